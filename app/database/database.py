@@ -3,6 +3,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 from dotenv import load_dotenv
+from app.database.routing import BULK, POINT, RoutingSession
 load_dotenv(override=True)
 
 # Debug environment loading
@@ -17,22 +18,80 @@ POSTGRES_SERVER = os.getenv("DB_HOST")
 POSTGRES_PORT = os.getenv("DB_PORT", "5432")
 POSTGRES_DB = os.getenv("DB_DATABASE")
 
-# SQLAlchemy connection string
-SQLALCHEMY_DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}?sslmode=require"
-
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_size=5,
-    max_overflow=10,
-    pool_pre_ping=True,
-    pool_recycle=3600,
-    connect_args={
-        "sslmode": "require",
-        "connect_timeout": 30
-    }
+# SQLAlchemy connection string (DATABASE_URL override cho local stand-in database, vd. sqlite trong tests)
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL") or \
+    f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}?sslmode=require"
+
+# Read replica (optional) cho bulk loaders + point lookups; không set -> đọc từ primary
+DB_REPLICA_URL = os.getenv("DB_REPLICA_URL")
+
+# Pool + statement timeout riêng cho từng loại query, để full-table scans không chiếm hết connections
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+DB_POINT_POOL_SIZE = int(os.getenv("DB_POINT_POOL_SIZE", "5"))
+DB_POINT_MAX_OVERFLOW = int(os.getenv("DB_POINT_MAX_OVERFLOW", "10"))
+DB_POINT_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_POINT_STATEMENT_TIMEOUT_MS", "2000"))
+DB_BULK_POOL_SIZE = int(os.getenv("DB_BULK_POOL_SIZE", "2"))
+DB_BULK_MAX_OVERFLOW = int(os.getenv("DB_BULK_MAX_OVERFLOW", "2"))
+DB_BULK_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_BULK_STATEMENT_TIMEOUT_MS", "60000"))
+
+
+def _is_postgres(url: str) -> bool:
+    return url.startswith("postgresql")
+
+
+def make_engine(url: str, pool_size: int, max_overflow: int, statement_timeout_ms: int = 0, read_only: bool = False):
+    """Engine với pool riêng; với Postgres set statement_timeout / read-only qua connection options"""
+    if not _is_postgres(url):
+        return create_engine(url, connect_args={"check_same_thread": False} if url.startswith("sqlite") else {})
+
+    connect_args = {"connect_timeout": 30}
+    if "sslmode=require" in url:
+        connect_args["sslmode"] = "require"
+    options = []
+    if statement_timeout_ms > 0:
+        options.append(f"-c statement_timeout={statement_timeout_ms}")
+    if read_only:
+        options.append("-c default_transaction_read_only=on")
+    if options:
+        connect_args["options"] = " ".join(options)
+
+    return create_engine(
+        url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        connect_args=connect_args
+    )
+
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL, pool_size=5, max_overflow=10, statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS)
+
+READ_DATABASE_URL = DB_REPLICA_URL or SQLALCHEMY_DATABASE_URL
+if _is_postgres(READ_DATABASE_URL):
+    point_engine = make_engine(READ_DATABASE_URL, DB_POINT_POOL_SIZE, DB_POINT_MAX_OVERFLOW,
+                               DB_POINT_STATEMENT_TIMEOUT_MS, read_only=True)
+    bulk_engine = make_engine(READ_DATABASE_URL, DB_BULK_POOL_SIZE, DB_BULK_MAX_OVERFLOW,
+                              DB_BULK_STATEMENT_TIMEOUT_MS, read_only=True)
+elif DB_REPLICA_URL:
+    point_engine = bulk_engine = make_engine(DB_REPLICA_URL, 0, 0)
+else:
+    # Local stand-in (sqlite): một database duy nhất, mọi route dùng chung engine
+    point_engine = bulk_engine = engine
+
+SessionLocal = sessionmaker(
+    class_=RoutingSession,
+    autocommit=False,
+    autoflush=False,
+    bind=engine,
+    route_binds={BULK: bulk_engine, POINT: point_engine}
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def pool_status() -> dict:
+    """Connections đang checked out của từng pool (cho /metrics)"""
+    pools = {"primary": engine, "point": point_engine, "bulk": bulk_engine}
+    return {name: getattr(e.pool, "checkedout", lambda: 0)() for name, e in pools.items()}
 
 Base = declarative_base()
 metadata = MetaData()
@@ -0,0 +1,190 @@
+"""
+Query-plan checker cho các loader / point queries (annotate bằng app.database.routing.routed)
+
+Chạy các loaders thật của recommendation service một lần (với một sample user), capture mọi routed
+statement cùng params, rồi EXPLAIN từng statement và flag sequential scans trên các bảng lớn:
+- route POINT: seq scan trên bảng lớn là lỗi (index thiếu / regression)
+- route BULK:  seq scan là warning (full-table loaders có thể scan hợp lệ)
+
+Postgres dùng EXPLAIN (FORMAT JSON) + pg_class.reltuples; sqlite stand-in dùng EXPLAIN QUERY PLAN.
+
+    python -m app.database.plan_checker [--user-id <id>] [--min-rows 10000] [--strict]
+"""
+import argparse
+import json
+import re
+import sys
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.database.routing import POINT, routed
+
+PLAN_CHECK_MIN_ROWS = 10000
+
+_TABLE_ALIAS_RE = re.compile(r'(?:FROM|JOIN)\s+"?(\w+)"?(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+_SQL_KEYWORDS = {"on", "where", "join", "left", "right", "inner", "outer", "group", "order", "limit", "cross", "full"}
+
+
+@contextmanager
+def capture_routed_statements():
+    """Thu mọi statement có routing annotation (db_route) chạy trong block"""
+    captured: List[Dict] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        route = context.execution_options.get("db_route") if context is not None else None
+        if route is not None:
+            captured.append({'route': route, 'statement': statement, 'parameters': parameters})
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield captured
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+
+
+def _sample_user_id(db: Session) -> Optional[str]:
+    row = db.execute(text('SELECT user_id FROM "Survey_Attempts" ORDER BY completed_at DESC LIMIT 1')).fetchone()
+    return str(row.user_id) if row else None
+
+
+def capture_loader_queries(db: Session, user_id: Optional[str] = None) -> List[Dict]:
+    """Chạy mọi loader một lần và trả về các routed statements (unique theo SQL)"""
+    from app.service.catalog import get_catalog_version
+    from app.service.change_feed import ChangeFeed
+    from app.service.data_version import get_user_data_version
+    from app.service.latest_survey import fetch_latest_survey
+    from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
+    from app.service.segment_index import build_segment_index, poll_segment_index
+
+    user_id = user_id or _sample_user_id(db) or "00000000-0000-0000-0000-000000000000"
+    recommender = CRAFFTASSISTRecommendationSystem(db)
+    recommender.interaction_snapshot = None  # luôn đi qua SQL path
+    feed = ChangeFeed(rebuild_catalog=lambda session: None)
+
+    loaders = [
+        recommender.get_user_survey_data,
+        recommender.get_courses_data,
+        recommender.get_consultants_data,
+        recommender.get_user_interactions,
+        lambda: recommender.get_user_interactions_by_user(user_id),
+        lambda: fetch_latest_survey(db, user_id),
+        lambda: get_user_data_version(db, user_id),
+        lambda: get_catalog_version(db),
+        lambda: poll_segment_index(db, build_segment_index(db)),
+        lambda: feed.poll(db),  # lần đầu: initial watermarks
+        lambda: feed.poll(db),  # change queries từ watermark
+    ]
+    with capture_routed_statements() as captured:
+        for loader in loaders:
+            try:
+                loader()
+            except Exception as e:
+                print(f"⚠️  Loader failed during plan capture: {str(e)}")
+                db.rollback()
+
+    unique: Dict[str, Dict] = {}
+    for query in captured:
+        unique.setdefault(query['statement'], query)
+    return list(unique.values())
+
+
+def _walk_postgres_plan(node: Dict, scans: List[str]) -> None:
+    if node.get("Node Type") == "Seq Scan" and node.get("Relation Name"):
+        scans.append(node["Relation Name"])
+    for child in node.get("Plans", []):
+        _walk_postgres_plan(child, scans)
+
+
+def _seq_scanned_tables(db: Session, route: str, statement: str, parameters) -> List[str]:
+    """Tên các bảng bị sequential scan trong plan của statement (EXPLAIN trên engine của route)"""
+    connection = db.connection(bind_arguments={'clause': routed("SELECT 1", route)})
+    if connection.dialect.name == "postgresql":
+        plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        scans: List[str] = []
+        _walk_postgres_plan(plan[0]["Plan"], scans)
+        return scans
+
+    # sqlite stand-in: "SCAN <alias>" (không có USING INDEX) là full scan
+    aliases = {}
+    for table, alias in _TABLE_ALIAS_RE.findall(statement):
+        aliases[table] = table
+        if alias and alias.lower() not in _SQL_KEYWORDS:
+            aliases[alias] = table
+    scans = []
+    for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall():
+        detail = row[-1]
+        if detail.startswith("SCAN ") and "USING" not in detail:
+            name = detail.split()[-1] if not detail.startswith("SCAN TABLE ") else detail.split()[2]
+            if name in aliases:
+                scans.append(aliases[name])
+    return scans
+
+
+def _table_rows(db: Session, table: str, cache: Dict[str, int]) -> int:
+    if table not in cache:
+        if db.get_bind().dialect.name == "postgresql":
+            row = db.execute(text("SELECT reltuples::bigint FROM pg_class WHERE relname = :table"), {'table': table}).fetchone()
+            cache[table] = int(row[0]) if row and row[0] is not None else 0
+        else:
+            cache[table] = int(db.execute(text(f'SELECT COUNT(*) FROM "{table}"')).scalar())
+    return cache[table]
+
+
+def check_query_plans(db: Session, queries: List[Dict], min_rows: int = PLAN_CHECK_MIN_ROWS) -> List[Dict]:
+    """EXPLAIN từng query, trả về findings cho seq scans trên bảng có >= min_rows rows"""
+    findings = []
+    table_rows: Dict[str, int] = {}
+    for query in queries:
+        try:
+            tables = _seq_scanned_tables(db, query['route'], query['statement'], query['parameters'])
+        except Exception as e:
+            print(f"⚠️  EXPLAIN failed: {str(e)}")
+            db.rollback()
+            continue
+        for table in sorted(set(tables)):
+            rows = _table_rows(db, table, table_rows)
+            if rows < min_rows:
+                continue
+            findings.append({
+                'severity': 'error' if query['route'] == POINT else 'warning',
+                'route': query['route'],
+                'table': table,
+                'table_rows': rows,
+                'query': " ".join(query['statement'].split())[:160]
+            })
+    return findings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Flag sequential scans in recommendation loader query plans")
+    parser.add_argument("--user-id", help="Sample user cho point queries (mặc định: user có survey mới nhất)")
+    parser.add_argument("--min-rows", type=int, default=PLAN_CHECK_MIN_ROWS, help="Chỉ flag bảng có ít nhất từng này rows")
+    parser.add_argument("--strict", action="store_true", help="Warnings (bulk seq scans) cũng làm fail")
+    args = parser.parse_args(argv)
+
+    from app.database.database import SessionLocal
+    db = SessionLocal()
+    try:
+        queries = capture_loader_queries(db, args.user_id)
+        findings = check_query_plans(db, queries, args.min_rows)
+    finally:
+        db.close()
+
+    print(f"🔍 Checked {len(queries)} loader queries")
+    for finding in findings:
+        icon = "❌" if finding['severity'] == 'error' else "⚠️ "
+        print(f"{icon} [{finding['route']}] Seq Scan on {finding['table']} ({finding['table_rows']} rows): {finding['query']}")
+    failed = [f for f in findings if f['severity'] == 'error' or args.strict]
+    if not findings:
+        print("✅ No sequential scans on large tables")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
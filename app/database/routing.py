@@ -0,0 +1,39 @@
+"""
+Routing cho read queries: bulk analytic loaders vs point lookups
+
+Mỗi query đọc được annotate bằng routed(sql, BULK | POINT) (execution option db_route). RoutingSession
+gửi query tới engine của route đó (replica / pool riêng, statement timeout riêng); query không annotate
+(và mọi write) vẫn đi engine chính của session.
+
+Module này không tạo engine nào, nên services import được mà không cần kết nối database.
+"""
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import TextClause
+
+BULK = "bulk"    # full-table scans: survey/course/consultant/interaction loaders, index builds
+POINT = "point"  # per-user / single-row reads: latest survey, version tokens, user slices
+
+
+def routed(sql: str, route: str) -> TextClause:
+    """text(sql) kèm routing annotation"""
+    return text(sql).execution_options(db_route=route)
+
+
+class RoutingSession(Session):
+    """Session chọn engine theo execution option db_route của statement"""
+
+    def __init__(self, *args, route_binds: Optional[Dict[str, Engine]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.route_binds = route_binds or {}
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if clause is not None and self.route_binds:
+            route = clause.get_execution_options().get("db_route")
+            engine = self.route_binds.get(route)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
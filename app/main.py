@@ -1,6 +1,19 @@
-from fastapi import FastAPI
+import time
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.database.database import engine, Base, get_db
+from fastapi.responses import PlainTextResponse
+from app.database.database import engine, Base, get_db, pool_status, SessionLocal
+from app.service.candidates import candidate_index_stats
+from app.service.change_feed import CHANGE_FEED_POLL_SECONDS, ChangeFeedRefresher, change_feed
+from app.service.explanation_store import explanation_store
+from app.service.metrics import REQUEST_SECONDS, registry, render_metrics
+from app.service.interaction_state import interaction_state_stats
+from app.service.latest_survey import latest_survey_cache
+from app.service.model_store import model_store_stats
+from app.service.ranked_lists import ranked_lists
+from app.service.result_cache import recommendation_result_cache, result_refresher
+from app.service.single_flight import recommendation_flight
+from app.service.stage_graph import stage_costs
 
 # FastAPI app
 app = FastAPI(
@@ -24,9 +37,59 @@ app.add_middleware(
 # Include routers
 from app.routes.recommendation_routes import router as recommendation_router
 from app.routes.recognize_toxic_chat import router as toxic_chat_router
+from app.routes.event_routes import router as event_router
 
 app.include_router(recommendation_router)
 app.include_router(toxic_chat_router)
+app.include_router(event_router)
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else "unmatched"
+    REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, request.method, str(response.status_code))
+    return response
+
+registry.register_gauge("single_flight_calls", "Single-flight coalescing counters", recommendation_flight.stats)
+registry.register_gauge("latest_survey_cache", "Latest survey LRU cache stats", latest_survey_cache.stats)
+registry.register_gauge("db_pool_checked_out", "Checked-out connections per database pool", pool_status, labelname="pool")
+registry.register_gauge("interaction_state", "In-memory interaction state (base + event overlay)", interaction_state_stats)
+registry.register_gauge("change_feed", "Watermark change feed counters", change_feed.stats)
+registry.register_gauge("stage_expected_seconds", "EWMA run time per recommendation stage (deadline planning)", stage_costs, labelname="stage")
+registry.register_gauge("candidate_index", "Two-stage course candidate index", candidate_index_stats)
+registry.register_gauge("recommendation_result_cache", "Per-user hybrid result cache (hit rate, bytes)", recommendation_result_cache.stats)
+registry.register_gauge("result_refresher", "Stale-while-revalidate background refreshes", result_refresher.stats)
+registry.register_gauge("ranked_lists", "Cached deep ranked lists behind pagination cursors", ranked_lists.stats)
+registry.register_gauge("explanation_store", "Captured recommendation explanations (TTL store)", explanation_store.stats)
+registry.register_gauge("model_store_mapped_bytes", "Bytes mapped from the shared model store", model_store_stats, labelname="model")
+
+change_feed_refresher = ChangeFeedRefresher(change_feed, SessionLocal)
+
+@app.on_event("startup")
+def start_change_feed():
+    # CHANGE_FEED_POLL_SECONDS=0 tắt refresher (datasets khi đó chỉ reload theo max age)
+    if CHANGE_FEED_POLL_SECONDS > 0:
+        change_feed_refresher.start()
+
+@app.on_event("startup")
+def start_result_refresher():
+    # Refresh entries stale của result cache ở background (RESULT_CACHE_MAX_STALE_SECONDS=0 tắt)
+    result_refresher.start(SessionLocal)
+
+@app.on_event("shutdown")
+def stop_change_feed():
+    change_feed_refresher.stop()
+
+@app.on_event("shutdown")
+def stop_result_refresher():
+    result_refresher.stop()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text format: per-stage latency histograms, request latency, cache counters"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,80 @@
+from datetime import datetime
+import hmac
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from app.database.database import get_db
+from app.service.event_ingestion import ingest_appointment_status, ingest_enrollment_progress, ingest_survey_completed
+
+EVENTS_TOKEN = os.getenv("EVENTS_TOKEN", "")
+
+
+def verify_events_token(x_events_token: Optional[str] = Header(None)):
+    """Chỉ backend có EVENTS_TOKEN mới gửi events được (không set env -> events tắt hoàn toàn)"""
+    if not EVENTS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Event ingestion is disabled")
+    if not hmac.compare_digest(x_events_token or "", EVENTS_TOKEN):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid events token")
+
+
+router = APIRouter(prefix="/events", tags=["events"], dependencies=[Depends(verify_events_token)])
+
+
+class EnrollmentProgressEvent(BaseModel):
+    user_id: str
+    course_id: str
+    progress_percentage: float
+    enrollment_date: Optional[datetime] = None
+
+
+class AppointmentStatusEvent(BaseModel):
+    user_id: str
+    consultant_id: str  # user id của consultant (Appointments."consultantId")
+    status: str
+    booking_time: Optional[datetime] = None
+
+
+class SurveyCompletedEvent(BaseModel):
+    user_id: str
+    test_survey_id: str
+    total_score: Optional[int] = None
+    risk_level: str
+    category_id: Optional[str] = None
+    completed_at: Optional[datetime] = None
+
+
+@router.post("/enrollment-progress")
+def enrollment_progress(event: EnrollmentProgressEvent):
+    """
+    Enrollment mới / progress thay đổi -> cập nhật interaction state của user
+    """
+    return ingest_enrollment_progress(event.user_id, event.course_id, event.progress_percentage, event.enrollment_date)
+
+
+@router.post("/appointment-status")
+def appointment_status(event: AppointmentStatusEvent):
+    """
+    Appointment mới / đổi status -> cập nhật interaction state của user
+    """
+    return ingest_appointment_status(event.user_id, event.consultant_id, event.status, event.booking_time)
+
+
+@router.post("/survey-completed")
+def survey_completed(event: SurveyCompletedEvent, db: Session = Depends(get_db)):
+    """
+    User hoàn thành survey -> cập nhật latest risk + segment membership
+    """
+    try:
+        return ingest_survey_completed(
+            db, event.user_id, event.test_survey_id, event.total_score, event.risk_level,
+            event.category_id, event.completed_at
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error ingesting survey event: {str(e)}"
+        )
@@ -1,11 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status
 from sqlalchemy.orm import Session
 from typing import Dict, List, Optional
 from app.database.database import get_db
 from app.service.recommendation_action import get_user_recommendations
+from app.service.data_version import (cache_headers, compute_recommendation_etag, etag_matches,
+                                      get_recommendation_versions)
+from app.service.single_flight import recommendation_flight
+from app.service.ranked_lists import InvalidCursorError, paginate
+from app.service.metrics import set_endpoint
+from app.service.profiling import ProfilingRoute, profiling_flag
 from pydantic import BaseModel
 
-router = APIRouter(prefix="/recommendations", tags=["recommendations"])
+async def tag_metrics_endpoint(request: Request):
+    """Tag mọi pipeline stage trong request với route template (không phải path có user_id)"""
+    route = request.scope.get("route")
+    set_endpoint(route.path if route is not None else request.url.path)
+
+router = APIRouter(
+    prefix="/recommendations",
+    tags=["recommendations"],
+    dependencies=[Depends(tag_metrics_endpoint), Depends(profiling_flag)],
+    route_class=ProfilingRoute
+)
 
 class RecommendationRequest(BaseModel):
     user_id: str
@@ -82,21 +98,39 @@ def get_recommendations(
 @router.get("/{user_id}")
 def get_user_recommendations_by_id(
     user_id: str,
+    response: Response,
     test_survey_id: str = "",       # query param
     total_score: int = 0,           # query param
     risk_level: str = "",           # query param
+    deadline_ms: Optional[int] = None,  # query param, budget của client (mặc định RECOMMENDATION_DEADLINE_MS)
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
     """
     Lấy recommendations cho user theo user_id (không cần request body)
+    Hỗ trợ conditional GET: ETag theo data version của user + catalog, If-None-Match -> 304
+    Với deadline_ms, stages đắt bị bỏ qua khi không kịp; kết quả thiếu stage ('skipped_stages') không có ETag
     """
     try:
-        result = get_user_recommendations(
-            user_id=user_id,
-            test_survey_id=test_survey_id,
-            total_score=total_score,
-            risk_level=risk_level,
-            db=db
+        # Versions đọc một lần, dùng chung cho ETag và result cache (cùng một snapshot)
+        versions = get_recommendation_versions(db, user_id)
+        etag = compute_recommendation_etag(db, user_id, "hybrid", test_survey_id, total_score, risk_level,
+                                           versions=versions)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag))
+        
+        # Requests đồng thời giống hệt nhau dùng chung một lần tính
+        result = recommendation_flight.do(
+            ("hybrid", user_id, test_survey_id, total_score, risk_level, deadline_ms),
+            lambda: get_user_recommendations(
+                user_id=user_id,
+                test_survey_id=test_survey_id,
+                total_score=total_score,
+                risk_level=risk_level,
+                db=db,
+                deadline_ms=deadline_ms,
+                versions=versions
+            )
         )
         
         if result['status'] == 'error':
@@ -105,6 +139,8 @@ def get_user_recommendations_by_id(
                 detail=result['message']
             )
         
+        if etag and not result.get('skipped_stages'):
+            response.headers.update(cache_headers(etag))
         return result
         
     except HTTPException:
@@ -118,23 +154,50 @@ def get_user_recommendations_by_id(
 @router.get("/{user_id}/courses")
 def get_course_recommendations_only(
     user_id: str,
+    response: Response,
     top_k: int = 5,
+    pipeline: str = "content",      # query param: content | two_stage
+    cursor: Optional[str] = None,   # query param: next_cursor của trang trước
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
     """
-    Chỉ lấy course recommendations
+    Chỉ lấy course recommendations (hỗ trợ ETag / If-None-Match như GET /{user_id})
+    pipeline=two_stage: candidate generators + ranker (content + collaborative + business rules)
+    Phân trang: top_k là kích thước trang, next_cursor lấy trang tiếp theo (slice của ranked list đã cache)
     """
+    if pipeline not in ("content", "two_stage"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown course pipeline: {pipeline} (expected content or two_stage)"
+        )
     try:
         from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
         
-        recommender = CRAFFTASSISTRecommendationSystem(db)
-        courses = recommender.content_based_course_recommendations(user_id, top_k)
+        etag = compute_recommendation_etag(db, user_id, "courses", top_k, pipeline, cursor or "")
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag))
+        
+        def compute(k: int):
+            recommender = CRAFFTASSISTRecommendationSystem(db)
+            if pipeline == "two_stage":
+                return recommender.two_stage_course_recommendations(user_id, k)
+            return recommender.content_based_course_recommendations(user_id, k)
         
+        page = paginate(user_id, "courses", (pipeline,), top_k, cursor,
+                        lambda k: recommendation_flight.do(("courses", user_id, k, pipeline), lambda: compute(k)))
+        courses = page['items']
+        
+        if etag:
+            response.headers.update(cache_headers(etag))
         return {
             "courses": courses,
-            "total": len(courses)
+            "total": len(courses),
+            "next_cursor": page['next_cursor']
         }
         
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -145,22 +208,29 @@ def get_course_recommendations_only(
 def get_consultant_recommendations_only(
     user_id: str,
     top_k: int = 3,
+    cursor: Optional[str] = None,   # query param: next_cursor của trang trước
     db: Session = Depends(get_db)
 ):
     """
-    Chỉ lấy consultant recommendations
+    Chỉ lấy consultant recommendations (phân trang bằng cursor như /{user_id}/courses)
     """
     try:
         from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
         
-        recommender = CRAFFTASSISTRecommendationSystem(db)
-        consultants = recommender.content_based_consultant_recommendations(user_id, top_k)
+        page = paginate(user_id, "consultants", (), top_k, cursor, lambda k: recommendation_flight.do(
+            ("consultants", user_id, k),
+            lambda: CRAFFTASSISTRecommendationSystem(db).content_based_consultant_recommendations(user_id, k)
+        ))
+        consultants = page['items']
         
         return {
             "consultants": consultants,
-            "total": len(consultants)
+            "total": len(consultants),
+            "next_cursor": page['next_cursor']
         }
         
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -171,16 +241,20 @@ def get_consultant_recommendations_only(
 def get_collaborative_recommendations(
     user_id: str,
     top_k: int = 5,
+    engine: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
     Enhanced collaborative filtering recommendations (courses + consultants)
+    engine: 'neighborhood' hoặc 'als' (mặc định COLLABORATIVE_ENGINE)
     """
+    if engine is not None and engine not in ('neighborhood', 'als'):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="engine must be 'neighborhood' or 'als'")
     try:
         from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
         
         recommender = CRAFFTASSISTRecommendationSystem(db)
-        result = recommender.collaborative_filtering_recommendations(user_id, top_k)
+        result = recommender.collaborative_filtering_recommendations(user_id, top_k, engine)
         
         return result
         
@@ -224,52 +298,36 @@ def calculate_risk_from_score(
 @router.get("/{user_id}/recommendation-explanation")
 def get_recommendation_explanation(
     user_id: str,
+    recommendation_id: str = "",    # query param, mặc định kết quả mới nhất của user
     db: Session = Depends(get_db)
 ):
     """
     Giải thích tại sao user được recommend những courses/consultants này
+    Explanation được ghi lại lúc hybrid scoring. recommendation_id không còn trong store (hết hạn / bị đẩy ra) -> 404,
+    không giải thích một kết quả khác; kết quả mới nhất thì được tính lại như GET /{user_id} (cùng top_k)
     """
     try:
-        from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
-        
-        recommender = CRAFFTASSISTRecommendationSystem(db)
-        recommendations = recommender.hybrid_recommendations(user_id, top_k=5)
+        from app.service.explanation_store import explanation_store
         
-        # Tạo explanation chi tiết
-        explanation = {
-            "user_id": user_id,
-            "risk_info": recommendations.get('user_risk_info', {}),
-            "recommendation_breakdown": recommendations.get('recommendation_summary', {}),
-            "course_explanations": [],
-            "consultant_explanations": []
-        }
-        
-        # Explain courses
-        for course in recommendations.get('courses', []):
-            explanation["course_explanations"].append({
-                "course_title": course['title'],
-                "score": course.get('hybrid_score', course.get('score', 0)),
-                "type": course['recommendation_type'],
-                "reason": course.get('reason', 'No specific reason'),
-                "factors": {
-                    "content_based_score": course.get('score', 0) if course['recommendation_type'] in ['content_based', 'hybrid'] else 0,
-                    "collaborative_score": course.get('collaborative_score', 0) if course['recommendation_type'] in ['collaborative', 'hybrid'] else 0,
-                    "difficulty_match": course.get('difficulty_level', ''),
-                    "target_audience_match": True  # Could be calculated
-                }
-            })
+        explanation = explanation_store.get(user_id, recommendation_id or None)
+        if explanation is not None:
+            return {**explanation, "cached": True}
+        if recommendation_id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Recommendation {recommendation_id} not found or expired"
+            )
         
-        # Explain consultants
-        for consultant in recommendations.get('consultants', []):
-            explanation["consultant_explanations"].append({
-                "consultant_name": consultant['name'],
-                "score": consultant['score'],
-                "specialization": consultant['specialization'],
-                "reason": f"Specialization matches your {recommendations.get('user_risk_info', {}).get('latest_risk_level', 'MEDIUM')} risk level"
-            })
+        from app.service.recommendation_action import compute_user_recommendations
         
-        return explanation
+        recommendations = compute_user_recommendations(user_id, db, 0)
+        explanation = explanation_store.get(user_id, recommendations.get('recommendation_id'))
+        if explanation is None:
+            raise ValueError(recommendations.get('message', 'No recommendations to explain'))
+        return {**explanation, "cached": False}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -287,8 +345,10 @@ def get_user_risk_summary(
     try:
         from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
         
-        recommender = CRAFFTASSISTRecommendationSystem(db)
-        risk_summary = recommender.get_user_risk_summary(user_id)
+        risk_summary = recommendation_flight.do(
+            ("risk-summary", user_id),
+            lambda: CRAFFTASSISTRecommendationSystem(db).get_user_risk_summary(user_id)
+        )
         
         return risk_summary
         
@@ -310,26 +370,32 @@ def demo_full_recommendation_system(
         from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
         
         recommender = CRAFFTASSISTRecommendationSystem(db)
+        # Một executor cho cả request: hybrid (tính trước, inputs top 20) cung cấp luôn content-based,
+        # collaborative và consultants top 3-5 bằng cách cắt prefix, mỗi stage chỉ tính một lần
+        executor = recommender.stage_executor(user_id)
         
         print(f"🔍 Demoing full recommendation system for user: {user_id}")
-        # 1. Lấy user risk info
-        risk_info = recommender.get_user_risk_summary(user_id)
+        # 1. Hybrid recommendations
+        hybrid_result = recommender.hybrid_recommendations(user_id, 10, executor=executor)
+        print(f"Hybrid recommendations: {len(hybrid_result.get('courses', []))} courses, {len(hybrid_result.get('consultants', []))} consultants")
+        
+        # 2. Lấy user risk info
+        risk_info = executor.run('risk_summary')
         print(f"User {user_id} risk summary: {risk_info}")
         
-        # 2. Content-based recommendations
-        content_courses = recommender.content_based_course_recommendations(user_id, 5)
+        # 3. Content-based recommendations
+        content_courses = executor.run('content_courses', 5)
         print(f"Content-based course recommendations: {len(content_courses)} found")
         
-        # 3. Collaborative filtering recommendations  
-        collab_courses = recommender.collaborative_filtering_recommendations(user_id, 5)
+        # 4. Collaborative filtering recommendations  
+        # Stage collaborative trả về cả courses lẫn consultants -> chỉ lấy courses (giống stage hybrid)
+        collab_courses = (executor.run('collaborative', 5) or {}).get('courses', [])
         print(f"Collaborative filtering course recommendations: {len(collab_courses)} found")
         
-        # 4. Consultant recommendations
-        consultants = recommender.content_based_consultant_recommendations(user_id, 3)
+        # 5. Consultant recommendations
+        consultants = executor.run('content_consultants', 3)
         print(f"Consultant recommendations: {len(consultants)} found")
-        # 5. Hybrid recommendations
-        hybrid_result = recommender.hybrid_recommendations(user_id, 10)
-        print(f"Hybrid recommendations: {len(hybrid_result.get('courses', []))} courses, {len(hybrid_result.get('consultants', []))} consultants")
+        print(f"Stage graph: {executor.stats()}")
         
         return {
             "demo_title": "CRAFFT/ASSIST Recommendation System Demo",
@@ -375,6 +441,13 @@ def demo_full_recommendation_system(
             detail=f"Demo error: {str(e)}"
         )
 
+@router.get("/data/single-flight-stats")
+def get_single_flight_stats():
+    """
+    Thống kê coalescing: số lần tính (leaders) và số requests trùng đã dùng chung kết quả (coalesced)
+    """
+    return recommendation_flight.stats()
+
 @router.get("/data/user-surveys")
 def get_all_user_survey_data(
     db: Session = Depends(get_db)
@@ -553,18 +626,8 @@ def get_user_interactions_by_id(
         from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
         
         recommender = CRAFFTASSISTRecommendationSystem(db)
-        interactions_df = recommender.get_user_interactions()
-        
-        if interactions_df.empty:
-            return {
-                "message": f"No interaction data found for user {user_id}",
-                "user_id": user_id,
-                "data": [],
-                "total_interactions": 0
-            }
-        
-        # Filter cho user cụ thể
-        user_interactions = interactions_df[interactions_df['user_id'] == user_id]
+        # Chỉ lấy slice của user này (index theo user_id), không load toàn bộ interactions
+        user_interactions = recommender.get_user_interactions_by_user(user_id)
         
         if user_interactions.empty:
             return {
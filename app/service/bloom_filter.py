@@ -0,0 +1,71 @@
+"""
+Bloom filter cho membership của ids (vd. users đã có interactions)
+
+Không có false negative: `id not in filter` chắc chắn đúng, nên dùng được để bỏ qua công việc cho ids
+chưa từng thấy mà không cần đọc dữ liệu. False positive (tỉ lệ ~fp_rate khi số ids <= capacity) chỉ
+làm caller chạy đường bình thường. Bits là numpy uint8 array; hash blake2b 128 bit (hai hash 64 bit).
+"""
+import hashlib
+import math
+from typing import Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+_UINT64_MASK = (1 << 64) - 1
+
+
+def _hash_pair(id_) -> Tuple[int, int]:
+    digest = hashlib.blake2b(str(id_).encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class BloomFilter:
+    """Bit array m bits, k vị trí mỗi id theo double hashing h1 + i * h2"""
+
+    def __init__(self, capacity: int, fp_rate: float = 0.01):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.num_bits = max(64, int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.added = 0
+
+    @classmethod
+    def from_ids(cls, ids: Iterable, fp_rate: float = 0.01, headroom: float = 2.0,
+                 min_capacity: int = 1024) -> "BloomFilter":
+        """Filter chứa ids, capacity = headroom x số ids (chỗ cho ids thêm sau qua add)"""
+        ids = pd.unique(np.asarray(list(ids), dtype=object).astype(str))
+        bloom = cls(max(int(len(ids) * headroom), min_capacity), fp_rate)
+        bloom.add_many(ids)
+        return bloom
+
+    def _positions(self, ids) -> np.ndarray:
+        """(len(ids), num_hashes) vị trí bit"""
+        pairs = np.array([_hash_pair(id_) for id_ in ids], dtype=np.uint64).reshape(-1, 2)
+        rounds = np.arange(self.num_hashes, dtype=np.uint64)
+        return (pairs[:, :1] + rounds[None, :] * pairs[:, 1:]) % np.uint64(self.num_bits)
+
+    def add_many(self, ids) -> None:
+        if len(ids) == 0:
+            return
+        positions = self._positions(ids).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+        self.added += len(ids)
+
+    def add(self, id_) -> None:
+        self.add_many([id_])
+
+    def __contains__(self, id_) -> bool:
+        first, second = _hash_pair(id_)
+        for i in range(self.num_hashes):
+            position = ((first + i * second) & _UINT64_MASK) % self.num_bits  # cùng phép tính uint64 như build
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.bits.nbytes)
@@ -0,0 +1,333 @@
+"""
+Two-stage course recommendations: candidate generation rẻ + ranking vector hoá trên candidates
+
+Stage 1 - các generators (đăng ký bằng register_candidate_generator) mỗi cái trả về tối đa
+CANDIDATES_PER_GENERATOR course positions (index trong catalog.course_records):
+- content_top_n:      top-N content score (TF-IDF similarity x audience boost) theo (risk level, user types),
+                      dựng lười một lần mỗi key
+- segment_popularity: courses được nhiều users cùng (risk level, category) thích nhất, dựng lười mỗi segment
+- item_neighbors:     neighbors item-item (cosine trên users) của các courses user đã học
+Stage 2 - rank_candidates chỉ tính signals cho hợp các candidates: content score, collaborative
+(item-item từ lịch sử của user, hoặc độ phổ biến trong segment khi user chưa có lịch sử) và business
+rule boosts, rồi gộp bằng score_fusion.fuse_scores với HYBRID weights.
+
+Mọi thứ phụ thuộc catalog / toàn bộ interactions nằm trong CourseCandidateIndex (build một lần, dùng chung
+trong process). Chi phí mỗi request tỉ lệ với số candidates (và số courses user đã học), không với số
+courses hay số users.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from app.service.catalog import RecommendationCatalog
+from app.service.collaborative_scoring import UserItemMatrix, top_k_indices
+from app.service.content_model import CourseContentModel
+from app.service.score_fusion import EngineScores, fuse_scores
+
+CANDIDATES_PER_GENERATOR = int(os.getenv("CANDIDATES_PER_GENERATOR", "200"))
+CANDIDATE_ITEM_NEIGHBORS = int(os.getenv("CANDIDATE_ITEM_NEIGHBORS", "50"))
+# Interactions đổi liên tục (events): index chỉ được build lại tối đa một lần mỗi khoảng này
+CANDIDATE_INDEX_REFRESH_SECONDS = float(os.getenv("CANDIDATE_INDEX_REFRESH_SECONDS", "300"))
+
+AUDIENCE_BOOST = 1.2      # giống content_based_course_recommendations
+LIKED_RATING = 0.4        # rating threshold của collaborative course filtering
+
+
+class CandidateContext(NamedTuple):
+    user_id: str
+    risk_level: str
+    category_id: Optional[str]
+    user_types: Tuple[str, ...]
+    seen: np.ndarray          # course positions user đã học
+    seen_ratings: np.ndarray  # max rating của user cho mỗi seen course
+    segment_users: Callable[[], np.ndarray]
+
+
+class CourseCandidateIndex:
+    """Arrays dùng chung cho candidate generators + ranker, theo thứ tự catalog.course_records"""
+
+    def __init__(self, catalog: RecommendationCatalog, content_model: CourseContentModel,
+                 interactions_df: pd.DataFrame, neighbors: int = CANDIDATE_ITEM_NEIGHBORS,
+                 interactions_version: Optional[Hashable] = None):
+        self.catalog = catalog
+        self.content_version = content_model.version
+        self.interactions_version = interactions_version
+        self.built_at = time.time()
+        self.num_courses = len(catalog.course_records)
+        self.target_audience = catalog.courses_df['target_audience'].to_numpy(dtype=object)
+        self._risk_rows = {risk: row for row, risk in enumerate(content_model.risk_levels)}
+        # TF-IDF rows và profiles đều đã L2-normalize -> dot product = cosine similarity
+        self.content_scores = np.asarray(sp.csr_matrix(content_model.tfidf_matrix).dot(
+            np.asarray(content_model.profile_matrix, dtype=np.float64).T
+        )).T
+        self._lock = threading.Lock()
+        self._content_top: Dict[Tuple, Tuple[np.ndarray, np.ndarray]] = {}
+        self._segment_popularity: Dict[Tuple, Tuple[int, np.ndarray, np.ndarray]] = {}
+        self._build_interactions(interactions_df, neighbors)
+
+    def _build_interactions(self, interactions_df: pd.DataFrame, neighbors: int) -> None:
+        courses = interactions_df[interactions_df['item_type'] == 'course'] if not interactions_df.empty else interactions_df
+        positions = np.zeros(0, dtype=np.int64)
+        if not courses.empty:
+            matrix = UserItemMatrix(courses)
+            positions = np.array([self.catalog.course_index.get(str(item_id), -1) for item_id in matrix.item_ids], dtype=np.int64)
+        if courses.empty or not (positions >= 0).any():
+            self.user_ids = pd.Index([])
+            self.liked = sp.csr_matrix((0, self.num_courses))
+            self.item_neighbors = sp.csr_matrix((self.num_courses, self.num_courses))
+            return
+
+        # Users x catalog courses (bỏ courses không còn trong catalog)
+        keep = np.flatnonzero(positions >= 0)
+        remap = sp.csr_matrix((np.ones(len(keep)), (keep, positions[keep])), shape=(len(positions), self.num_courses))
+        ratings = sp.csr_matrix(matrix.ratings.dot(remap))
+        self.user_ids = matrix.user_ids
+        self.liked = sp.csr_matrix(sp.csr_matrix(matrix.max_ratings.dot(remap)) >= LIKED_RATING, dtype=np.float64)
+
+        # Item-item cosine (trên mean ratings), giữ top `neighbors` mỗi course
+        norms = np.sqrt(np.asarray(ratings.multiply(ratings).sum(axis=0)).ravel())
+        normalized = sp.csr_matrix(ratings.multiply(1.0 / np.where(norms > 0, norms, 1.0)))
+        similarity = sp.csr_matrix(normalized.T.dot(normalized))
+        similarity.setdiag(0)
+        similarity.eliminate_zeros()
+        rows, cols, values = [], [], []
+        for course in range(self.num_courses):
+            start, end = similarity.indptr[course], similarity.indptr[course + 1]
+            if start == end:
+                continue
+            chosen = top_k_indices(similarity.data[start:end], neighbors)
+            rows.append(np.full(len(chosen), course))
+            cols.append(similarity.indices[start:end][chosen])
+            values.append(similarity.data[start:end][chosen])
+        if rows:
+            self.item_neighbors = sp.csr_matrix(
+                (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+                shape=(self.num_courses, self.num_courses)
+            )
+        else:
+            self.item_neighbors = sp.csr_matrix((self.num_courses, self.num_courses))
+
+    def risk_row(self, risk_level: str) -> int:
+        return self._risk_rows.get(risk_level, self._risk_rows['medium'])
+
+    def audience_boost(self, positions: np.ndarray, user_types: Sequence[str]) -> np.ndarray:
+        matched = np.isin(self.target_audience[positions], list(user_types) + ['all'])
+        return np.where(matched, AUDIENCE_BOOST, 1.0)
+
+    def content_top(self, risk_level: str, user_types: Sequence[str], n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(positions, content scores) top-n theo content score đã boost, cache theo (risk row, user types)"""
+        key = (self.risk_row(risk_level), tuple(user_types))
+        with self._lock:
+            cached = self._content_top.get(key)
+        if cached is None or len(cached[0]) < min(n, self.num_courses):
+            all_positions = np.arange(self.num_courses)
+            scores = self.content_scores[key[0]] * self.audience_boost(all_positions, user_types)
+            chosen = top_k_indices(scores, n)
+            cached = (chosen, scores[chosen])
+            with self._lock:
+                self._content_top[key] = cached
+        return cached[0][:n], cached[1][:n]
+
+    def segment_popularity(self, risk_level: str, category_id: Optional[str],
+                           segment_users: Callable[[], np.ndarray], n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(positions, tỉ lệ users trong segment thích course) top-n, cache theo segment"""
+        key = (risk_level, category_id)
+        with self._lock:
+            cached = self._segment_popularity.get(key)
+        # cached = (n đã tính, positions, shares); segment có ít courses được thích hơn n vẫn là cache hit
+        if cached is None or cached[0] < n:
+            user_rows = self.user_ids.get_indexer(list(segment_users()))
+            user_rows = user_rows[user_rows >= 0]
+            if len(user_rows) == 0:
+                cached = (n, np.zeros(0, dtype=np.int64), np.zeros(0))
+            else:
+                share = np.asarray(self.liked[user_rows].sum(axis=0)).ravel() / len(user_rows)
+                candidates = np.flatnonzero(share > 0)
+                chosen = candidates[top_k_indices(share[candidates], n)]
+                cached = (n, chosen, share[chosen])
+            with self._lock:
+                self._segment_popularity[key] = cached
+        return cached[1][:n], cached[2][:n]
+
+    def context(self, user_id: str, user_data: Dict, user_interactions: pd.DataFrame,
+                segment_users: Callable[[], np.ndarray]) -> CandidateContext:
+        seen: Dict[int, float] = {}
+        if not user_interactions.empty:
+            courses = user_interactions[user_interactions['item_type'] == 'course']
+            for item_id, rating in zip(courses['item_id'], courses['rating']):
+                position = self.catalog.course_index.get(str(item_id))
+                if position is not None:
+                    seen[position] = max(seen.get(position, 0.0), float(rating))
+        return CandidateContext(
+            user_id=str(user_id),
+            risk_level=user_data['risk_level'],
+            category_id=user_data.get('category_id'),
+            user_types=tuple(user_data.get('user_type', [])),
+            seen=np.fromiter(seen.keys(), dtype=np.int64, count=len(seen)),
+            seen_ratings=np.fromiter(seen.values(), dtype=np.float64, count=len(seen)),
+            segment_users=segment_users,
+        )
+
+    def item_neighbor_scores(self, context: CandidateContext, positions: np.ndarray) -> np.ndarray:
+        """Collaborative signal item-item: trung bình (theo rating của user) similarity tới các courses đã học"""
+        if len(positions) == 0 or context.seen_ratings.sum() <= 0:
+            return np.zeros(len(positions))
+        weights = context.seen_ratings
+        scores = np.asarray(self.item_neighbors[context.seen][:, positions].T.dot(weights)).ravel() / weights.sum()
+        return np.where(np.isin(positions, context.seen), 0.0, scores)
+
+
+CandidateGenerator = Callable[[CourseCandidateIndex, CandidateContext, int], np.ndarray]
+
+CANDIDATE_GENERATORS: Dict[str, CandidateGenerator] = {}
+
+
+def register_candidate_generator(name: str):
+    """Decorator: generator(index, context, n) -> course positions, được gọi cho mọi two-stage request"""
+    def decorator(generator: CandidateGenerator) -> CandidateGenerator:
+        CANDIDATE_GENERATORS[name] = generator
+        return generator
+    return decorator
+
+
+@register_candidate_generator("content_top_n")
+def content_top_n(index: CourseCandidateIndex, context: CandidateContext, n: int) -> np.ndarray:
+    positions, scores = index.content_top(context.risk_level, context.user_types, n)
+    return positions[scores > 0]
+
+
+@register_candidate_generator("segment_popularity")
+def segment_popularity(index: CourseCandidateIndex, context: CandidateContext, n: int) -> np.ndarray:
+    positions, _ = index.segment_popularity(context.risk_level, context.category_id, context.segment_users, n)
+    return positions
+
+
+@register_candidate_generator("item_neighbors")
+def item_neighbors(index: CourseCandidateIndex, context: CandidateContext, n: int) -> np.ndarray:
+    if len(context.seen) == 0:
+        return np.zeros(0, dtype=np.int64)
+    neighbors = index.item_neighbors[context.seen]
+    scores = np.asarray(neighbors.T.dot(context.seen_ratings)).ravel()
+    scores[context.seen] = 0.0
+    candidates = np.flatnonzero(scores > 0)
+    return candidates[top_k_indices(scores[candidates], n)]
+
+
+def generate_candidates(index: CourseCandidateIndex, context: CandidateContext,
+                        per_generator: int = CANDIDATES_PER_GENERATOR) -> Dict[str, np.ndarray]:
+    """Course positions của từng generator (lỗi của một generator không làm hỏng cả request)"""
+    results = {}
+    for name, generator in CANDIDATE_GENERATORS.items():
+        try:
+            results[name] = np.asarray(generator(index, context, per_generator), dtype=np.int64)
+        except Exception as e:
+            print(f"Error in candidate generator {name}: {str(e)}")
+            results[name] = np.zeros(0, dtype=np.int64)
+    return results
+
+
+def rank_candidates(index: CourseCandidateIndex, context: CandidateContext, candidates: Dict[str, np.ndarray],
+                    weights: Dict[str, float], top_k: int) -> List[Dict]:
+    """Score hợp các candidates bằng content + collaborative + boosts, gộp bằng fuse_scores"""
+    positions = np.unique(np.concatenate(list(candidates.values()))) if candidates else np.zeros(0, dtype=np.int64)
+    if len(positions) == 0:
+        return []
+
+    boost = index.audience_boost(positions, context.user_types)
+    content = index.content_scores[index.risk_row(context.risk_level), positions] * boost
+    if context.seen_ratings.sum() > 0:
+        collaborative = index.item_neighbor_scores(context, positions)
+    else:
+        # User chưa có lịch sử (có rating > 0): độ phổ biến trong segment, trừ courses user đã thử
+        popular_positions, shares = index.segment_popularity(
+            context.risk_level, context.category_id, context.segment_users, CANDIDATES_PER_GENERATOR
+        )
+        share_by_position = dict(zip(popular_positions.tolist(), shares.tolist()))
+        collaborative = np.array([share_by_position.get(position, 0.0) for position in positions.tolist()])
+        collaborative[np.isin(positions, context.seen)] = 0.0
+
+    fused = fuse_scores([
+        EngineScores('content_based', positions, content),
+        EngineScores('collaborative', positions, collaborative),
+    ], weights, top_k)
+
+    sources_by_position: Dict[int, List[str]] = {}
+    for name, generated in candidates.items():
+        for position in generated.tolist():
+            sources_by_position.setdefault(position, []).append(name)
+
+    column_of = {position: column for column, position in enumerate(positions.tolist())}
+    records = []
+    for column, position in enumerate(fused.item_ids.tolist()):
+        source_column = column_of[position]
+        sources = fused.sources(column)
+        if len(sources) > 1:
+            recommendation_source = 'both'
+        else:
+            recommendation_source = sources[0] if sources else 'content_based'
+        records.append({
+            **index.catalog.course_records[position],
+            'score': float(content[source_column]),
+            'similarity_score': float(collaborative[source_column]),
+            'hybrid_score': float(fused.scores[column]),
+            'recommendation_type': 'two_stage',
+            'recommendation_source': recommendation_source,
+            'boosts': ['audience'] if boost[source_column] > 1.0 else [],
+            'candidate_sources': sources_by_position.get(position, []),
+            'score_provenance': fused.provenance(column),
+        })
+    return records
+
+
+_index_lock = threading.Lock()
+_index: Optional[CourseCandidateIndex] = None
+
+
+def get_candidate_index(catalog: RecommendationCatalog, content_model: CourseContentModel,
+                        load_interactions: Callable[[], pd.DataFrame],
+                        interactions_version: Hashable) -> CourseCandidateIndex:
+    """
+    Index dùng chung: build lại ngay khi catalog version / content model đổi (catalog build lại vì quá hạn
+    với cùng version không tính), và khi interactions_version đổi nhưng tối đa một lần mỗi
+    CANDIDATE_INDEX_REFRESH_SECONDS. load_interactions() (dựng DataFrame toàn bộ interactions) chỉ được gọi khi build
+    """
+    global _index
+    with _index_lock:
+        index = _index
+        if (index is not None and index.content_version == content_model.version
+                and (index.catalog is catalog or (catalog.version is not None
+                                                  and index.catalog.version == catalog.version))):
+            if (index.interactions_version == interactions_version
+                    or time.time() - index.built_at < CANDIDATE_INDEX_REFRESH_SECONDS):
+                return index
+
+    index = CourseCandidateIndex(catalog, content_model, load_interactions(),
+                                 interactions_version=interactions_version)
+    with _index_lock:
+        _index = index
+    return index
+
+
+def invalidate_candidate_index() -> None:
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def candidate_index_stats() -> Dict[str, float]:
+    index = _index
+    if index is None:
+        return {}
+    return {
+        'courses': float(index.num_courses),
+        'users': float(len(index.user_ids)),
+        'item_neighbor_pairs': float(index.item_neighbors.nnz),
+        'cached_content_keys': float(len(index._content_top)),
+        'cached_segments': float(len(index._segment_popularity)),
+        'age_seconds': time.time() - index.built_at,
+    }
@@ -0,0 +1,150 @@
+"""
+Catalog index cho courses và consultants
+
+Catalog được build MỘT lần cho mỗi catalog version (và làm mới sau CATALOG_MAX_AGE_SECONDS để
+enrollment_count / total_appointments không quá cũ). Mỗi item có id -> row index và output
+record dựng sẵn, nên resolve candidate trong mọi recommendation path chỉ là một dict lookup.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from app.database.routing import POINT, routed
+
+CATALOG_MAX_AGE_SECONDS = float(os.getenv("CATALOG_MAX_AGE_SECONDS", "300"))
+
+
+class RecommendationCatalog:
+    """Courses + consultants kèm id index và output records dựng sẵn"""
+
+    def __init__(self, courses_df: pd.DataFrame, consultants_df: pd.DataFrame, version: Optional[str] = None):
+        self.version = version
+        self.built_at = time.time()
+        self.courses_df = courses_df.reset_index(drop=True)
+        self.consultants_df = consultants_df.reset_index(drop=True)
+
+        self.course_records: List[Dict] = [self._course_record(course) for _, course in self.courses_df.iterrows()]
+        self.course_index: Dict[str, int] = {record['course_id']: idx for idx, record in enumerate(self.course_records)}
+
+        # Consultant được nhận diện bằng consult_id (user_id của consultant), giống appointment "consultantId"
+        self.consultant_records: List[Dict] = [self._consultant_record(consultant) for _, consultant in self.consultants_df.iterrows()]
+        self.consultant_index: Dict[str, int] = {record['consultant_id']: idx for idx, record in enumerate(self.consultant_records)}
+
+        # TF-IDF model của courses (app.service.content_model), build lazy lần đầu cần
+        self.course_content_model = None
+
+    @staticmethod
+    def _course_record(course) -> Dict:
+        return {
+            'course_id': str(course['id']),
+            'title': str(course['title']),
+            'description': str(course['description']) if pd.notna(course['description']) else '',
+            'enrollment_count': int(course['enrollment_count']) if pd.notna(course['enrollment_count']) else 0,
+        }
+
+    @staticmethod
+    def _consultant_record(consultant) -> Dict:
+        return {
+            'consultant_id': str(consultant['consult_id']),
+            'name': str(consultant['full_name']),
+            'specialization': str(consultant['specialization']) if pd.notna(consultant['specialization']) and consultant['specialization'] else 'General',
+            'experience_years': int(consultant['experience_years']) if pd.notna(consultant['experience_years']) else 0,
+            'total_appointments': int(consultant['total_appointments']) if pd.notna(consultant['total_appointments']) else 0,
+        }
+
+    @property
+    def is_empty(self) -> bool:
+        return self.courses_df.empty and self.consultants_df.empty
+
+    def get_course(self, course_id: str) -> Optional[Dict]:
+        """Output record của course (bản copy), None nếu không có trong catalog"""
+        idx = self.course_index.get(str(course_id))
+        return dict(self.course_records[idx]) if idx is not None else None
+
+    def get_consultant(self, consultant_id: str) -> Optional[Dict]:
+        """Output record của consultant (bản copy), None nếu không có trong catalog"""
+        idx = self.consultant_index.get(str(consultant_id))
+        return dict(self.consultant_records[idx]) if idx is not None else None
+
+
+def get_catalog_version(db: Session) -> Optional[str]:
+    """Version token rẻ cho catalog: số lượng + updated_at mới nhất của Course, Course_Category, Consultants"""
+    try:
+        row = db.execute(routed("""
+            SELECT
+                (SELECT COUNT(*) FROM "Course") AS course_count,
+                (SELECT MAX(updated_at) FROM "Course") AS course_updated_at,
+                (SELECT COUNT(*) FROM "Course_Category") AS category_count,
+                (SELECT MAX(updated_at) FROM "Course_Category") AS category_updated_at,
+                (SELECT COUNT(*) FROM "Consultants" WHERE is_available = true) AS consultant_count,
+                (SELECT MAX(updated_at) FROM "Consultants") AS consultant_updated_at
+        """, POINT)).fetchone()
+        return "-".join(str(value) for value in row)
+    except Exception as e:
+        print(f"Error in get_catalog_version: {str(e)}")
+        db.rollback()
+        return None
+
+
+_catalog_lock = threading.Lock()
+_catalog: Optional[RecommendationCatalog] = None
+_catalog_listeners: List[Callable[[Optional[str]], None]] = []
+
+
+def add_catalog_listener(listener: Callable[[Optional[str]], None]) -> None:
+    """Đăng ký callback(version) chạy khi catalog version đổi hoặc catalog bị invalidate (version None)"""
+    with _catalog_lock:
+        if listener not in _catalog_listeners:
+            _catalog_listeners.append(listener)
+
+
+def _notify_catalog_listeners(version: Optional[str]) -> None:
+    with _catalog_lock:
+        listeners = list(_catalog_listeners)
+    for listener in listeners:
+        try:
+            listener(version)
+        except Exception as e:
+            print(f"Error in catalog listener: {str(e)}")
+
+
+def get_catalog(db: Session,
+                load_courses: Callable[[], pd.DataFrame],
+                load_consultants: Callable[[], pd.DataFrame]) -> RecommendationCatalog:
+    """
+    Catalog dùng chung trong process, chỉ build lại khi catalog version đổi hoặc quá hạn.
+    Build lại vì quá hạn (cùng version, chỉ counts đổi) giữ course content model của catalog cũ
+    nếu courses giữ nguyên thứ tự (TF-IDF rows theo thứ tự course_records)
+    """
+    global _catalog
+    version = get_catalog_version(db)
+    with _catalog_lock:
+        previous = _catalog
+        if (previous is not None and version is not None and previous.version == version
+                and time.time() - previous.built_at < CATALOG_MAX_AGE_SECONDS):
+            return previous
+
+    catalog = RecommendationCatalog(load_courses(), load_consultants(), version)
+    if (previous is not None and version is not None and previous.version == version
+            and list(previous.course_index) == list(catalog.course_index)):
+        catalog.course_content_model = previous.course_content_model
+    print(f"📚 Built catalog {version}: {len(catalog.course_records)} courses, {len(catalog.consultant_records)} consultants")
+    if version is not None and not catalog.is_empty:
+        with _catalog_lock:
+            previous = _catalog
+            _catalog = catalog
+        if previous is None or previous.version != version:
+            _notify_catalog_listeners(version)
+    return catalog
+
+
+def invalidate_catalog() -> None:
+    """Bỏ catalog đang cache (build lại ở request kế tiếp)"""
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
+    _notify_catalog_listeners(None)
@@ -0,0 +1,245 @@
+"""
+Change feed theo watermark: background refresher merge deltas vào các in-process datasets
+
+Thay vì reload toàn bộ bảng theo TTL, mỗi CHANGE_FEED_POLL_SECONDS refresher đọc các rows có
+updated_at / created_at từ watermark trở đi của từng bảng nguồn (chi phí tỉ lệ với số thay đổi,
+không phải kích thước bảng):
+- Survey_Attempts   -> segment index (apply_survey_attempts) + invalidate_user (latest survey, result cache)
+- Course_Enrollment -> interaction state: đọc lại course rows của các users đổi (replace_user).
+                       Bảng không có updated_at nên dùng enrollment_date / completion_date; progress
+                       thay đổi giữa chừng đến qua POST /events/enrollment-progress
+- Appointments      -> interaction state: đọc lại consultant rows của các users đổi (kể cả is_deleted)
+- Course, Consultants -> catalog được build lại ngay trong background (bảng nhỏ, TF-IDF cần cả corpus)
+
+Watermark là timestamp lớn nhất đã thấy (đồng hồ của database). Điều kiện là `>=` để không bỏ sót
+rows commit muộn với cùng timestamp; rows đã merge tại đúng watermark được nhớ lại và bỏ qua ở lần poll
+sau. Watermark đầu tiên là MAX(timestamp) hiện tại: datasets được build từ trạng thái lúc đó.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import bindparam
+from sqlalchemy.orm import Session
+
+from app.database.routing import POINT, routed
+from app.service.catalog import invalidate_catalog
+from app.service.data_version import invalidate_user
+from app.service.interaction_state import current_interaction_state
+from app.service.metrics import registry
+from app.service.segment_index import apply_survey_attempts
+
+CHANGE_FEED_POLL_SECONDS = float(os.getenv("CHANGE_FEED_POLL_SECONDS", "15"))
+
+CHANGE_FEED_ROWS = registry.counter("change_feed_rows_total", "Changed rows merged by the change feed", ("source",))
+
+# source -> (câu query thay đổi từ :watermark, các cột timestamp dùng làm watermark)
+_CHANGE_QUERIES = {
+    "Survey_Attempts": ("""
+        SELECT sa.user_id, sa.risk_level, ts.category_id, sa.created_at, sa.updated_at
+        FROM "Survey_Attempts" sa
+        JOIN "Users" u ON sa.user_id = u.id
+        JOIN "Test_Survey" ts ON sa.test_survey_id = ts.id
+        WHERE u.is_deleted = false AND (sa.updated_at >= :watermark OR sa.created_at >= :watermark)
+    """, ("created_at", "updated_at")),
+    "Course_Enrollment": ("""
+        SELECT user_id, enrollment_date, completion_date
+        FROM "Course_Enrollment"
+        WHERE enrollment_date >= :watermark OR completion_date >= :watermark
+    """, ("enrollment_date", "completion_date")),
+    "Appointments": ("""
+        SELECT "userId" AS user_id, created_at, updated_at
+        FROM "Appointments"
+        WHERE updated_at >= :watermark OR created_at >= :watermark
+    """, ("created_at", "updated_at")),
+    "Course": ("""
+        SELECT id, created_at, updated_at
+        FROM "Course"
+        WHERE updated_at >= :watermark OR created_at >= :watermark
+    """, ("created_at", "updated_at")),
+    "Consultants": ("""
+        SELECT id, created_at, updated_at
+        FROM "Consultants"
+        WHERE updated_at >= :watermark OR created_at >= :watermark
+    """, ("created_at", "updated_at")),
+}
+
+_USER_COURSE_INTERACTIONS_SQL = """
+    SELECT user_id, course_id AS item_id, progress_percentage, enrollment_date AS interaction_date
+    FROM "Course_Enrollment"
+    WHERE user_id IN :user_ids
+"""
+
+_USER_APPOINTMENT_INTERACTIONS_SQL = """
+    SELECT "userId" AS user_id, "consultantId" AS item_id, status, booking_time AS interaction_date
+    FROM "Appointments"
+    WHERE "userId" IN :user_ids AND is_deleted = false
+"""
+
+
+def _max_timestamp(rows: Iterable, columns) -> Optional[object]:
+    values = [getattr(row, column) for row in rows for column in columns]
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def _row_timestamp(row, columns) -> Optional[object]:
+    return _max_timestamp([row], columns)
+
+
+def _load_user_rows(db: Session, sql: str, user_ids: List[str]) -> List:
+    statement = routed(sql, POINT).bindparams(bindparam("user_ids", expanding=True))
+    return db.execute(statement, {'user_ids': user_ids}).fetchall()
+
+
+class ChangeFeed:
+    """Watermark cho từng bảng nguồn + logic merge deltas vào datasets"""
+
+    def __init__(self, rebuild_catalog: Optional[Callable[[Session], None]] = None):
+        self._lock = threading.Lock()
+        self.watermarks: Dict[str, object] = {}
+        # Rows (nguyên tuple) đã merge có timestamp đúng bằng watermark
+        self._boundary_rows: Dict[str, Set[tuple]] = {}
+        self.rebuild_catalog = rebuild_catalog or _rebuild_catalog
+        self.polls = 0
+        self.errors = 0
+        self.rows_applied: Dict[str, int] = {source: 0 for source in _CHANGE_QUERIES}
+        self.last_poll_at: Optional[float] = None
+
+    def _initial_watermark(self, db: Session, source: str) -> object:
+        _, columns = _CHANGE_QUERIES[source]
+        row = db.execute(routed(
+            f'SELECT {", ".join(f"MAX({column}) AS {column}" for column in columns)} FROM "{source}"', POINT
+        )).fetchone()
+        return _max_timestamp([row], columns)
+
+    def _changes(self, db: Session, source: str) -> List:
+        sql, columns = _CHANGE_QUERIES[source]
+        watermark = self.watermarks.get(source)
+        initial = watermark is None
+        if initial:
+            # Lần đầu (hoặc bảng đang rỗng): bắt đầu từ trạng thái hiện tại
+            watermark = self.watermarks[source] = self._initial_watermark(db, source)
+            if watermark is None:
+                return []
+        rows = db.execute(routed(sql, POINT), {'watermark': watermark}).fetchall()
+        boundary = self._boundary_rows.setdefault(source, set())
+        rows = [row for row in rows if tuple(row) not in boundary]
+        newest = _max_timestamp(rows, columns)
+        if newest is not None and newest > watermark:
+            self.watermarks[source] = watermark = newest
+            boundary.clear()
+        boundary.update(tuple(row) for row in rows if _row_timestamp(row, columns) == watermark)
+        return [] if initial else rows
+
+    def _apply_interactions(self, db: Session, rows: List, sql: str, item_type: str) -> None:
+        user_ids = sorted({str(row.user_id) for row in rows if row.user_id is not None})
+        if not user_ids:
+            return
+        state = current_interaction_state()
+        if state is not None:
+            from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
+            interaction_rows = _load_user_rows(db, sql, user_ids)
+            if item_type == 'course':
+                df = CRAFFTASSISTRecommendationSystem._build_interactions_dataframe(interaction_rows, [])
+            else:
+                df = CRAFFTASSISTRecommendationSystem._build_interactions_dataframe([], interaction_rows)
+            records_by_user: Dict[str, List[Dict]] = {user_id: [] for user_id in user_ids}
+            for record in df.to_dict('records'):
+                records_by_user[record['user_id']].append(record)
+            for user_id, records in records_by_user.items():
+                state.replace_user(user_id, item_type, records)
+        for user_id in user_ids:
+            invalidate_user(user_id)
+
+    def poll(self, db: Session) -> Dict[str, int]:
+        """Một vòng: đọc deltas của mọi bảng nguồn và merge, trả về số rows đổi theo bảng"""
+        with self._lock:
+            changed = {source: self._changes(db, source) for source in _CHANGE_QUERIES}
+
+            attempts = changed["Survey_Attempts"]
+            for user_id in {str(row.user_id) for row in attempts}:
+                invalidate_user(user_id)
+            apply_survey_attempts(attempts)
+
+            self._apply_interactions(db, changed["Course_Enrollment"], _USER_COURSE_INTERACTIONS_SQL, 'course')
+            self._apply_interactions(db, changed["Appointments"], _USER_APPOINTMENT_INTERACTIONS_SQL, 'consultant')
+            state = current_interaction_state()
+            if state is not None:
+                state.mark_synced()
+
+            if changed["Course"] or changed["Consultants"]:
+                invalidate_catalog()
+                self.rebuild_catalog(db)
+
+            counts = {source: len(rows) for source, rows in changed.items()}
+            for source, count in counts.items():
+                if count:
+                    self.rows_applied[source] += count
+                    CHANGE_FEED_ROWS.inc(source, amount=count)
+            self.polls += 1
+            self.last_poll_at = time.time()
+            return counts
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'polls': self.polls,
+                'errors': self.errors,
+                'seconds_since_poll': time.time() - self.last_poll_at if self.last_poll_at else -1,
+                **{f"rows_{source}": count for source, count in self.rows_applied.items()}
+            }
+
+
+def _rebuild_catalog(db: Session) -> None:
+    from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
+    CRAFFTASSISTRecommendationSystem(db).get_catalog()
+
+
+class ChangeFeedRefresher:
+    """Background thread gọi ChangeFeed.poll() mỗi interval_seconds với một session riêng"""
+
+    def __init__(self, feed: ChangeFeed, session_factory: Callable[[], Session],
+                 interval_seconds: float = CHANGE_FEED_POLL_SECONDS):
+        self.feed = feed
+        self.session_factory = session_factory
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> Optional[Dict[str, int]]:
+        db = self.session_factory()
+        try:
+            counts = self.feed.poll(db)
+            if any(counts.values()):
+                print(f"🔄 Change feed merged {counts}")
+            return counts
+        except Exception as e:
+            self.feed.errors += 1
+            print(f"Error in change feed poll: {str(e)}")
+            db.rollback()
+            return None
+        finally:
+            db.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval_seconds)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval_seconds + 5)
+            self._thread = None
+
+
+change_feed = ChangeFeed()
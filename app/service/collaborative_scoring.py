@@ -0,0 +1,116 @@
+"""
+Sparse user-item matrix và weighted neighbor aggregation cho collaborative filtering
+
+Thay cho pivot_table dense + vòng lặp filter DataFrame theo từng similar user:
+    scores = similarities(top neighbors) @ neighbor_item_matrix / sum(similarities)
+-> predicted score cho MỌI item trong một phép nhân sparse (BLAS-backed), mask items user đã
+có, rồi lấy top-k bằng argpartition.
+"""
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.metrics.pairwise import cosine_similarity
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Index của top_k scores (giảm dần), dùng argpartition thay vì sort toàn bộ"""
+    if top_k <= 0 or len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class UserItemMatrix:
+    """
+    Sparse (CSR) user x item matrix từ interactions DataFrame
+    - ratings:     mean rating mỗi (user, item), giống pivot_table(aggfunc='mean', fill_value=0)
+    - max_ratings: max rating mỗi (user, item), dùng cho các threshold "đã rate >= x"
+    - pattern:     1 cho mọi (user, item) có interaction (kể cả rating 0)
+    """
+
+    def __init__(self, interactions_df: pd.DataFrame):
+        grouped = interactions_df.groupby(['user_id', 'item_id'], sort=False)['rating'].agg(['mean', 'max'])
+        user_codes, user_ids = pd.factorize(grouped.index.get_level_values(0))
+        item_codes, item_ids = pd.factorize(grouped.index.get_level_values(1))
+        shape = (len(user_ids), len(item_ids))
+
+        self.user_ids = pd.Index(user_ids)
+        self.item_ids = pd.Index(item_ids)
+        self.ratings = sp.csr_matrix((grouped['mean'].to_numpy(dtype=np.float64), (user_codes, item_codes)), shape=shape)
+        self.max_ratings = sp.csr_matrix((grouped['max'].to_numpy(dtype=np.float64), (user_codes, item_codes)), shape=shape)
+        self.pattern = sp.csr_matrix((np.ones(len(grouped), dtype=np.float64), (user_codes, item_codes)), shape=shape)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.ratings.shape
+
+    @property
+    def nnz(self) -> int:
+        return self.pattern.nnz
+
+    @property
+    def sparsity(self) -> float:
+        size = self.shape[0] * self.shape[1]
+        return (1 - self.nnz / size) * 100 if size else 100.0
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.user_ids
+
+    def user_rows(self, user_ids: Iterable[str]) -> np.ndarray:
+        """Row index của các users (bỏ qua users không có trong matrix)"""
+        rows = self.user_ids.get_indexer(list(user_ids))
+        return rows[rows >= 0]
+
+    def seen_items(self, user_id: str, min_rating: Optional[float] = None) -> np.ndarray:
+        """Item index mà user đã tương tác (hoặc đã rate >= min_rating)"""
+        row = self.user_ids.get_loc(user_id)
+        if min_rating is None:
+            return self.pattern.indices[self.pattern.indptr[row]:self.pattern.indptr[row + 1]]
+        start, end = self.max_ratings.indptr[row], self.max_ratings.indptr[row + 1]
+        return self.max_ratings.indices[start:end][self.max_ratings.data[start:end] >= min_rating]
+
+    def user_similarities(self, user_id: str, candidate_rows: np.ndarray) -> np.ndarray:
+        """Cosine similarity giữa user và các candidate rows (1 x n, không dựng full n x n)"""
+        if len(candidate_rows) == 0:
+            return np.zeros(0, dtype=np.float64)
+        row = self.user_ids.get_loc(user_id)
+        return cosine_similarity(self.ratings[row], self.ratings[candidate_rows]).ravel()
+
+    def liked_matrix(self, rows: np.ndarray, rating_threshold: float) -> sp.csr_matrix:
+        """Neighbor-item matrix: mean rating của các (neighbor, item) có max rating >= threshold"""
+        liked = self.max_ratings[rows] >= rating_threshold
+        return sp.csr_matrix(self.ratings[rows].multiply(liked))
+
+
+def aggregate_neighbor_scores(neighbor_item_matrix: sp.csr_matrix,
+                              neighbor_weights: np.ndarray,
+                              exclude_items: np.ndarray,
+                              top_k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Weighted aggregation: scores = weights @ M / sum(weights)
+    Trả về (item_indices, scores, source_neighbor) cho top_k items có score > 0,
+    source_neighbor là row của neighbor đóng góp nhiều nhất cho item đó
+    """
+    empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.int64))
+    weights = np.asarray(neighbor_weights, dtype=np.float64)
+    total_weight = weights.sum()
+    if neighbor_item_matrix.shape[0] == 0 or total_weight <= 0:
+        return empty
+
+    scores = np.asarray(neighbor_item_matrix.T.dot(weights)).ravel() / total_weight
+    if len(exclude_items):
+        scores[exclude_items] = 0.0
+
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) == 0:
+        return empty
+    chosen = candidates[top_k_indices(scores[candidates], top_k)]
+
+    contributions = neighbor_item_matrix[:, chosen].multiply(weights[:, None])
+    source_neighbor = np.asarray(sp.csc_matrix(contributions).argmax(axis=0)).ravel()
+    return chosen, scores[chosen], source_neighbor
@@ -0,0 +1,129 @@
+"""
+Content-based course model: TF-IDF matrix của courses + profile vector cho mỗi risk level
+
+Trước đây mỗi request fit lại TfidfVectorizer trên toàn bộ courses. Model chỉ phụ thuộc vào
+course features và risk mapping, nên được build một lần cho mỗi catalog (version = hash của
+features) và giữ trên catalog object. Khi MODEL_STORE_DIR được cấu hình, arrays được publish vào
+model store: worker đầu tiên fit + publish, các workers khác attach read-only (memmap) thay vì
+mỗi worker giữ một bản copy.
+"""
+import hashlib
+from typing import Dict, List, Optional
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from app.service.catalog import RecommendationCatalog
+from app.service.model_store import AttachedModel, get_model_handle
+
+COURSE_CONTENT_MODEL = "course_content"
+TFIDF_PARAMS = {'max_features': 1000, 'stop_words': 'english'}
+
+
+def course_features(catalog: RecommendationCatalog) -> List[str]:
+    """Text feature của mỗi course (cùng thứ tự với catalog.course_records)"""
+    courses_df = catalog.courses_df
+    return [
+        f"{description} {category_name} {target_audience}"
+        for description, category_name, target_audience in zip(
+            courses_df['description'], courses_df['category_name'], courses_df['target_audience']
+        )
+    ]
+
+
+def risk_profiles(risk_mapping: Dict[str, Dict]) -> Dict[str, str]:
+    """User profile text cho mỗi risk level (course topics nối lại)"""
+    return {risk: " ".join(mapping['course_topics']) for risk, mapping in risk_mapping.items()}
+
+
+class CourseContentModel:
+    """TF-IDF matrix (courses x vocabulary, CSR) + profile vectors (risk levels x vocabulary)"""
+
+    def __init__(self, version: str, tfidf_matrix: sp.csr_matrix, profile_matrix: np.ndarray,
+                 feature_names: np.ndarray, risk_levels: List[str], shared: bool = False):
+        self.version = version
+        self.tfidf_matrix = tfidf_matrix
+        self.profile_matrix = profile_matrix
+        self.feature_names = feature_names
+        self.risk_levels = risk_levels
+        self._risk_rows = {risk: row for row, risk in enumerate(risk_levels)}
+        self.shared = shared
+
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self.feature_names)
+
+    def profile_vector(self, risk_level: str) -> sp.csr_matrix:
+        """Profile vector của risk level (fallback 'medium', giống risk_mapping.get(..., 'medium'))"""
+        row = self._risk_rows.get(risk_level, self._risk_rows['medium'])
+        return sp.csr_matrix(self.profile_matrix[row:row + 1])
+
+    @classmethod
+    def fit(cls, version: str, features: List[str], profiles: Dict[str, str]) -> "CourseContentModel":
+        vectorizer = TfidfVectorizer(**TFIDF_PARAMS)
+        tfidf_matrix = vectorizer.fit_transform(features).tocsr()
+        risk_levels = list(profiles)
+        profile_matrix = vectorizer.transform([profiles[risk] for risk in risk_levels]).toarray()
+        return cls(version, tfidf_matrix, profile_matrix, vectorizer.get_feature_names_out().astype(str), risk_levels)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            'tfidf_data': self.tfidf_matrix.data,
+            'tfidf_indices': self.tfidf_matrix.indices,
+            'tfidf_indptr': self.tfidf_matrix.indptr,
+            'profile_matrix': self.profile_matrix,
+            'feature_names': self.feature_names,
+        }
+
+    @classmethod
+    def from_attached(cls, model: AttachedModel) -> "CourseContentModel":
+        tfidf_matrix = sp.csr_matrix(
+            (model['tfidf_data'], model['tfidf_indices'], model['tfidf_indptr']),
+            shape=tuple(model.meta['tfidf_shape'])
+        )
+        return cls(model.version, tfidf_matrix, model['profile_matrix'], model['feature_names'],
+                   model.meta['risk_levels'], shared=True)
+
+
+def content_model_version(features: List[str], profiles: Dict[str, str]) -> str:
+    digest = hashlib.sha1(repr(sorted(TFIDF_PARAMS.items())).encode('utf-8'))
+    for text in features:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    for risk in sorted(profiles):
+        digest.update(f"{risk}={profiles[risk]}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def get_course_content_model(catalog: RecommendationCatalog, risk_mapping: Dict[str, Dict]) -> Optional[CourseContentModel]:
+    """Model cho catalog hiện tại: cache trên catalog, attach từ model store, hoặc fit (+ publish)"""
+    model = catalog.course_content_model
+    if model is not None:
+        return model
+
+    features = course_features(catalog)
+    if not features:
+        return None
+    profiles = risk_profiles(risk_mapping)
+    version = content_model_version(features, profiles)
+
+    handle = get_model_handle(COURSE_CONTENT_MODEL)
+    attached = handle.get() if handle is not None else None
+    if attached is not None and attached.version == version:
+        model = CourseContentModel.from_attached(attached)
+    else:
+        model = CourseContentModel.fit(version, features, profiles)
+        if handle is not None:
+            try:
+                attached = handle.publish(version, model.to_arrays(), {
+                    'tfidf_shape': list(model.tfidf_matrix.shape),
+                    'risk_levels': model.risk_levels,
+                })
+                if attached is not None and attached.version == version:
+                    model = CourseContentModel.from_attached(attached)
+            except Exception as e:
+                print(f"Error publishing course content model: {str(e)}")
+
+    catalog.course_content_model = model
+    return model
@@ -0,0 +1,121 @@
+"""
+Version token rẻ cho dữ liệu của một user + catalog, dùng làm ETag cho recommendation endpoints
+
+Recommendations của user chỉ đổi khi survey/interactions của user đổi, hoặc catalog đổi. Token gồm:
+- user SQL token: count + max timestamps của Survey_Attempts / Course_Enrollment / Appointments của user
+  (một point query, các cột user_id đều có index)
+- catalog version (app.service.catalog.get_catalog_version)
+- epoch: time bucket RECOMMENDATION_ETAG_EPOCH_SECONDS, giới hạn độ cũ của tín hiệu collaborative
+  (hành vi của users khác không nằm trong user token)
+
+User generation (counter trong process, tăng mỗi khi invalidate_user(user_id) được gọi; listeners đăng ký
+qua add_invalidation_listener để các cache per-user cùng bị xoá) chỉ dùng cho token của cache trong process,
+không nằm trong ETag: nó khác nhau giữa các workers / sau restart nên ETag sẽ không ổn định.
+"""
+import hashlib
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.database.routing import POINT, routed
+from app.service.catalog import get_catalog_version
+from app.service.latest_survey import invalidate_latest_survey
+
+RECOMMENDATION_CACHE_MAX_AGE = int(os.getenv("RECOMMENDATION_CACHE_MAX_AGE", "60"))
+RECOMMENDATION_ETAG_EPOCH_SECONDS = int(os.getenv("RECOMMENDATION_ETAG_EPOCH_SECONDS", "3600"))
+
+_generation_lock = threading.Lock()
+_user_generations: Dict[str, int] = {}
+_invalidation_listeners: List[Callable[[str], None]] = []
+
+
+def add_invalidation_listener(listener: Callable[[str], None]) -> None:
+    """Đăng ký callback(user_id) chạy mỗi khi dữ liệu của user đổi"""
+    with _generation_lock:
+        if listener not in _invalidation_listeners:
+            _invalidation_listeners.append(listener)
+
+
+def invalidate_user(user_id: str) -> int:
+    """Đánh dấu dữ liệu của user đã đổi: tăng generation và gọi các listeners, trả về generation mới"""
+    user_id = str(user_id)
+    with _generation_lock:
+        generation = _user_generations.get(user_id, 0) + 1
+        _user_generations[user_id] = generation
+        listeners = list(_invalidation_listeners)
+    for listener in listeners:
+        try:
+            listener(user_id)
+        except Exception as e:
+            print(f"Error in invalidation listener for user {user_id}: {str(e)}")
+    return generation
+
+
+def get_user_generation(user_id: str) -> int:
+    return _user_generations.get(str(user_id), 0)
+
+
+add_invalidation_listener(invalidate_latest_survey)
+
+
+def get_user_data_version(db: Session, user_id: str) -> Optional[str]:
+    """SQL token cho survey + interaction data của user (None nếu query lỗi)"""
+    try:
+        row = db.execute(routed("""
+            SELECT
+                (SELECT COUNT(*) FROM "Survey_Attempts" WHERE user_id = :user_id) AS survey_count,
+                (SELECT MAX(updated_at) FROM "Survey_Attempts" WHERE user_id = :user_id) AS survey_updated_at,
+                (SELECT COUNT(*) FROM "Course_Enrollment" WHERE user_id = :user_id) AS enrollment_count,
+                (SELECT SUM(progress_percentage) FROM "Course_Enrollment" WHERE user_id = :user_id) AS enrollment_progress,
+                (SELECT MAX(enrollment_date) FROM "Course_Enrollment" WHERE user_id = :user_id) AS enrollment_date,
+                (SELECT COUNT(*) FROM "Appointments" WHERE "userId" = :user_id AND is_deleted = false) AS appointment_count,
+                (SELECT MAX(updated_at) FROM "Appointments" WHERE "userId" = :user_id) AS appointment_updated_at
+        """, POINT), {'user_id': user_id}).fetchone()
+        return "-".join(str(value) for value in row)
+    except Exception as e:
+        print(f"Error in get_user_data_version: {str(e)}")
+        db.rollback()
+        return None
+
+
+def get_recommendation_versions(db: Session, user_id: str) -> Tuple[Optional[str], Optional[str]]:
+    """(user data version, catalog version): đọc một lần mỗi request, dùng chung cho ETag và result cache"""
+    return get_user_data_version(db, user_id), get_catalog_version(db)
+
+
+def compute_recommendation_etag(db: Session, user_id: str, *params,
+                                versions: Optional[Tuple[Optional[str], Optional[str]]] = None) -> Optional[str]:
+    """
+    Strong ETag cho recommendations của user với các request params đã cho.
+    versions: kết quả get_recommendation_versions đã đọc (None = đọc ở đây).
+    None nếu không tính được version (khi đó endpoint trả về response bình thường, không ETag)
+    """
+    user_version, catalog_version = versions if versions is not None else get_recommendation_versions(db, user_id)
+    if user_version is None or catalog_version is None:
+        return None
+
+    epoch = int(time.time() // RECOMMENDATION_ETAG_EPOCH_SECONDS) if RECOMMENDATION_ETAG_EPOCH_SECONDS > 0 else 0
+    key = "|".join(str(part) for part in (
+        user_id, user_version, catalog_version, epoch, *params
+    ))
+    return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """So khớp header If-None-Match (có thể là list hoặc *) với ETag hiện tại (weak comparison)"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={RECOMMENDATION_CACHE_MAX_AGE}, must-revalidate",
+    }
@@ -0,0 +1,72 @@
+"""
+Event ingestion: áp dụng deltas (enrollment progress, appointment status, survey completion) vào
+in-process state thay vì reload toàn bộ
+
+Mỗi event là O(1): upsert interaction state, thêm segment membership, cập nhật latest survey, rồi
+invalidate_user() -> chỉ caches của user đó bị làm mới (ETag đổi theo SQL token của user).
+Backend ghi database trước rồi mới gửi event, nên rebuild từ Postgres thấy cùng dữ liệu. Snapshot chỉ chứa
+dữ liệu tới lúc nó được tạo: rebuild khi snapshot chưa đổi version giữ lại các deltas (interaction_state),
+còn snapshot version mới không có các events đến sau lúc tạo snapshot cho tới khi change feed / reload bắt kịp.
+"""
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from app.database.routing import POINT, routed
+from app.service.data_version import invalidate_user
+from app.service.interaction_state import appointment_rating, course_rating, current_interaction_state
+from app.service.latest_survey import peek_latest_survey, record_survey_completion
+from app.service.metrics import registry
+from app.service.segment_index import record_survey_attempt
+
+EVENTS_INGESTED = registry.counter("events_ingested_total", "Incremental events applied to in-memory state", ("kind",))
+
+
+def _apply_interaction(user_id: str, item_type: str, item_id: str, rating: float, interaction_date) -> bool:
+    state = current_interaction_state()
+    if state is None:
+        return False
+    state.apply(user_id, item_type, item_id, rating, interaction_date)
+    return True
+
+
+def ingest_enrollment_progress(user_id: str, course_id: str, progress_percentage: float,
+                               enrollment_date: Optional[datetime] = None) -> Dict:
+    updated = _apply_interaction(user_id, 'course', course_id, course_rating(progress_percentage), enrollment_date)
+    generation = invalidate_user(user_id)
+    EVENTS_INGESTED.inc("enrollment_progress")
+    return {'user_id': user_id, 'interaction_state_updated': updated, 'user_generation': generation}
+
+
+def ingest_appointment_status(user_id: str, consultant_id: str, status: str,
+                              booking_time: Optional[datetime] = None) -> Dict:
+    """consultant_id là user id của consultant (giống Appointments."consultantId")"""
+    updated = _apply_interaction(user_id, 'consultant', consultant_id, appointment_rating(status), booking_time)
+    generation = invalidate_user(user_id)
+    EVENTS_INGESTED.inc("appointment_status")
+    return {'user_id': user_id, 'interaction_state_updated': updated, 'user_generation': generation}
+
+
+def _survey_category(db: Session, test_survey_id: str) -> Optional[str]:
+    row = db.execute(routed('SELECT category_id FROM "Test_Survey" WHERE id = :id', POINT), {'id': test_survey_id}).fetchone()
+    return str(row.category_id) if row else None
+
+
+def ingest_survey_completed(db: Session, user_id: str, test_survey_id: str, total_score: Optional[int], risk_level: str,
+                            category_id: Optional[str] = None, completed_at: Optional[datetime] = None) -> Dict:
+    if category_id is None:
+        category_id = _survey_category(db, test_survey_id)
+
+    # Lấy entry cũ trước khi invalidate_user() xoá caches của user
+    previous = peek_latest_survey(user_id)
+    generation = invalidate_user(user_id)
+    latest_updated = record_survey_completion(previous, user_id, test_survey_id, category_id, total_score, risk_level, completed_at)
+    segment_updated = record_survey_attempt(user_id, risk_level, category_id)
+    EVENTS_INGESTED.inc("survey_completed")
+    return {
+        'user_id': user_id,
+        'latest_survey_updated': latest_updated,
+        'segment_membership_changed': segment_updated,
+        'user_generation': generation
+    }
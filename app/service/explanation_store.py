@@ -0,0 +1,141 @@
+"""
+Explanation capture: hybrid_recommendations ghi lại lý do của từng item ngay lúc scoring
+
+Mỗi kết quả hybrid có một recommendation_id. Explanation gọn của kết quả (content score, collaborative
+score, source neighbor, boosts đã áp dụng) được lưu dưới id đó trong một LRU có TTL ngắn, kèm con trỏ
+"kết quả mới nhất" cho mỗi user. /recommendation-explanation chỉ là lookup; chỉ tính lại hybrid khi miss.
+
+Khi dữ liệu của user đổi (invalidate_user) con trỏ mới nhất bị xoá, còn explanation theo id vẫn giữ
+đến hết TTL vì nó mô tả đúng kết quả user đã nhận.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from app.service.data_version import add_invalidation_listener
+
+EXPLANATION_TTL_SECONDS = float(os.getenv("EXPLANATION_TTL_SECONDS", "600"))
+EXPLANATION_STORE_SIZE = int(os.getenv("EXPLANATION_STORE_SIZE", "10000"))
+
+
+def _engine_score(record: Dict, engine: str) -> float:
+    return float(record.get('score_provenance', {}).get(engine, {}).get('score', 0.0))
+
+
+def _item_explanation(record: Dict) -> Dict:
+    explanation = {
+        'score': record.get('hybrid_score', record.get('score', 0)),
+        'type': record.get('recommendation_type'),
+        'source': record.get('recommendation_source'),
+        'factors': {
+            'content_based_score': _engine_score(record, 'content_based'),
+            'collaborative_score': _engine_score(record, 'collaborative'),
+            'boosts': record.get('boosts', []),
+        }
+    }
+    for key in ('source_user', 'source_model'):
+        if record.get(key) is not None:
+            explanation['factors'][key] = record[key]
+    return explanation
+
+
+def build_explanation(user_id: str, recommendation_id: str, result: Dict) -> Dict:
+    """Explanation (format của /recommendation-explanation) cho một kết quả hybrid"""
+    risk_info = result.get('user_risk_info', {})
+    course_explanations: List[Dict] = []
+    for course in result.get('courses', []):
+        item = _item_explanation(course)
+        item['factors']['difficulty_match'] = course.get('difficulty_level', '')
+        course_explanations.append({
+            'course_id': course.get('course_id'),
+            'course_title': course.get('title'),
+            'reason': course.get('reason', 'No specific reason'),
+            **item
+        })
+    consultant_explanations = [
+        {
+            'consultant_id': consultant.get('consultant_id'),
+            'consultant_name': consultant.get('name'),
+            'specialization': consultant.get('specialization'),
+            'reason': consultant.get('reason')
+            or f"Specialization matches your {risk_info.get('latest_risk_level') or 'MEDIUM'} risk level",
+            **_item_explanation(consultant)
+        }
+        for consultant in result.get('consultants', [])
+    ]
+    return {
+        'user_id': user_id,
+        'recommendation_id': recommendation_id,
+        'risk_info': risk_info,
+        'recommendation_breakdown': result.get('recommendation_summary', {}),
+        'course_explanations': course_explanations,
+        'consultant_explanations': consultant_explanations,
+        'captured_at': time.time()
+    }
+
+
+class ExplanationStore:
+    """LRU recommendation_id -> (user_id, explanation, thời điểm lưu), có TTL"""
+
+    def __init__(self, max_size: int = EXPLANATION_STORE_SIZE, ttl_seconds: float = EXPLANATION_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._latest: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def capture(self, user_id: str, result: Dict) -> str:
+        """Lưu explanation của kết quả hybrid, trả về recommendation_id mới"""
+        user_id = str(user_id)
+        recommendation_id = uuid.uuid4().hex
+        explanation = build_explanation(user_id, recommendation_id, result)
+        with self._lock:
+            self._entries[recommendation_id] = (user_id, explanation, time.time())
+            self._latest[user_id] = recommendation_id
+            while len(self._entries) > self.max_size:
+                evicted_id, (evicted_user, _, _) = self._entries.popitem(last=False)
+                if self._latest.get(evicted_user) == evicted_id:
+                    del self._latest[evicted_user]
+        return recommendation_id
+
+    def get(self, user_id: str, recommendation_id: Optional[str] = None) -> Optional[Dict]:
+        """Explanation theo id (phải thuộc user_id), hoặc của kết quả mới nhất của user; None nếu miss"""
+        user_id = str(user_id)
+        with self._lock:
+            recommendation_id = recommendation_id or self._latest.get(user_id)
+            entry = self._entries.get(recommendation_id) if recommendation_id else None
+            if entry is None or entry[0] != user_id or time.time() - entry[2] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(recommendation_id)
+            self.hits += 1
+            return entry[1]
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._latest.pop(str(user_id), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+explanation_store = ExplanationStore()
+
+add_invalidation_listener(explanation_store.invalidate)
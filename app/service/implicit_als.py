@@ -0,0 +1,243 @@
+"""
+Implicit-feedback matrix factorization (ALS, Hu/Koren/Volinsky 2008) cho collaborative recommendations
+
+Train offline trên cùng interactions với neighborhood CF (rating = progress / appointment status):
+    preference p_ui = 1 cho mọi interaction, confidence c_ui = 1 + ALS_ALPHA * rating
+Một model chung cho courses + consultants (hành vi ở loại item này giúp loại kia). Kết quả là
+user_factors / item_factors float32, publish vào model store (app.service.model_store) để mọi worker
+attach read-only. Serving: scores = item_factors @ user_vector + argpartition (top_k_indices).
+User chưa có trong model (mới có interactions sau lần train) được fold-in: giải một hệ k x k từ
+interactions hiện tại của user, không cần train lại.
+
+    MODEL_STORE_DIR=/dev/shm/wdp-models python -m app.service.implicit_als
+"""
+import hashlib
+import os
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from app.service.collaborative_scoring import top_k_indices
+from app.service.interaction_snapshot import ITEM_TYPES
+from app.service.model_store import AttachedModel, get_model_handle
+
+IMPLICIT_ALS_MODEL = "implicit_als"
+
+ALS_FACTORS = int(os.getenv("ALS_FACTORS", "32"))
+ALS_REGULARIZATION = float(os.getenv("ALS_REGULARIZATION", "0.1"))
+ALS_ALPHA = float(os.getenv("ALS_ALPHA", "20"))
+ALS_ITERATIONS = int(os.getenv("ALS_ITERATIONS", "15"))
+
+
+def _confidence_matrix(interactions_df: pd.DataFrame, user_ids: np.ndarray, item_keys: pd.MultiIndex,
+                       alpha: float) -> sp.csr_matrix:
+    """users x items, giá trị = confidence - 1 = alpha * max rating của (user, item)"""
+    grouped = interactions_df.groupby(['user_id', 'item_type', 'item_id'], sort=False)['rating'].max()
+    rows = np.searchsorted(user_ids, grouped.index.get_level_values(0).to_numpy(dtype=str))
+    cols = item_keys.get_indexer(grouped.index.droplevel(0))
+    # + epsilon để interaction rating 0 vẫn nằm trong sparsity pattern (preference = 1)
+    values = alpha * grouped.to_numpy(dtype=np.float64) + 1e-6
+    return sp.csr_matrix((values, (rows, cols)), shape=(len(user_ids), len(item_keys)))
+
+
+def _solve_rows(confidence: sp.csr_matrix, fixed: np.ndarray, regularization: float) -> np.ndarray:
+    """Một nửa vòng ALS: với mỗi row, x = (YtY + Yᵀ(C-1)Y + λI)⁻¹ Yᵀ C p"""
+    factors = fixed.shape[1]
+    gram = fixed.T @ fixed + regularization * np.eye(factors)
+    solved = np.zeros((confidence.shape[0], factors), dtype=np.float64)
+    for row in range(confidence.shape[0]):
+        start, end = confidence.indptr[row], confidence.indptr[row + 1]
+        if start == end:
+            continue
+        solved[row] = _solve_one(gram, fixed[confidence.indices[start:end]], confidence.data[start:end])
+    return solved
+
+
+def _solve_one(gram: np.ndarray, item_factors: np.ndarray, confidence_minus_one: np.ndarray) -> np.ndarray:
+    a = gram + (item_factors.T * confidence_minus_one) @ item_factors
+    b = item_factors.T @ (confidence_minus_one + 1.0)
+    return np.linalg.solve(a, b)
+
+
+class ImplicitALSModel:
+    """Factor matrices + id lookups; arrays có thể là memmap read-only từ model store"""
+
+    def __init__(self, version: str, user_factors: np.ndarray, item_factors: np.ndarray,
+                 user_ids: np.ndarray, item_ids: np.ndarray, item_types: np.ndarray, regularization: float,
+                 alpha: float = ALS_ALPHA):
+        self.version = version
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.user_ids = user_ids      # sorted -> lookup bằng searchsorted
+        self.item_ids = item_ids
+        self.item_types = item_types  # index vào ITEM_TYPES
+        self.regularization = regularization
+        self.alpha = alpha
+        self._gram = None
+        self._item_rows: Dict[str, Dict[str, int]] = {}
+        self._type_rows: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for code, item_type in enumerate(ITEM_TYPES):
+            rows = np.flatnonzero(np.asarray(item_types) == code)
+            ids = np.array([str(item_ids[row]) for row in rows], dtype=object)
+            self._item_rows[item_type] = dict(zip(ids, rows.tolist()))
+            self._type_rows[item_type] = (rows, ids)
+
+    @property
+    def factors(self) -> int:
+        return self.item_factors.shape[1]
+
+    def user_row(self, user_id: str) -> int:
+        idx = int(np.searchsorted(self.user_ids, str(user_id)))
+        if idx < len(self.user_ids) and self.user_ids[idx] == str(user_id):
+            return idx
+        return -1
+
+    def item_row(self, item_type: str, item_id: str) -> int:
+        return self._item_rows[item_type].get(str(item_id), -1)
+
+    def fold_in(self, user_interactions: pd.DataFrame) -> Optional[np.ndarray]:
+        """User vector từ interactions hiện tại của user (một lần giải k x k), None nếu không có item nào trong model"""
+        if user_interactions.empty:
+            return None
+        best: Dict[int, float] = {}
+        for item_type, item_id, rating in zip(user_interactions['item_type'], user_interactions['item_id'], user_interactions['rating']):
+            row = self.item_row(item_type, item_id)
+            if row >= 0:
+                best[row] = max(best.get(row, 0.0), float(rating))
+        if not best:
+            return None
+        if self._gram is None:
+            item_factors = np.asarray(self.item_factors, dtype=np.float64)
+            self._gram = item_factors.T @ item_factors + self.regularization * np.eye(self.factors)
+        rows = np.fromiter(best.keys(), dtype=np.int64)
+        confidence_minus_one = self.alpha * np.fromiter(best.values(), dtype=np.float64) + 1e-6
+        item_factors = np.asarray(self.item_factors[rows], dtype=np.float64)
+        return _solve_one(self._gram, item_factors, confidence_minus_one).astype(np.float32)
+
+    def user_vector(self, user_id: str, user_interactions: pd.DataFrame) -> Optional[np.ndarray]:
+        """Factors đã train của user, hoặc fold-in nếu user mới"""
+        row = self.user_row(user_id)
+        if row >= 0:
+            return np.asarray(self.user_factors[row])
+        return self.fold_in(user_interactions)
+
+    def recommend(self, user_vector: np.ndarray, item_type: str, top_k: int,
+                  exclude_item_ids: Iterable[str] = (), allowed_item_ids=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top_k (item_ids, scores > 0) của item_type: dot product + argpartition"""
+        rows, ids = self._type_rows[item_type]
+        if len(rows) == 0:
+            return np.zeros(0, dtype=object), np.zeros(0, dtype=np.float32)
+        scores = np.asarray(self.item_factors[rows]) @ user_vector
+        blocked = np.zeros(len(rows), dtype=bool)
+        exclude = set(str(item_id) for item_id in exclude_item_ids)
+        if exclude or allowed_item_ids is not None:
+            blocked = np.fromiter(
+                (item_id in exclude or (allowed_item_ids is not None and item_id not in allowed_item_ids) for item_id in ids),
+                dtype=bool, count=len(ids)
+            )
+        scores = np.where(blocked, 0.0, scores)
+        candidates = np.flatnonzero(scores > 0)
+        chosen = candidates[top_k_indices(scores[candidates], top_k)]
+        return ids[chosen], scores[chosen]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            'user_factors': self.user_factors,
+            'item_factors': self.item_factors,
+            'user_ids': self.user_ids,
+            'item_ids': self.item_ids,
+            'item_types': self.item_types,
+        }
+
+    @classmethod
+    def from_attached(cls, model: AttachedModel) -> "ImplicitALSModel":
+        return cls(model.version, model['user_factors'], model['item_factors'], model['user_ids'],
+                   model['item_ids'], model['item_types'], model.meta['regularization'], model.meta['alpha'])
+
+
+def train_implicit_als(interactions_df: pd.DataFrame, factors: int = ALS_FACTORS,
+                       regularization: float = ALS_REGULARIZATION, alpha: float = ALS_ALPHA,
+                       iterations: int = ALS_ITERATIONS, seed: int = 42) -> ImplicitALSModel:
+    """Train ALS trên interactions DataFrame (schema của get_user_interactions)"""
+    df = interactions_df.assign(user_id=interactions_df['user_id'].astype(str), item_id=interactions_df['item_id'].astype(str))
+    user_ids = np.unique(df['user_id'].to_numpy(dtype=str))
+    item_keys = pd.MultiIndex.from_frame(df[['item_type', 'item_id']].drop_duplicates()).sort_values()
+    confidence = _confidence_matrix(df, user_ids, item_keys, alpha)
+    confidence_t = confidence.T.tocsr()
+
+    rng = np.random.default_rng(seed)
+    user_factors = rng.normal(0, 0.01, (len(user_ids), factors))
+    item_factors = rng.normal(0, 0.01, (len(item_keys), factors))
+    for _ in range(iterations):
+        user_factors = _solve_rows(confidence, item_factors, regularization)
+        item_factors = _solve_rows(confidence_t, user_factors, regularization)
+
+    item_types = np.array([ITEM_TYPES.index(item_type) for item_type in item_keys.get_level_values(0)], dtype=np.uint8)
+    item_ids = item_keys.get_level_values(1).to_numpy(dtype=str)
+    digest = hashlib.sha1()
+    for values in (user_ids, item_ids, user_factors.astype(np.float32), item_factors.astype(np.float32)):
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return ImplicitALSModel(digest.hexdigest()[:16], user_factors.astype(np.float32), item_factors.astype(np.float32),
+                            user_ids, item_ids, item_types, regularization, alpha)
+
+
+_model_lock = threading.Lock()
+_model: Optional[ImplicitALSModel] = None
+
+
+def get_implicit_als_model() -> Optional[ImplicitALSModel]:
+    """Model ALS mới nhất trong model store (None nếu chưa train / chưa cấu hình MODEL_STORE_DIR)"""
+    global _model
+    handle = get_model_handle(IMPLICIT_ALS_MODEL)
+    attached = handle.get() if handle is not None else None
+    if attached is None:
+        return None
+    with _model_lock:
+        if _model is None or _model.version != attached.version:
+            _model = ImplicitALSModel.from_attached(attached)
+        return _model
+
+
+def train_and_publish() -> str:
+    """Offline job: đọc interactions, train, publish vào model store"""
+    from app.database.database import SessionLocal
+    from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
+
+    handle = get_model_handle(IMPLICIT_ALS_MODEL)
+    if handle is None:
+        raise ValueError("MODEL_STORE_DIR is not configured")
+
+    db = SessionLocal()
+    try:
+        recommender = CRAFFTASSISTRecommendationSystem(db)
+        interactions_df = recommender.get_user_interactions()
+    finally:
+        db.close()
+    if interactions_df.empty:
+        raise ValueError("No interactions to train on")
+
+    started = time.perf_counter()
+    model = train_implicit_als(interactions_df)
+    handle.publish(model.version, model.to_arrays(), {
+        'factors': model.factors,
+        'regularization': model.regularization,
+        'alpha': model.alpha,
+        'iterations': ALS_ITERATIONS,
+        'rows': int(len(interactions_df)),
+    })
+    print(f"✅ Trained implicit ALS {model.version}: {len(model.user_ids)} users, {len(model.item_ids)} items, "
+          f"{model.factors} factors in {time.perf_counter() - started:.1f}s")
+    return model.version
+
+
+if __name__ == "__main__":
+    try:
+        train_and_publish()
+    except ValueError as e:
+        print(f"❌ {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,294 @@
+"""
+Compact binary snapshot cho interaction data (Course_Enrollment + Appointments)
+
+Một snapshot là MỘT file duy nhất:
+    magic (8 bytes) | header length (uint64) | JSON header | arrays (aligned 64 bytes)
+
+Arrays (tất cả contiguous, sort theo user_code -> item_type -> item_code):
+    user_codes  int32    interned user id (index vào user_ids)
+    item_codes  int32    interned item id (index vào item_ids)
+    ratings     float32  rating 0.0 - 1.0
+    days        int32    interaction_date theo ngày kể từ 1970-01-01 (DAY_NONE nếu NULL)
+    item_types  uint8    index vào ITEM_TYPES
+    user_offsets int64   CSR offsets: rows của user u nằm trong [user_offsets[u], user_offsets[u + 1])
+    user_ids    S<n>     id dictionary của users (đã sort -> lookup bằng searchsorted)
+    item_ids    S<n>     id dictionary của items (courses + consultants)
+
+Refresh job ghi file tạm rồi os.replace() sang đường dẫn chính (atomic). Workers mở
+bằng np.memmap read-only nên khởi động gần như tức thì và share pages qua OS page cache.
+"""
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_MAGIC = b"WDPSNAP1"
+SNAPSHOT_FORMAT = 1
+ARRAY_ALIGNMENT = 64
+ITEM_TYPES = ('course', 'consultant')
+DAY_NONE = np.iinfo(np.int32).min
+
+INTERACTION_SNAPSHOT_PATH = os.getenv("INTERACTION_SNAPSHOT_PATH", "")
+
+
+def _align(offset: int) -> int:
+    return (offset + ARRAY_ALIGNMENT - 1) // ARRAY_ALIGNMENT * ARRAY_ALIGNMENT
+
+
+def _encode_ids(ids: np.ndarray) -> np.ndarray:
+    """Chuyển array id (str) thành fixed-width bytes để memmap được"""
+    if len(ids) == 0:
+        return np.zeros(0, dtype='S1')
+    return np.char.encode(ids.astype('U'), 'utf-8')
+
+
+def _build_user_offsets(user_codes: np.ndarray, num_users: int) -> np.ndarray:
+    """CSR offsets trên user_codes đã sort"""
+    return np.searchsorted(user_codes, np.arange(num_users + 1), side='left').astype(np.int64)
+
+
+class InteractionSnapshot:
+    """Read-only view (np.memmap) trên một interaction snapshot file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic = f.read(len(SNAPSHOT_MAGIC))
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not an interaction snapshot")
+            (header_length,) = struct.unpack('<Q', f.read(8))
+            self.header = json.loads(f.read(header_length).decode('utf-8'))
+
+        if self.header.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format: {self.header.get('format')}")
+
+        self.version = self.header['version']
+        self.created_at = self.header['created_at']
+        self.arrays: Dict[str, np.ndarray] = {}
+        for name, spec in self.header['arrays'].items():
+            shape = tuple(spec['shape'])
+            if shape[0] == 0:
+                self.arrays[name] = np.zeros(shape, dtype=spec['dtype'])
+            else:
+                self.arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r', offset=spec['offset'], shape=shape)
+
+        self.user_codes = self.arrays['user_codes']
+        self.item_codes = self.arrays['item_codes']
+        self.ratings = self.arrays['ratings']
+        self.days = self.arrays['days']
+        self.item_types = self.arrays['item_types']
+        self.user_ids = self.arrays['user_ids']
+        self.item_ids = self.arrays['item_ids']
+        if 'user_offsets' in self.arrays:
+            self.user_offsets = self.arrays['user_offsets']
+        else:
+            self.user_offsets = _build_user_offsets(self.user_codes, len(self.user_ids))
+
+    def __len__(self) -> int:
+        return int(self.header['rows'])
+
+    @property
+    def num_users(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def num_items(self) -> int:
+        return len(self.item_ids)
+
+    @staticmethod
+    def _lookup(dictionary: np.ndarray, key: str) -> int:
+        if len(dictionary) == 0:
+            return -1
+        encoded = str(key).encode('utf-8')
+        idx = int(np.searchsorted(dictionary, encoded))
+        if idx < len(dictionary) and dictionary[idx] == encoded:
+            return idx
+        return -1
+
+    def user_code(self, user_id: str) -> int:
+        """Interned code của user_id, -1 nếu user không có trong snapshot"""
+        return self._lookup(self.user_ids, user_id)
+
+    def item_code(self, item_id: str) -> int:
+        """Interned code của item_id, -1 nếu item không có trong snapshot"""
+        return self._lookup(self.item_ids, item_id)
+
+    def item_type_code(self, item_type: str) -> int:
+        return ITEM_TYPES.index(item_type)
+
+    def decode_user_ids(self, codes: np.ndarray) -> np.ndarray:
+        return np.char.decode(self.user_ids[codes], 'utf-8').astype(object)
+
+    def decode_item_ids(self, codes: np.ndarray) -> np.ndarray:
+        return np.char.decode(self.item_ids[codes], 'utf-8').astype(object)
+
+    def _rows_to_dataframe(self, rows) -> pd.DataFrame:
+        user_codes = np.asarray(self.user_codes[rows])
+        if len(user_codes) == 0:
+            return pd.DataFrame()
+        days = np.asarray(self.days[rows]).astype(np.int64)
+        dates = days.astype('datetime64[D]').astype('datetime64[ns]')
+        dates[days == DAY_NONE] = np.datetime64('NaT')
+        return pd.DataFrame({
+            'user_id': self.decode_user_ids(user_codes),
+            'item_id': self.decode_item_ids(np.asarray(self.item_codes[rows])),
+            'item_type': np.asarray(ITEM_TYPES, dtype=object)[np.asarray(self.item_types[rows])],
+            'rating': np.asarray(self.ratings[rows]).astype(np.float64),
+            'interaction_date': dates
+        })
+
+    def user_rows(self, user_id: str) -> slice:
+        """Khoảng rows của user (O(log users) lookup + O(1) offsets)"""
+        code = self.user_code(user_id)
+        if code < 0:
+            return slice(0, 0)
+        return slice(int(self.user_offsets[code]), int(self.user_offsets[code + 1]))
+
+    def user_slice(self, user_id: str) -> pd.DataFrame:
+        """Interactions của một user, không phụ thuộc tổng số interactions"""
+        return self._rows_to_dataframe(self.user_rows(user_id))
+
+    def to_dataframe(self, item_type: Optional[str] = None) -> pd.DataFrame:
+        """
+        Dựng lại DataFrame cùng schema với get_user_interactions()
+        (interaction_date chỉ có độ phân giải theo ngày)
+        """
+        if item_type is None:
+            return self._rows_to_dataframe(slice(None))
+        rows = np.flatnonzero(np.asarray(self.item_types) == self.item_type_code(item_type))
+        return self._rows_to_dataframe(rows)
+
+    @staticmethod
+    def write(interactions_df: pd.DataFrame, path: str) -> str:
+        """Ghi interactions DataFrame thành snapshot file (atomic), trả về version"""
+        df = interactions_df
+        if df.empty:
+            df = pd.DataFrame(columns=['user_id', 'item_id', 'item_type', 'rating', 'interaction_date'])
+
+        user_ids, user_codes = np.unique(df['user_id'].astype(str).to_numpy(dtype=object), return_inverse=True)
+        item_ids, item_codes = np.unique(df['item_id'].astype(str).to_numpy(dtype=object), return_inverse=True)
+        item_types = df['item_type'].map({name: code for code, name in enumerate(ITEM_TYPES)})
+        if item_types.isna().any():
+            raise ValueError(f"Unknown item_type in interactions: {set(df['item_type']) - set(ITEM_TYPES)}")
+
+        dates = pd.to_datetime(df['interaction_date'], utc=True)
+        days = np.full(len(df), DAY_NONE, dtype=np.int64)
+        valid = dates.notna().to_numpy()
+        if valid.any():
+            days[valid] = dates[valid].dt.tz_convert(None).to_numpy().astype('datetime64[D]').astype(np.int64)
+
+        arrays = {
+            'user_codes': user_codes.reshape(-1).astype(np.int32),
+            'item_codes': item_codes.reshape(-1).astype(np.int32),
+            'ratings': df['rating'].fillna(0).to_numpy().astype(np.float32),
+            'days': days.astype(np.int32),
+            'item_types': item_types.to_numpy().astype(np.uint8),
+        }
+        order = np.lexsort((arrays['item_codes'], arrays['item_types'], arrays['user_codes']))
+        arrays = {name: np.ascontiguousarray(values[order]) for name, values in arrays.items()}
+        arrays['user_offsets'] = _build_user_offsets(arrays['user_codes'], len(user_ids))
+        arrays['user_ids'] = _encode_ids(user_ids)
+        arrays['item_ids'] = _encode_ids(item_ids)
+
+        digest = hashlib.sha1()
+        for name in sorted(arrays):
+            digest.update(name.encode('utf-8'))
+            digest.update(arrays[name].tobytes())
+        version = digest.hexdigest()[:16]
+
+        header = {
+            'format': SNAPSHOT_FORMAT,
+            'version': version,
+            'created_at': datetime.utcnow().isoformat(),
+            'rows': int(len(df)),
+            'item_types': list(ITEM_TYPES),
+            'arrays': {}
+        }
+        # Offsets phụ thuộc độ dài header -> tính lặp đến khi ổn định
+        header_length = 0
+        while True:
+            offset = _align(len(SNAPSHOT_MAGIC) + 8 + header_length)
+            for name, values in arrays.items():
+                header['arrays'][name] = {'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': offset}
+                offset = _align(offset + values.nbytes)
+            header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+            if len(header_bytes) == header_length:
+                break
+            header_length = len(header_bytes)
+
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack('<Q', header_length))
+            f.write(header_bytes)
+            for name, values in arrays.items():
+                f.seek(header['arrays'][name]['offset'])
+                f.write(values.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return version
+
+
+_snapshot_lock = threading.Lock()
+_snapshot: Optional[InteractionSnapshot] = None
+_snapshot_stat = None
+
+
+def get_interaction_snapshot(path: Optional[str] = None) -> Optional[InteractionSnapshot]:
+    """
+    Snapshot dùng chung trong process; tự mở lại khi refresh job đã thay file.
+    Trả về None nếu chưa cấu hình INTERACTION_SNAPSHOT_PATH hoặc file chưa tồn tại.
+    """
+    global _snapshot, _snapshot_stat
+    path = path or INTERACTION_SNAPSHOT_PATH
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    stat_key = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot_stat != stat_key:
+            try:
+                _snapshot = InteractionSnapshot(path)
+                _snapshot_stat = stat_key
+                print(f"📦 Opened interaction snapshot {_snapshot.version}: {len(_snapshot)} rows, {_snapshot.num_users} users, {_snapshot.num_items} items")
+            except Exception as e:
+                print(f"Error opening interaction snapshot {path}: {str(e)}")
+                return None
+        return _snapshot
+
+
+def refresh_interaction_snapshot(path: Optional[str] = None) -> str:
+    """Refresh job: đọc interactions từ Postgres và ghi snapshot mới"""
+    from app.database.database import SessionLocal
+    from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
+
+    path = path or INTERACTION_SNAPSHOT_PATH
+    if not path:
+        raise ValueError("INTERACTION_SNAPSHOT_PATH is not configured")
+
+    db = SessionLocal()
+    try:
+        recommender = CRAFFTASSISTRecommendationSystem(db)
+        interactions_df = recommender.get_user_interactions()
+    finally:
+        db.close()
+
+    version = InteractionSnapshot.write(interactions_df, path)
+    print(f"✅ Wrote interaction snapshot {version} ({len(interactions_df)} rows) to {path}")
+    return version
+
+
+if __name__ == "__main__":
+    refresh_interaction_snapshot(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,262 @@
+"""
+In-memory interaction state cho collaborative filtering: base DataFrame + overlay các deltas
+
+Base được load một lần (snapshot hoặc Postgres) và dùng lại giữa các requests. Events
+(enrollment progress, appointment status) ghi vào overlay theo key (user_id, item_type, item_id)
+trong O(1): interaction mới nhất của cặp user-item thay thế các rows cũ của cặp đó. Change feed
+(app.service.change_feed) thay toàn bộ rows của một (user_id, item_type) bằng rows đọc lại từ database
+(replace_user). DataFrame hợp nhất (base - keys bị thay + rows mới) chỉ được dựng lại một lần sau mỗi đợt
+thay đổi, và deltas được compact vào base khi vượt INTERACTION_STATE_COMPACT_THRESHOLD.
+
+Rebuild khi snapshot chưa đổi version không đọc lại snapshot (nó không chứa các deltas): base mới là dữ liệu
+hợp nhất của state cũ, nên events / change feed đã áp dụng vẫn còn. State có base rỗng vẫn được giữ (để nhận
+events) nhưng chỉ coi là còn hiệu lực trong INTERACTION_STATE_EMPTY_RETRY_SECONDS (lần load lỗi trả về rỗng).
+
+Mỗi item_type có một Bloom filter các users có interactions (build từ base, thêm users qua events / change
+feed), nên might_have_interactions() trả lời "user chắc chắn chưa có interaction nào" mà không cần dựng
+DataFrame hay user-item matrix.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from app.service.bloom_filter import BloomFilter
+
+INTERACTION_STATE_MAX_AGE_SECONDS = float(os.getenv("INTERACTION_STATE_MAX_AGE_SECONDS", "300"))
+INTERACTION_STATE_REBUILD_SECONDS = float(os.getenv("INTERACTION_STATE_REBUILD_SECONDS", "3600"))
+INTERACTION_STATE_EMPTY_RETRY_SECONDS = float(os.getenv("INTERACTION_STATE_EMPTY_RETRY_SECONDS", "30"))
+INTERACTION_STATE_COMPACT_THRESHOLD = int(os.getenv("INTERACTION_STATE_COMPACT_THRESHOLD", "5000"))
+INTERACTION_BLOOM_FP_RATE = float(os.getenv("INTERACTION_BLOOM_FP_RATE", "0.01"))
+
+INTERACTION_COLUMNS = ['user_id', 'item_id', 'item_type', 'rating', 'interaction_date']
+
+InteractionKey = Tuple[str, str, str]
+UserItemTypeKey = Tuple[str, str]
+
+
+def course_rating(progress_percentage: Optional[float]) -> float:
+    """Rating của một enrollment: progress 0-100 -> 0.0-1.0"""
+    return (progress_percentage or 0) / 100.0
+
+
+def appointment_rating(status: Optional[str]) -> float:
+    """Rating của một appointment: completed -> 0.8, còn lại -> 0.1"""
+    return 0.8 if status == 'completed' else 0.1
+
+
+class InteractionState:
+    """Interactions (courses + consultants) dùng chung trong process, nhận deltas theo user-item"""
+
+    def __init__(self, base_df: pd.DataFrame, source_version: Optional[str] = None):
+        self._base = base_df if not base_df.empty else pd.DataFrame(columns=INTERACTION_COLUMNS)
+        self.empty_base = base_df.empty
+        self._overlay: Dict[InteractionKey, Dict] = {}
+        self._replaced: Dict[UserItemTypeKey, List[Dict]] = {}
+        self._lock = threading.Lock()
+        self._materialized: Optional[pd.DataFrame] = None
+        self._materialized_version = -1
+        self.source_version = source_version
+        self.version = 0
+        self.built_at = time.time()
+        self.synced_at = self.built_at
+        self.events_applied = 0
+        self.users_replaced = 0
+        self._user_filters: Dict[str, BloomFilter] = {
+            item_type: BloomFilter.from_ids(group['user_id'], INTERACTION_BLOOM_FP_RATE)
+            for item_type, group in self._base.groupby('item_type')
+        }
+
+    def _add_user(self, item_type: str, user_id: str) -> None:
+        bloom = self._user_filters.get(item_type)
+        if bloom is None:
+            bloom = self._user_filters[item_type] = BloomFilter.from_ids([], INTERACTION_BLOOM_FP_RATE)
+        bloom.add(user_id)
+
+    @property
+    def data_version(self) -> Tuple:
+        """Token đổi khi dữ liệu hợp nhất đổi (state mới hoặc delta mới), không cần dựng DataFrame"""
+        return self.source_version, self.built_at, self.version
+
+    def might_have_interactions(self, user_id: str, item_type: Optional[str] = None) -> bool:
+        """False = user chắc chắn không có interaction (của item_type, None = mọi loại)"""
+        filters = self._user_filters.values() if item_type is None else [self._user_filters.get(item_type)]
+        return any(bloom is not None and str(user_id) in bloom for bloom in filters)
+
+    def __len__(self) -> int:
+        return len(self.to_dataframe())
+
+    def apply(self, user_id: str, item_type: str, item_id: str, rating: float, interaction_date=None) -> None:
+        """Upsert interaction của (user, item) - O(1)"""
+        key = (str(user_id), item_type, str(item_id))
+        with self._lock:
+            self._overlay[key] = {
+                'user_id': key[0],
+                'item_id': key[2],
+                'item_type': item_type,
+                'rating': float(rating),
+                'interaction_date': interaction_date
+            }
+            self._add_user(item_type, key[0])
+            self.version += 1
+            self.events_applied += 1
+
+    def replace_user(self, user_id: str, item_type: str, records: List[Dict]) -> None:
+        """Thay mọi interactions (user, item_type) bằng records (đọc lại từ database, đã gồm mọi event trước đó)"""
+        user_id = str(user_id)
+        with self._lock:
+            self._replaced[(user_id, item_type)] = list(records)
+            if records:
+                self._add_user(item_type, user_id)
+            for key in [key for key in self._overlay if key[0] == user_id and key[1] == item_type]:
+                del self._overlay[key]
+            self.version += 1
+            self.users_replaced += 1
+
+    def adopt_deltas(self, previous: "InteractionState", since_version: int) -> None:
+        """
+        Thêm deltas của state cũ mà state này chưa có: events tới state cũ (sau since_version) trong lúc state này
+        được build. Deltas là upsert nên áp lại lên base đã chứa chúng không đổi kết quả; delta mới hơn của state
+        này được giữ
+        """
+        with previous._lock:
+            if previous.version == since_version:
+                return
+            overlay = dict(previous._overlay)
+            replaced = dict(previous._replaced)
+        with self._lock:
+            for key, records in replaced.items():
+                if key not in self._replaced:
+                    self._replaced[key] = records
+                    if records:
+                        self._add_user(key[1], key[0])
+            for key, record in overlay.items():
+                if key not in self._overlay and key[:2] not in self._replaced:
+                    self._overlay[key] = record
+                    self._add_user(key[1], key[0])
+            self.version += 1
+
+    def mark_synced(self) -> None:
+        """Change feed đã merge mọi thay đổi tới thời điểm này -> chưa cần reload toàn bộ"""
+        self.synced_at = time.time()
+
+    def _pending_rows(self) -> int:
+        return len(self._overlay) + sum(len(records) for records in self._replaced.values())
+
+    def _merge(self) -> pd.DataFrame:
+        if not self._overlay and not self._replaced:
+            return self._base
+        delta_rows = [record for records in self._replaced.values() for record in records]
+        delta_rows.extend(self._overlay.values())
+        delta_df = pd.DataFrame(delta_rows, columns=INTERACTION_COLUMNS)
+        if self._base.empty:
+            return delta_df
+        user_ids = self._base['user_id'].astype(str)
+        base_keys = pd.MultiIndex.from_arrays([user_ids, self._base['item_type'], self._base['item_id'].astype(str)])
+        keep = ~base_keys.isin(list(self._overlay.keys()))
+        if self._replaced:
+            user_type_keys = pd.MultiIndex.from_arrays([user_ids, self._base['item_type']])
+            keep &= ~user_type_keys.isin(list(self._replaced.keys()))
+        return pd.concat([self._base[keep], delta_df], ignore_index=True)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Interactions hiện tại (base + deltas); dựng lại tối đa một lần mỗi version"""
+        with self._lock:
+            if self._materialized_version != self.version:
+                self._materialized = self._merge()
+                self._materialized_version = self.version
+                if self._pending_rows() >= INTERACTION_STATE_COMPACT_THRESHOLD:
+                    self._base = self._materialized
+                    self._overlay = {}
+                    self._replaced = {}
+            return self._materialized
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'base_rows': len(self._base),
+                'overlay_rows': len(self._overlay),
+                'replaced_user_item_types': len(self._replaced),
+                'events_applied': self.events_applied,
+                'users_replaced': self.users_replaced,
+                'user_filter_bytes': sum(bloom.nbytes for bloom in self._user_filters.values()),
+                'version': self.version,
+                'age_seconds': time.time() - self.built_at,
+                'sync_age_seconds': time.time() - self.synced_at
+            }
+
+
+_state_lock = threading.Lock()
+# Chỉ một request build state tại một thời điểm (các requests khác chờ rồi dùng state vừa build)
+_load_lock = threading.Lock()
+_state: Optional[InteractionState] = None
+
+
+def _is_fresh(state: Optional[InteractionState], source_version: Optional[str]) -> bool:
+    now = time.time()
+    if state is None or state.source_version != source_version:
+        return False
+    if state.empty_base and now - state.built_at >= INTERACTION_STATE_EMPTY_RETRY_SECONDS:
+        return False
+    return (now - state.synced_at < INTERACTION_STATE_MAX_AGE_SECONDS
+            and now - state.built_at < INTERACTION_STATE_REBUILD_SECONDS)
+
+
+def get_interaction_state(load: Callable[[], pd.DataFrame], source_version: Optional[str] = None) -> InteractionState:
+    """
+    State dùng chung: build lại khi chưa có, snapshot đổi version, không được sync (change feed) trong
+    INTERACTION_STATE_MAX_AGE_SECONDS, hoặc quá INTERACTION_STATE_REBUILD_SECONDS kể từ lần build.
+    Cùng snapshot version -> không gọi load(), base mới là dữ liệu hợp nhất của state cũ (giữ deltas)
+    """
+    global _state
+    with _state_lock:
+        state = _state
+        if _is_fresh(state, source_version):
+            return state
+
+    with _load_lock:
+        previous = _state
+        if _is_fresh(previous, source_version):
+            return previous  # request khác vừa build xong
+
+        carry = previous is not None and source_version is not None and previous.source_version == source_version
+        if carry:
+            since_version = previous.version
+            state = InteractionState(previous.to_dataframe(), source_version)
+        else:
+            state = InteractionState(load(), source_version)
+        with _state_lock:
+            _state = state
+        if carry:
+            state.adopt_deltas(previous, since_version)
+    return state
+
+
+def current_interaction_state() -> Optional[InteractionState]:
+    """State đã build (None nếu chưa có request nào load) - dùng cho event ingestion"""
+    return _state
+
+
+def might_have_interactions(user_id: str, item_type: Optional[str] = None,
+                            source_version: Optional[str] = None) -> bool:
+    """
+    False chỉ khi state dùng chung còn hiệu lực (cùng điều kiện get_interaction_state) và Bloom filter của nó
+    chắc chắn không chứa user; chưa có state / state hết hạn -> True (caller chạy đường bình thường)
+    """
+    state = _state
+    if not _is_fresh(state, source_version):
+        return True
+    return state.might_have_interactions(user_id, item_type)
+
+
+def interaction_state_stats() -> Dict:
+    state = _state
+    return state.stats() if state is not None else {}
+
+
+def invalidate_interaction_state() -> None:
+    global _state
+    with _state_lock:
+        _state = None
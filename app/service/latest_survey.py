@@ -0,0 +1,166 @@
+"""
+Latest survey attempt của từng user: DISTINCT ON (user_id) query + in-process LRU
+
+Mọi recommendation path đều cần risk level mới nhất của user trước tiên. Thay vì load toàn bộ
+Survey_Attempts rồi lấy iloc[0], mỗi user chỉ cần một point query (đã gồm total_surveys_taken),
+và kết quả được cache LRU (có TTL). Cache entry bị invalidate khi có attempt mới của user.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.database.routing import POINT, routed
+
+LATEST_SURVEY_CACHE_SIZE = int(os.getenv("LATEST_SURVEY_CACHE_SIZE", "10000"))
+LATEST_SURVEY_TTL_SECONDS = float(os.getenv("LATEST_SURVEY_TTL_SECONDS", "60"))
+
+_MISSING = object()
+
+
+def user_type_for_age(age: Optional[int]) -> List[str]:
+    """Target audience của user theo tuổi (dùng cho audience boost)"""
+    return ['adult', 'parents', 'teacher'] if age is not None and age > 23 else ['youth', 'students']
+
+
+class LatestSurveyCache:
+    """LRU cache user_id -> latest survey (hoặc None nếu user chưa làm survey)"""
+
+    def __init__(self, max_size: int = LATEST_SURVEY_CACHE_SIZE, ttl_seconds: float = LATEST_SURVEY_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str):
+        """Trả về cached value, hoặc _MISSING nếu chưa có / đã hết hạn"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.time() - entry[1] > self.ttl_seconds:
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, user_id: str):
+        """Như get() nhưng không tính hit/miss và không đổi LRU order"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.time() - entry[1] > self.ttl_seconds:
+                return _MISSING
+            return entry[0]
+
+    def put(self, user_id: str, value: Optional[Dict]) -> None:
+        with self._lock:
+            self._entries[user_id] = (value, time.time())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+latest_survey_cache = LatestSurveyCache()
+
+
+def fetch_latest_survey(db: Session, user_id: str) -> Optional[Dict]:
+    """Latest attempt của user (cùng thứ tự completed_at DESC như get_user_survey_data) + tổng số attempts"""
+    row = db.execute(routed("""
+        SELECT DISTINCT ON (sa.user_id)
+            sa.user_id,
+            sa.test_survey_id,
+            sa.total_score,
+            sa.risk_level,
+            sa.completed_at,
+            u.first_name,
+            u.last_name,
+            u.age,
+            ts.category_id,
+            COUNT(*) OVER (PARTITION BY sa.user_id) AS total_surveys_taken
+        FROM "Survey_Attempts" sa
+        JOIN "Users" u ON sa.user_id = u.id
+        JOIN "Test_Survey" ts ON sa.test_survey_id = ts.id
+        WHERE sa.user_id = :user_id AND u.is_deleted = false
+        ORDER BY sa.user_id, sa.completed_at DESC
+    """, POINT), {'user_id': user_id}).fetchone()
+
+    if row is None:
+        return None
+    return {
+        'user_id': str(row.user_id),
+        'test_survey_id': str(row.test_survey_id),
+        'category_id': str(row.category_id),
+        'total_score': row.total_score,
+        'risk_level': row.risk_level,
+        'completed_at': row.completed_at,
+        'first_name': row.first_name,
+        'last_name': row.last_name,
+        'age': row.age,
+        'user_type': user_type_for_age(row.age),
+        'total_surveys_taken': int(row.total_surveys_taken)
+    }
+
+
+def get_latest_survey(db: Session, user_id: str) -> Optional[Dict]:
+    """Latest survey của user qua LRU cache (None nếu user chưa có survey)"""
+    cached = latest_survey_cache.get(user_id)
+    if cached is not _MISSING:
+        return cached
+    latest = fetch_latest_survey(db, user_id)
+    latest_survey_cache.put(user_id, latest)
+    return latest
+
+
+def invalidate_latest_survey(user_id: str) -> None:
+    """Gọi khi user có survey attempt mới"""
+    latest_survey_cache.invalidate(str(user_id))
+
+
+def peek_latest_survey(user_id: str) -> Optional[Dict]:
+    """Cached latest survey (None nếu không có trong cache hoặc user chưa có survey)"""
+    cached = latest_survey_cache.peek(str(user_id))
+    return None if cached is _MISSING else cached
+
+
+def record_survey_completion(previous: Optional[Dict], user_id: str, test_survey_id: str, category_id: Optional[str],
+                             total_score: Optional[int], risk_level: str, completed_at=None) -> bool:
+    """
+    Cập nhật latest survey của user tại chỗ khi có survey completion event (O(1), không query).
+    Chỉ làm được khi đã có entry trước đó (tên, tuổi, tổng số surveys); nếu không thì invalidate.
+    """
+    user_id = str(user_id)
+    if previous is None:
+        latest_survey_cache.invalidate(user_id)
+        return False
+    latest_survey_cache.put(user_id, {
+        **previous,
+        'test_survey_id': str(test_survey_id),
+        'category_id': str(category_id) if category_id is not None else previous.get('category_id'),
+        'total_score': total_score,
+        'risk_level': risk_level,
+        'completed_at': completed_at,
+        'total_surveys_taken': previous['total_surveys_taken'] + 1
+    })
+    return True
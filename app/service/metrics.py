@@ -0,0 +1,207 @@
+"""
+Per-stage latency metrics cho recommendation pipeline, export theo Prometheus text format
+
+- stage_timer(stage, engine) / @timed(stage, engine): đo một stage bằng time.perf_counter và ghi vào
+  histogram recommendation_stage_seconds{endpoint, engine, stage} (+ counter lỗi)
+- endpoint / engine là contextvars: route set endpoint một lần, stage lồng nhau kế thừa engine của
+  stage ngoài -> call sites không phải truyền tags
+- register_gauge(): số liệu từ các cache / single-flight, đọc lúc render /metrics
+
+Mỗi observe chỉ là perf_counter + bisect + cộng dưới một lock, đủ rẻ để bật trong production.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_endpoint: ContextVar[str] = ContextVar("metrics_endpoint", default="internal")
+_current_engine: ContextVar[str] = ContextVar("metrics_engine", default="none")
+# Per-request sink (profiling mode): list nhận (stage, engine, seconds) của request hiện tại
+_stage_sink: ContextVar[Optional[list]] = ContextVar("metrics_stage_sink", default=None)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labelvalues -> [count mỗi bucket (không cộng dồn) + 1 cho +Inf, sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][position] += 1
+            series[1] += value
+
+    def snapshot(self, *labelvalues: str) -> Optional[Dict]:
+        """count / sum của một series (dùng cho profiling + tests)"""
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                return None
+            return {'count': sum(series[0]), 'sum': series[1]}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labelvalues, (list(series[0]), series[1])) for labelvalues, series in self._series.items())
+        for labelvalues, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames + ('le',), labelvalues + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labelvalues)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labelvalues)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Union[Counter, Histogram]] = {}
+        self._gauges: Dict[str, Tuple[str, str, Callable]] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, help_text, labelnames, buckets))
+
+    def register_gauge(self, name: str, help_text: str, fn: Callable[[], Union[float, Dict[str, float]]], labelname: str = "kind") -> None:
+        """fn() trả về một số, hoặc dict label value -> số (một label tên labelname)"""
+        with self._lock:
+            self._gauges[name] = (help_text, labelname, fn)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            gauges = list(self._gauges.items())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, (help_text, labelname, fn) in gauges:
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"Error collecting gauge {name}: {str(e)}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for label, v in sorted(value.items()):
+                    lines.append(f"{name}{_format_labels((labelname,), (label,))} {float(v)}")
+            else:
+                lines.append(f"{name} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "recommendation_stage_seconds", "Latency of recommendation pipeline stages", ("endpoint", "engine", "stage")
+)
+STAGE_ERRORS = registry.counter(
+    "recommendation_stage_errors_total", "Recommendation pipeline stages that raised", ("endpoint", "engine", "stage")
+)
+REQUEST_SECONDS = registry.histogram(
+    "http_request_seconds", "HTTP request latency", ("endpoint", "method", "status")
+)
+
+
+def set_endpoint(endpoint: str) -> None:
+    """Tag endpoint cho mọi stage chạy trong request hiện tại"""
+    _current_endpoint.set(endpoint)
+
+
+def _record(stage: str, engine: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, _current_endpoint.get(), engine, stage)
+    sink = _stage_sink.get()
+    if sink is not None:
+        sink.append({'stage': stage, 'engine': engine, 'seconds': seconds})
+
+
+def observe_stage(stage: str, seconds: float, engine: Optional[str] = None) -> None:
+    _record(stage, engine or _current_engine.get(), seconds)
+
+
+@contextmanager
+def stage_timer(stage: str, engine: Optional[str] = None):
+    """Đo một stage; engine=None -> kế thừa engine của stage bao ngoài"""
+    engine = engine or _current_engine.get()
+    token = _current_engine.set(engine)
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(_current_endpoint.get(), engine, stage)
+        raise
+    finally:
+        _record(stage, engine, time.perf_counter() - started)
+        _current_engine.reset(token)
+
+
+def timed(stage: str, engine: Optional[str] = None):
+    """Decorator dạng stage_timer cho cả một method"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage, engine):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def capture_stages():
+    """Thu thập stage timings của riêng request hiện tại (ngoài histogram chung)"""
+    stages: list = []
+    token = _stage_sink.set(stages)
+    try:
+        yield stages
+    finally:
+        _stage_sink.reset(token)
+
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,180 @@
+"""
+Model store dùng chung giữa các workers: numpy arrays publish một lần, workers attach read-only (memmap)
+
+Layout trên đĩa (nên đặt MODEL_STORE_DIR trên tmpfs, vd. /dev/shm/wdp-models, để là shared memory):
+    <root>/<model>/<version>/<array>.npy    arrays (np.save, không nén -> np.load(mmap_mode='r'))
+    <root>/<model>/<version>/meta.json      metadata (JSON)
+    <root>/<model>/CURRENT                  version hiện tại
+
+publish() ghi vào thư mục tạm rồi rename sang <version> và os.replace() file CURRENT: đổi version là
+atomic, workers không bao giờ thấy model ghi dở. Mỗi worker giữ một ModelHandle cho mỗi model;
+handle.get() stat file CURRENT và attach lại khi version đổi. Pages của các file .npy nằm trong OS page
+cache nên thêm worker gần như không tốn thêm bộ nhớ. Version cũ bị xoá sau MODEL_STORE_KEEP_VERSIONS lần
+publish (workers đang map file cũ vẫn đọc được cho đến khi bỏ mapping).
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+import numpy as np
+
+MODEL_STORE_DIR = os.getenv("MODEL_STORE_DIR", "")
+MODEL_STORE_KEEP_VERSIONS = int(os.getenv("MODEL_STORE_KEEP_VERSIONS", "3"))
+
+_CURRENT = "CURRENT"
+_META = "meta.json"
+
+
+class AttachedModel:
+    """Một version của model, arrays là np.memmap read-only"""
+
+    def __init__(self, name: str, version: str, path: str):
+        self.name = name
+        self.version = version
+        self.path = path
+        with open(os.path.join(path, _META), encoding="utf-8") as f:
+            self.meta: Dict = json.load(f)
+        self.arrays: Dict[str, np.ndarray] = {
+            array_name: np.load(os.path.join(path, f"{array_name}.npy"), mmap_mode="r", allow_pickle=False)
+            for array_name in self.meta["arrays"]
+        }
+        self.attached_at = time.time()
+
+    def __getitem__(self, array_name: str) -> np.ndarray:
+        return self.arrays[array_name]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(values.nbytes for values in self.arrays.values())
+
+
+class ModelStore:
+    """Publish / attach các model (dict các numpy arrays + metadata) dưới một thư mục gốc"""
+
+    def __init__(self, root: str, keep_versions: int = MODEL_STORE_KEEP_VERSIONS):
+        self.root = root
+        self.keep_versions = keep_versions
+
+    def _model_dir(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def current_version(self, name: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self._model_dir(name), _CURRENT), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def publish(self, name: str, version: str, arrays: Dict[str, np.ndarray], meta: Optional[Dict] = None) -> str:
+        """Ghi model version rồi trỏ CURRENT sang (atomic); publish lại cùng version là no-op"""
+        model_dir = self._model_dir(name)
+        version_dir = os.path.join(model_dir, version)
+        os.makedirs(model_dir, exist_ok=True)
+
+        if not os.path.isdir(version_dir):
+            tmp_dir = os.path.join(model_dir, f".tmp-{version}-{uuid.uuid4().hex[:8]}")
+            os.makedirs(tmp_dir)
+            for array_name, values in arrays.items():
+                np.save(os.path.join(tmp_dir, f"{array_name}.npy"), np.ascontiguousarray(values), allow_pickle=False)
+            with open(os.path.join(tmp_dir, _META), "w", encoding="utf-8") as f:
+                json.dump({**(meta or {}), "arrays": sorted(arrays), "published_at": time.time()}, f)
+            try:
+                os.rename(tmp_dir, version_dir)
+            except OSError:
+                # Worker khác vừa publish cùng version (cùng nội dung)
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        tmp_current = os.path.join(model_dir, f".{_CURRENT}-{uuid.uuid4().hex[:8]}")
+        with open(tmp_current, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_current, os.path.join(model_dir, _CURRENT))
+        self._prune(name, version)
+        return version
+
+    def _prune(self, name: str, current: str) -> None:
+        model_dir = self._model_dir(name)
+        versions = [
+            entry for entry in os.scandir(model_dir)
+            if entry.is_dir() and not entry.name.startswith(".") and entry.name != current
+        ]
+        versions.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in versions[max(self.keep_versions - 1, 0):]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def attach(self, name: str, version: Optional[str] = None) -> Optional[AttachedModel]:
+        """Attach version (mặc định CURRENT) read-only, None nếu chưa có"""
+        version = version or self.current_version(name)
+        if version is None:
+            return None
+        path = os.path.join(self._model_dir(name), version)
+        if not os.path.isdir(path):
+            return None
+        return AttachedModel(name, version, path)
+
+
+class ModelHandle:
+    """Model đã attach của worker hiện tại, tự refresh khi CURRENT trỏ sang version mới"""
+
+    def __init__(self, store: ModelStore, name: str):
+        self.store = store
+        self.name = name
+        self._lock = threading.Lock()
+        self._model: Optional[AttachedModel] = None
+        self._current_stat = None
+
+    def get(self) -> Optional[AttachedModel]:
+        try:
+            stat = os.stat(os.path.join(self.store._model_dir(self.name), _CURRENT))
+        except OSError:
+            return self._model
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if self._model is None or self._current_stat != stat_key:
+                self.refresh()
+                self._current_stat = stat_key
+            return self._model
+
+    def refresh(self) -> Optional[AttachedModel]:
+        """Attach lại version CURRENT (giữ model cũ nếu attach lỗi)"""
+        try:
+            model = self.store.attach(self.name)
+        except Exception as e:
+            print(f"Error attaching model {self.name}: {str(e)}")
+            return self._model
+        if model is not None and (self._model is None or model.version != self._model.version):
+            print(f"🧩 Attached model {self.name} {model.version} ({model.nbytes / 1024:.0f} KiB, shared)")
+            self._model = model
+        return self._model
+
+    def publish(self, version: str, arrays: Dict[str, np.ndarray], meta: Optional[Dict] = None) -> Optional[AttachedModel]:
+        """Publish rồi attach ngay version mới"""
+        self.store.publish(self.name, version, arrays, meta)
+        with self._lock:
+            self._current_stat = None
+            return self.refresh()
+
+
+_handles_lock = threading.Lock()
+_handles: Dict[str, ModelHandle] = {}
+
+
+def get_model_handle(name: str) -> Optional[ModelHandle]:
+    """Handle dùng chung trong worker, None nếu MODEL_STORE_DIR chưa cấu hình"""
+    if not MODEL_STORE_DIR:
+        return None
+    with _handles_lock:
+        handle = _handles.get(name)
+        if handle is None:
+            handle = _handles[name] = ModelHandle(ModelStore(MODEL_STORE_DIR), name)
+        return handle
+
+
+def model_store_stats() -> Dict[str, float]:
+    """Bytes đang map của mỗi model đã attach"""
+    with _handles_lock:
+        handles = list(_handles.values())
+    return {handle.name: float(handle._model.nbytes) for handle in handles if handle._model is not None}
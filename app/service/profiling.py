@@ -0,0 +1,160 @@
+"""
+On-demand profiling cho một recommendation request (chỉ admin)
+
+Bật bằng header `X-Profile: 1` hoặc query `?profile=1` (`only` thay cho `1` -> chỉ trả profile, bỏ payload),
+kèm header `X-Admin-Token` khớp PROFILING_ADMIN_TOKEN (không set env -> profiling tắt hoàn toàn).
+
+Request được chạy dưới cProfile (deterministic, chỉ thread đang xử lý request), không qua single-flight
+và result cache (đo chính lần tính của request này), response gồm:
+- stages: stage timings của riêng request này (từ app.service.metrics)
+- top_functions: top PROFILING_TOP_FUNCTIONS hàm theo cumulative time
+- sql: từng statement đã chạy với duration (không kèm params)
+
+ProfilingRoute bọc endpoint của mọi route trong router, nên mọi route (kể cả /demo/{user_id}) đều hỗ trợ.
+"""
+import asyncio
+import cProfile
+import hmac
+import os
+import pstats
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.service.metrics import capture_stages
+from app.service.result_cache import bypass_result_cache
+from app.service.single_flight import bypass_single_flight
+
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+PROFILING_TOP_FUNCTIONS = int(os.getenv("PROFILING_TOP_FUNCTIONS", "25"))
+PROFILING_MAX_SQL_LENGTH = 500
+
+PROFILE_MODES = ("1", "true", "only")
+
+# Mode của request hiện tại ("1"/"true": kèm payload, "only": chỉ profile), None nếu không profiling
+_profile_mode: ContextVar[Optional[str]] = ContextVar("profile_mode", default=None)
+# SQL statements của request đang được profile
+_sql_log: ContextVar[Optional[List[Dict]]] = ContextVar("profile_sql_log", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _sql_log.get() is not None:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    sql_log = _sql_log.get()
+    if sql_log is None:
+        return
+    starts = conn.info.get("profile_query_start")
+    if not starts:
+        return
+    sql_log.append({
+        'statement': " ".join(statement.split())[:PROFILING_MAX_SQL_LENGTH],
+        'duration_ms': (time.perf_counter() - starts.pop()) * 1000,
+        'rows': cursor.rowcount
+    })
+
+
+async def profiling_flag(request: Request):
+    """Router dependency: đọc flag profiling, chỉ cho phép khi admin token hợp lệ"""
+    mode = (request.headers.get("X-Profile") or request.query_params.get("profile") or "").lower()
+    if mode not in PROFILE_MODES:
+        return
+    token = request.headers.get("X-Admin-Token", "")
+    if not PROFILING_ADMIN_TOKEN or not hmac.compare_digest(token, PROFILING_ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Profiling is restricted to admins")
+    _profile_mode.set(mode)
+
+
+def _top_functions(profiler: cProfile.Profile, limit: int) -> List[Dict]:
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            'function': f"{os.path.relpath(filename) if filename.startswith(os.getcwd()) else filename}:{line}({name})",
+            'calls': nc,
+            'total_time_ms': tt * 1000,
+            'cumulative_time_ms': ct * 1000
+        }
+        for (filename, line, name), (cc, nc, tt, ct, callers) in rows
+    ]
+
+
+def run_profiled(fn: Callable, *args, **kwargs) -> Tuple[Any, Dict]:
+    """Chạy fn dưới cProfile + stage capture + SQL capture, trả về (result, profile)"""
+    profiler = cProfile.Profile()
+    sql_log: List[Dict] = []
+    sql_token = _sql_log.set(sql_log)
+    started = time.perf_counter()
+    try:
+        with capture_stages() as stages, bypass_single_flight(), bypass_result_cache():
+            profiler.enable()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                profiler.disable()
+    finally:
+        _sql_log.reset(sql_token)
+
+    return result, {
+        'total_ms': (time.perf_counter() - started) * 1000,
+        'stages': [{**stage, 'seconds': round(stage['seconds'], 6)} for stage in stages],
+        'top_functions': _top_functions(profiler, PROFILING_TOP_FUNCTIONS),
+        'sql': {
+            'count': len(sql_log),
+            'total_ms': sum(query['duration_ms'] for query in sql_log),
+            'statements': sql_log
+        }
+    }
+
+
+def profiled_endpoint(endpoint: Callable) -> Callable:
+    """Bọc một sync endpoint: chạy bình thường, hoặc dưới profiler nếu request bật profiling"""
+    if asyncio.iscoroutinefunction(endpoint):
+        # cProfile chỉ thấy thread hiện tại; async endpoints giữ nguyên
+        return endpoint
+
+    @wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        mode = _profile_mode.get()
+        if mode is None:
+            return endpoint(*args, **kwargs)
+        result, profile = run_profiled(endpoint, *args, **kwargs)
+        if isinstance(result, Response):
+            # vd. 304 Not Modified: giữ nguyên response, profile đi qua header
+            result.headers["X-Profile-Total-Ms"] = f"{profile['total_ms']:.1f}"
+            return result
+        if mode == "only":
+            profiled = JSONResponse({'profile': profile})
+        else:
+            profiled = JSONResponse({'profile': profile, 'result': jsonable_encoder(result)})
+        # Response trả về thay cho response FastAPI inject -> giữ headers endpoint đã set (ETag, Cache-Control)
+        _copy_headers(kwargs, profiled)
+        return profiled
+    return wrapper
+
+
+def _copy_headers(kwargs: Dict[str, Any], target: Response) -> None:
+    for value in kwargs.values():
+        if isinstance(value, Response):
+            for name, header in value.headers.items():
+                if name not in ("content-length", "content-type"):
+                    target.headers[name] = header
+
+
+class ProfilingRoute(APIRoute):
+    """Route class cho router: mọi endpoint đều hỗ trợ profiling mode"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, profiled_endpoint(endpoint), **kwargs)
@@ -0,0 +1,178 @@
+"""
+Cursor pagination cho recommendation lists: trang sau là slice của một ranked list đã cache
+
+Trang đầu tính như bình thường (top_k). Khi client xin trang tiếp theo (cursor), ranked list sâu
+(RANKED_LIST_SIZE items, vd. top 200) của (user_id, kind, params) được tính một lần rồi cache ngắn hạn;
+các trang sau chỉ cắt từ list đó. Cursor = (list_id, offset): cursor có list_id luôn cắt đúng list đó
+(thứ tự ổn định trong lúc lật trang) cho đến khi list hết hạn / bị đẩy khỏi LRU; khi đó dùng list mới nhất
+của key (tính lại nếu cần). invalidate_user chỉ bỏ con trỏ "mới nhất" của user (trang mới sẽ tính lại).
+"""
+import base64
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from app.service.data_version import add_invalidation_listener
+from app.service.result_cache import estimate_size, is_result_cache_bypassed
+from app.service.single_flight import recommendation_flight
+
+RANKED_LIST_SIZE = int(os.getenv("RANKED_LIST_SIZE", "200"))
+RANKED_LIST_TTL_SECONDS = float(os.getenv("RANKED_LIST_TTL_SECONDS", "120"))
+RANKED_LIST_CACHE_SIZE = int(os.getenv("RANKED_LIST_CACHE_SIZE", "2000"))
+RANKED_LIST_MAX_BYTES = int(os.getenv("RANKED_LIST_MAX_BYTES", str(32 * 1024 * 1024)))
+
+ListKey = Tuple[str, str, Tuple[Hashable, ...]]
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(list_id: Optional[str], offset: int) -> str:
+    return base64.urlsafe_b64encode(f"{list_id or ''}:{offset}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[str], int]:
+    """(list_id hoặc None, offset); InvalidCursorError nếu cursor không hợp lệ"""
+    try:
+        list_id, offset = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":")
+        offset = int(offset)
+    except Exception:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}")
+    if offset < 0:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}")
+    return list_id or None, offset
+
+
+class RankedListStore:
+    """LRU list_id -> (key, items, bytes, thời điểm tạo), cộng con trỏ key -> list mới nhất"""
+
+    def __init__(self, max_size: int = RANKED_LIST_CACHE_SIZE, max_bytes: int = RANKED_LIST_MAX_BYTES,
+                 ttl_seconds: float = RANKED_LIST_TTL_SECONDS):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lists: "OrderedDict[str, tuple]" = OrderedDict()
+        self._latest: Dict[ListKey, str] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.builds = 0
+        self.hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(user_id: str, kind: str, *params: Hashable) -> ListKey:
+        return (str(user_id), kind, tuple(params))
+
+    def _remove(self, list_id: str) -> None:
+        entry = self._lists.pop(list_id, None)
+        if entry is None:
+            return
+        self.bytes -= entry[2]
+        if self._latest.get(entry[0]) == list_id:
+            del self._latest[entry[0]]
+
+    def _get(self, list_id: Optional[str], key: ListKey) -> Optional[List[Dict]]:
+        entry = self._lists.get(list_id) if list_id is not None else None
+        if entry is None or entry[0] != key:
+            return None
+        if time.time() - entry[3] > self.ttl_seconds:
+            self._remove(list_id)
+            return None
+        self._lists.move_to_end(list_id)
+        return entry[1]
+
+    def lookup(self, key: ListKey, list_id: Optional[str] = None) -> Tuple[Optional[str], Optional[List[Dict]]]:
+        """List list_id (nếu còn và thuộc key), ngược lại list mới nhất của key; (None, None) nếu không có"""
+        if is_result_cache_bypassed():
+            return None, None
+        with self._lock:
+            for candidate in (list_id, self._latest.get(key)):
+                items = self._get(candidate, key)
+                if items is not None:
+                    self.hits += 1
+                    return candidate, items
+            return None, None
+
+    def put(self, key: ListKey, items: List[Dict]) -> str:
+        list_id = uuid.uuid4().hex
+        size = estimate_size({'items': items})
+        with self._lock:
+            self._lists[list_id] = (key, items, size, time.time())
+            self._latest[key] = list_id
+            self.bytes += size
+            self.builds += 1
+            while len(self._lists) > 1 and (len(self._lists) > self.max_size or self.bytes > self.max_bytes):
+                self._remove(next(iter(self._lists)))
+                self.evictions += 1
+        return list_id
+
+    def get_or_build(self, key: ListKey, build: Callable[[int], List[Dict]],
+                     list_id: Optional[str] = None) -> Tuple[str, List[Dict]]:
+        """(list_id, items) của list đã cache, hoặc build(RANKED_LIST_SIZE) một lần (requests trùng dùng chung)"""
+        found_id, items = self.lookup(key, list_id)
+        if items is not None:
+            return found_id, items
+
+        def compute() -> Tuple[str, List[Dict]]:
+            found = self.lookup(key)
+            if found[1] is not None:
+                return found
+            built = list(build(RANKED_LIST_SIZE))
+            return self.put(key, built), built
+
+        return recommendation_flight.do(("ranked_list",) + key, compute)
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            for key in [key for key in self._latest if key[0] == str(user_id)]:
+                del self._latest[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lists.clear()
+            self._latest.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'size': len(self._lists),
+                'max_size': self.max_size,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'builds': self.builds,
+                'hits': self.hits,
+                'evictions': self.evictions
+            }
+
+
+ranked_lists = RankedListStore()
+
+add_invalidation_listener(ranked_lists.invalidate_user)
+
+
+def paginate(user_id: str, kind: str, params: Tuple[Hashable, ...], page_size: int, cursor: Optional[str],
+             compute_top: Callable[[int], List[Dict]]) -> Dict[str, Any]:
+    """
+    Một trang recommendations: {'items', 'next_cursor'}
+    Không cursor: list mới nhất đã cache nếu có, ngược lại compute_top(page_size) như trước (không tính list sâu).
+    Có cursor: slice của ranked list sâu (compute_top(RANKED_LIST_SIZE) một lần)
+    """
+    key = RankedListStore.key(user_id, kind, *params)
+    if cursor is None:
+        list_id, items = ranked_lists.lookup(key)
+        if items is None:
+            items = list(compute_top(page_size))
+            # Trang đầu đầy -> có thể còn trang sau (list sâu chỉ được tính khi client thật sự lật trang)
+            return {'items': items, 'next_cursor': encode_cursor(None, page_size) if len(items) >= page_size else None}
+        offset = 0
+    else:
+        cursor_list_id, offset = decode_cursor(cursor)
+        list_id, items = ranked_lists.get_or_build(key, compute_top, cursor_list_id)
+
+    end = offset + page_size
+    return {'items': items[offset:end], 'next_cursor': encode_cursor(list_id, end) if end < len(items) else None}
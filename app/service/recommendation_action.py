@@ -1,22 +1,53 @@
+import os
+import time
 import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from typing import List, Dict
+from app.database.routing import BULK, POINT, routed
+from typing import List, Dict, Optional, Tuple
+from app.service.interaction_snapshot import InteractionSnapshot, get_interaction_snapshot
+from app.service.catalog import RecommendationCatalog, get_catalog
+from app.service.data_version import get_recommendation_versions
+from app.service.content_model import get_course_content_model
+from app.service.collaborative_scoring import UserItemMatrix, aggregate_neighbor_scores, top_k_indices
+from app.service.segment_index import SurveySegmentIndex, get_segment_index
+from app.service.latest_survey import get_latest_survey, user_type_for_age
+from app.service.metrics import observe_stage, stage_timer, timed
+from app.service.interaction_state import (InteractionState, appointment_rating, course_rating, get_interaction_state,
+                                           might_have_interactions)
+from app.service.implicit_als import ImplicitALSModel, get_implicit_als_model
+from app.service.score_fusion import EngineScores, fuse_scores
+from app.service.explanation_store import explanation_store
+from app.service.result_cache import recommendation_result_cache, result_refresher
+from app.service.candidates import generate_candidates, get_candidate_index, rank_candidates
+from app.service.stage_graph import Stage, StageExecutor, StageGraph, unranked
+
+COLLABORATIVE_ENGINE = os.getenv("COLLABORATIVE_ENGINE", "neighborhood")
+# Deadline mặc định cho hybrid recommendations (ms, 0 = không giới hạn)
+RECOMMENDATION_DEADLINE_MS = int(os.getenv("RECOMMENDATION_DEADLINE_MS", "0"))
+# Courses của hybrid: 'merge' (mỗi engine score mọi item rồi fusion) hoặc 'two_stage' (candidates + ranker)
+HYBRID_COURSE_PIPELINE = os.getenv("HYBRID_COURSE_PIPELINE", "merge")
+COURSE_PIPELINES = ('merge', 'two_stage')
+
+# Hybrid fusion: weight của mỗi engine và field chứa score của engine đó trong recommendation records
+HYBRID_ENGINE_WEIGHTS = {'content_based': 0.5, 'collaborative': 0.5}
+HYBRID_SCORE_KEYS = {'content_based': 'score', 'collaborative': 'similarity_score'}
 
 
 class CRAFFTASSISTRecommendationSystem:
-    def __init__(self, db_session: Session):
+    def __init__(self, db_session: Session, interaction_snapshot: Optional[InteractionSnapshot] = None):
         self.db = db_session
-        self.tfidf_vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
+        # Snapshot memmap (nếu refresh job đã ghi) để collaborative filtering không phải đọc lại Postgres
+        self.interaction_snapshot = interaction_snapshot or get_interaction_snapshot()
+        self._catalog: Optional[RecommendationCatalog] = None
         
+    @timed("load_user_surveys")
     def get_user_survey_data(self) -> pd.DataFrame:
         """Lấy dữ liệu khảo sát của người dùng qua SQLAlchemy ORM"""
         try:
            
-            survey_data = self.db.execute(text("""
+            survey_data = self.db.execute(routed("""
                 SELECT 
                     sa.user_id,
                     sa.test_survey_id,
@@ -32,7 +63,7 @@ class CRAFFTASSISTRecommendationSystem:
                 JOIN "Test_Survey" ts ON sa.test_survey_id = ts.id
                 WHERE u.is_deleted = false
                 ORDER BY sa.completed_at DESC
-            """)).fetchall()
+            """, BULK)).fetchall()
             print(f"Found {len(survey_data)} survey records")
             
             data_list = []
@@ -47,7 +78,7 @@ class CRAFFTASSISTRecommendationSystem:
                     'first_name': row.first_name,
                     'last_name': row.last_name,
                     'age': row.age,
-                    'user_type': ['adult', 'parents', 'teacher'] if row.age > 23 else ['youth', 'students'],
+                    'user_type': user_type_for_age(row.age),
                 })
             
          
@@ -61,7 +92,7 @@ class CRAFFTASSISTRecommendationSystem:
         """Lấy dữ liệu khóa học qua SQLAlchemy ORM"""
         try:
             # Sử dụng raw SQL với table names chính xác
-            courses_data = self.db.execute(text("""
+            courses_data = self.db.execute(routed("""
                 SELECT 
                     c.id,
                     c.title,
@@ -82,7 +113,7 @@ class CRAFFTASSISTRecommendationSystem:
                     GROUP BY course_id
                 ) ce ON c.id = ce.course_id
                 ORDER BY c.created_at DESC
-            """)).fetchall()
+            """, BULK)).fetchall()
             
             print(f"Found {len(courses_data)} course records")
             
@@ -113,7 +144,7 @@ class CRAFFTASSISTRecommendationSystem:
         """Lấy dữ liệu chuyên viên tư vấn qua SQLAlchemy ORM"""
         try:
           
-            consultants_data = self.db.execute(text("""
+            consultants_data = self.db.execute(routed("""
                 SELECT 
                     c.id,
                     c.specialization,
@@ -136,7 +167,7 @@ class CRAFFTASSISTRecommendationSystem:
                 ) app ON c.id = app."consultantId"
                 WHERE c.is_available = true
                 ORDER BY c.created_at DESC
-            """)).fetchall()
+            """, BULK)).fetchall()
             
             print(f"Found {len(consultants_data)} consultant records")
             
@@ -162,20 +193,46 @@ class CRAFFTASSISTRecommendationSystem:
             print(f"Error in get_consultants_data: {str(e)}")
             return pd.DataFrame()  # Return empty DataFrame on error
     
+    @timed("catalog")
+    def get_catalog(self) -> RecommendationCatalog:
+        """Catalog (courses + consultants) có id index, dùng chung cho mọi recommendation path"""
+        if self._catalog is None:
+            self._catalog = get_catalog(self.db, self.get_courses_data, self.get_consultants_data)
+        return self._catalog
+
+    @timed("latest_survey")
+    def get_latest_user_survey(self, user_id: str) -> Optional[Dict]:
+        """Survey attempt mới nhất của user (point query + LRU cache), None nếu chưa có"""
+        try:
+            return get_latest_survey(self.db, user_id)
+        except Exception as e:
+            print(f"Error in get_latest_user_survey: {str(e)}")
+            self.db.rollback()
+            return None
+
+    @timed("segment_index")
+    def get_segment_index(self) -> SurveySegmentIndex:
+        """(risk_level, category_id) -> users index, cập nhật dần theo survey attempts mới"""
+        try:
+            return get_segment_index(self.db)
+        except Exception:
+            self.db.rollback()
+            raise
+
     def get_user_interactions(self) -> pd.DataFrame:
         """Lấy dữ liệu tương tác của người dùng qua SQLAlchemy ORM"""
         try:
             # Bước 1: Lấy course interactions qua raw SQL
-            course_interactions = self.db.execute(text("""
+            course_interactions = self.db.execute(routed("""
                 SELECT 
                     user_id,
                     course_id as item_id,
                     progress_percentage,
                     enrollment_date as interaction_date
                 FROM "Course_Enrollment"
-            """)).fetchall()
+            """, BULK)).fetchall()
             
-            appointment_interactions = self.db.execute(text("""
+            appointment_interactions = self.db.execute(routed("""
                 SELECT 
                     "userId" as user_id,
                     "consultantId" as item_id,
@@ -183,38 +240,97 @@ class CRAFFTASSISTRecommendationSystem:
                     booking_time as interaction_date
                 FROM "Appointments"
                 WHERE is_deleted = false 
-            """)).fetchall()
-            data_list = []
-            # Course interactions
-            for row in course_interactions:
-                data_list.append({
-                    'user_id': str(row.user_id),
-                    'item_id': str(row.item_id),
-                    'item_type': 'course',
-                    'rating': (row.progress_percentage or 0) / 100.0,
-                    'interaction_date': row.interaction_date
-                })
-                            
-            # Appointment interactions
-            for row in appointment_interactions:
-                rating = 0.8 if row.status == 'completed' else 0.1 
-                if row.user_id is None:
-                    continue
-                data_list.append({
-                    'user_id': str(row.user_id),
-                    'item_id': str(row.item_id),
-                    'item_type': 'consultant',
-                    'rating': rating,
-                    'interaction_date': row.interaction_date
-                })
-            
-            # Bước 4: Tạo DataFrame từ data
-            return pd.DataFrame(data_list)
+            """, BULK)).fetchall()
+            return self._build_interactions_dataframe(course_interactions, appointment_interactions)
             
         except Exception as e:
             print(f"Error in get_user_interactions: {str(e)}")
             return pd.DataFrame()  # Return empty DataFrame on error
 
+    def get_user_interactions_by_user(self, user_id: str) -> pd.DataFrame:
+        """
+        Lấy interactions của MỘT user bằng parameterized query (dùng index user_id). Không đọc snapshot:
+        snapshot chỉ dùng cho collaborative filtering hàng loạt, nó không có events / change feed gần đây
+        và interaction_date chỉ còn theo ngày (seen items, ALS fold-in, two-stage cần dữ liệu hiện tại)
+        """
+        try:
+            course_interactions = self.db.execute(routed("""
+                SELECT 
+                    user_id,
+                    course_id as item_id,
+                    progress_percentage,
+                    enrollment_date as interaction_date
+                FROM "Course_Enrollment"
+                WHERE user_id = :user_id
+            """, POINT), {'user_id': user_id}).fetchall()
+            
+            appointment_interactions = self.db.execute(routed("""
+                SELECT 
+                    "userId" as user_id,
+                    "consultantId" as item_id,
+                    status,
+                    booking_time as interaction_date
+                FROM "Appointments"
+                WHERE "userId" = :user_id AND is_deleted = false 
+            """, POINT), {'user_id': user_id}).fetchall()
+            return self._build_interactions_dataframe(course_interactions, appointment_interactions)
+            
+        except Exception as e:
+            print(f"Error in get_user_interactions_by_user: {str(e)}")
+            return pd.DataFrame()
+
+    @staticmethod
+    def _build_interactions_dataframe(course_interactions, appointment_interactions) -> pd.DataFrame:
+        """Chuyển rows của Course_Enrollment + Appointments thành interactions DataFrame"""
+        data_list = []
+        # Course interactions
+        for row in course_interactions:
+            data_list.append({
+                'user_id': str(row.user_id),
+                'item_id': str(row.item_id),
+                'item_type': 'course',
+                'rating': course_rating(row.progress_percentage),
+                'interaction_date': row.interaction_date
+            })
+                        
+        # Appointment interactions
+        for row in appointment_interactions:
+            if row.user_id is None:
+                continue
+            data_list.append({
+                'user_id': str(row.user_id),
+                'item_id': str(row.item_id),
+                'item_type': 'consultant',
+                'rating': appointment_rating(row.status),
+                'interaction_date': row.interaction_date
+            })
+        
+        return pd.DataFrame(data_list)
+
+    @timed("load_interactions")
+    def get_collaborative_state(self) -> InteractionState:
+        """
+        In-memory interaction state dùng chung trong process (base từ snapshot, fallback sang Postgres)
+        + deltas từ POST /events
+        """
+        snapshot = self.interaction_snapshot
+        if snapshot is not None:
+            print(f"📦 Using interaction snapshot {snapshot.version} ({len(snapshot)} rows)")
+            return get_interaction_state(snapshot.to_dataframe, snapshot.version)
+        return get_interaction_state(self.get_user_interactions)
+
+    def get_collaborative_interactions(self) -> pd.DataFrame:
+        """Interaction data cho collaborative filtering (DataFrame hợp nhất của get_collaborative_state)"""
+        return self.get_collaborative_state().to_dataframe()
+
+    def has_interactions(self, user_id: str, item_type: Optional[str] = None) -> bool:
+        """
+        Bloom filter của interaction state dùng chung: False = user chắc chắn chưa có interaction (của item_type),
+        collaborative filtering không cần load interactions / dựng matrix. True khi chưa biết (state chưa build)
+        """
+        snapshot = self.interaction_snapshot
+        return might_have_interactions(user_id, item_type, snapshot.version if snapshot is not None else None)
+
     def create_risk_level_mapping(self) -> Dict[str, Dict]:
         return {
             'low': {
@@ -330,44 +446,38 @@ class CRAFFTASSISTRecommendationSystem:
             }
         }
 
+    @timed("course_total", engine="content_based")
     def content_based_course_recommendations(self, user_id: str, top_k: int = 5) -> List[Dict]:
         """Content-based filtering cho khóa học"""
         # Lấy thông tin survey gần nhất của user
-        user_surveys = self.get_user_survey_data()
-        
-        user_data = user_surveys[user_surveys['user_id'] == user_id]
-        if user_data.empty:
+        user_data = self.get_latest_user_survey(user_id)
+        if user_data is None:
             return []
-        user_data = user_data.iloc[0]
         
-        courses_df = self.get_courses_data()
+        catalog = self.get_catalog()
+        courses_df = catalog.courses_df
         if courses_df.empty:
             return []
             
         risk_mapping = self.create_risk_level_mapping()
         user_risk = user_data['risk_level']
         
-        # Tạo feature vector cho courses
-        course_features = []
-        for _, course in courses_df.iterrows():
-            features = f"{course['description']} {course['category_name']} {course['target_audience']}"
-            course_features.append(features)
-        
-        if not course_features:
+        # TF-IDF model (fit một lần mỗi catalog, chia sẻ giữa workers qua model store)
+        with stage_timer("tfidf_fit"):
+            content_model = get_course_content_model(catalog, risk_mapping)
+        if content_model is None:
             return []
+        tfidf_matrix = content_model.tfidf_matrix
         
-        print(f"📚 Total courses found: {len(course_features)}")
-        # TF-IDF vectorization
-        tfidf_matrix = self.tfidf_vectorizer.fit_transform(course_features)
-        
+        print(f"📚 Total courses found: {tfidf_matrix.shape[0]}")
         # 📊 Enhanced debugging info
         print(f"📊 TF-IDF Matrix Shape: {tfidf_matrix.shape} (courses x vocabulary)")
-        print(f"📊 Vocabulary Size: {len(self.tfidf_vectorizer.vocabulary_)}")
+        print(f"📊 Vocabulary Size: {content_model.vocabulary_size}")
         print(f"📊 Non-zero Elements: {tfidf_matrix.nnz}")
         print(f"📊 Sparsity: {(1 - tfidf_matrix.nnz / (tfidf_matrix.shape[0] * tfidf_matrix.shape[1])) * 100:.2f}%")
         
         # Show sample vocabulary terms
-        feature_names = self.tfidf_vectorizer.get_feature_names_out()
+        feature_names = content_model.feature_names
         print(f"📝 Sample vocabulary terms: {list(feature_names[:10])}")
         
         # Show course-term matrix info for each course
@@ -382,9 +492,9 @@ class CRAFFTASSISTRecommendationSystem:
         print(f"📊 Total courses vectorized: {tfidf_matrix.shape[0]}")
         
         
-        # Tạo user profile dựa trên risk level
+        # User profile dựa trên risk level (vector dựng sẵn trong model)
         user_profile = " ".join(risk_mapping.get(user_risk, risk_mapping['medium'])['course_topics'])
-        user_vector = self.tfidf_vectorizer.transform([user_profile])
+        user_vector = content_model.profile_vector(user_risk)
         
         # 🎯 Enhanced user profile debugging
         print(f"👤 User Risk Level: {user_risk}")
@@ -402,7 +512,8 @@ class CRAFFTASSISTRecommendationSystem:
             print(f"🔗 User matching terms: {[feature_names[i] for i in user_terms[:5]]}")
         
         # Tính cosine similarity
-        similarities = cosine_similarity(user_vector, tfidf_matrix).flatten()
+        with stage_timer("cosine_similarity"):
+            similarities = cosine_similarity(user_vector, tfidf_matrix).flatten()
         
         # 🎯 Similarity debugging
         if len(similarities) > 0:
@@ -420,26 +531,28 @@ class CRAFFTASSISTRecommendationSystem:
         
         # Áp dụng business rules
         course_scores = []
-        for idx, (_, course) in enumerate(courses_df.iterrows()):
+        user_types = user_data.get('user_type', [])
+        for idx, target_audience in enumerate(courses_df['target_audience'].tolist()):
             base_score = similarities[idx]
             original_score = base_score
+            course_record = catalog.course_records[idx]
+            boosts = []
             
             # Business rules boost
-            if course['target_audience'] in user_data.get('user_type', []) or course['target_audience'] == 'all':
+            if target_audience in user_types or target_audience == 'all':
                 base_score *= 1.2
+                boosts.append('audience')
                 
             # Debug individual scores
             if idx < 3:  # Show details for first 3 courses
                 boost_applied = "✅ Audience boost" if base_score != original_score else "❌ No boost"
-                print(f"📊 Course {idx} ({course['title'][:20]}...): sim={original_score:.3f} → final={base_score:.3f} ({boost_applied})")
+                print(f"📊 Course {idx} ({course_record['title'][:20]}...): sim={original_score:.3f} → final={base_score:.3f} ({boost_applied})")
             
             course_scores.append({
-                'course_id': str(course['id']),
-                'title': str(course['title']),
-                'description': str(course['description']) if pd.notna(course['description']) else '',
+                **course_record,
                 'score': float(base_score),
-                'enrollment_count': int(course['enrollment_count']) if pd.notna(course['enrollment_count']) else 0,
-                'recommendation_type': 'content_based'
+                'recommendation_type': 'content_based',
+                'boosts': boosts
             })
         
         # Sắp xếp và trả về top K
@@ -454,17 +567,15 @@ class CRAFFTASSISTRecommendationSystem:
         
         return course_scores[:top_k]
 
+    @timed("consultant_total", engine="content_based")
     def content_based_consultant_recommendations(self, user_id: str, top_k: int = 3) -> List[Dict]:
         """Content-based filtering cho consultant"""
-        user_surveys = self.get_user_survey_data()
-        user_data = user_surveys[user_surveys['user_id'] == user_id]
-        
-        if user_data.empty:
+        user_data = self.get_latest_user_survey(user_id)
+        if user_data is None:
             return []
-            
-        user_data = user_data.iloc[0]
         
-        consultants_df = self.get_consultants_data()
+        catalog = self.get_catalog()
+        consultants_df = catalog.consultants_df
         if consultants_df.empty:
             return []
             
@@ -472,8 +583,9 @@ class CRAFFTASSISTRecommendationSystem:
         user_risk = user_data['risk_level']
         
         consultant_scores = []
-        for _, consultant in consultants_df.iterrows():
+        for idx, consultant in enumerate(consultants_df[['specialization', 'experience_years']].to_dict(orient='records')):
             base_score = risk_mapping.get(user_risk, risk_mapping['medium'])['priority_weight']
+            boosts = []
             
             # Boost score dựa trên specialization
             if consultant['specialization']:
@@ -481,42 +593,62 @@ class CRAFFTASSISTRecommendationSystem:
                 for spec in risk_mapping.get(user_risk, risk_mapping['medium'])['consultant_specialization']:
                     if any(spec in s.strip() for s in specializations):
                         base_score *= 1.2
+                        boosts.append('specialization')
                         break
             
             # Boost score dựa trên experience
             if consultant['experience_years'] and consultant['experience_years'] >= 5:
                 base_score *= 1.12
+                boosts.append('experience')
         
 
             consultant_scores.append({
-                'consultant_id': str(consultant['consult_id']),
-                'name': str(consultant['full_name']),
-                'specialization': str(consultant['specialization']) if pd.notna(consultant['specialization']) else 'General',
-                'experience_years': int(consultant['experience_years']) if pd.notna(consultant['experience_years']) else 0,
+                **catalog.consultant_records[idx],
                 'score': float(base_score),
-                'total_appointments': int(consultant['total_appointments']) if pd.notna(consultant['total_appointments']) else 0,
-                'recommendation_type': 'content_based'
+                'recommendation_type': 'content_based',
+                'boosts': boosts
             })
         
         consultant_scores.sort(key=lambda x: x['score'], reverse=True)
         return consultant_scores[:top_k]
 
-    def collaborative_filtering_recommendations(self, user_id: str, top_k: int = 5) -> Dict:
+    def collaborative_filtering_recommendations(self, user_id: str, top_k: int = 5, engine: Optional[str] = None,
+                                                user_risk_info: Optional[Dict] = None) -> Dict:
         """
         Enhanced collaborative filtering cho cả courses và consultants
         Logic: Users tương tự (cùng risk level with category of this survey + behavior) → recommend items tương tự
+        engine: 'neighborhood' (user similarity) hoặc 'als' (implicit ALS, fallback neighborhood nếu chưa có model);
+        mặc định COLLABORATIVE_ENGINE
+        user_risk_info: risk summary đã tính sẵn (stage graph), None thì tự lấy
         """
         try:
-            print(f"🤝 Starting enhanced collaborative filtering - User: {user_id}")
-            
-            # Lấy course recommendations
-            course_recommendations = self.collaborative_filtering_course_recommendations(user_id, top_k)
-            
-            # Lấy consultant recommendations
-            consultant_recommendations = self.collaborative_filtering_consultant_recommendations(user_id, min(3, top_k))
+            if not self.has_interactions(user_id):
+                print(f"ℹ️ User {user_id} has no interactions, skipping collaborative filtering")
+                if user_risk_info is None:
+                    user_risk_info = self.get_user_risk_summary(user_id)
+                return {**_no_interactions_collaborative(top_k), 'user_risk_info': user_risk_info}
+
+            engine = engine or COLLABORATIVE_ENGINE
+            print(f"🤝 Starting enhanced collaborative filtering - User: {user_id}, engine: {engine}")
+            als_model = get_implicit_als_model() if engine == 'als' else None
+            if engine == 'als' and als_model is None:
+                print("⚠️  No implicit ALS model published, falling back to neighborhood CF")
+            
+            if als_model is not None:
+                course_recommendations = self.als_course_recommendations(als_model, user_id, top_k)
+                consultant_recommendations = self.als_consultant_recommendations(als_model, user_id, min(3, top_k))
+                method = 'implicit_als'
+            else:
+                # Lấy course recommendations
+                course_recommendations = self.collaborative_filtering_course_recommendations(user_id, top_k)
+                
+                # Lấy consultant recommendations
+                consultant_recommendations = self.collaborative_filtering_consultant_recommendations(user_id, min(3, top_k))
+                method = 'user_similarity_based'
             
             # Lấy thông tin risk của user
-            user_risk_info = self.get_user_risk_summary(user_id)
+            if user_risk_info is None:
+                user_risk_info = self.get_user_risk_summary(user_id)
             
             return {
                 'courses': course_recommendations,
@@ -526,7 +658,7 @@ class CRAFFTASSISTRecommendationSystem:
                 'recommendation_summary': {
                     'total_courses': len(course_recommendations),
                     'total_consultants': len(consultant_recommendations),
-                    'method': 'user_similarity_based'
+                    'method': method
                 },
                 'status': 'success'
             }
@@ -541,13 +673,18 @@ class CRAFFTASSISTRecommendationSystem:
                 'message': str(e)
             }
 
+    @timed("course_total", engine="collaborative")
     def collaborative_filtering_course_recommendations(self, user_id: str, top_k: int = 5) -> List[Dict]:
         """Collaborative filtering cho courses sử dụng user similarity với comprehensive debugging"""
         try:
+            if not self.has_interactions(user_id, 'course'):
+                print(f"ℹ️ User {user_id} has no course interactions, skipping collaborative filtering")
+                return []
+
             print(f"🤝 COLLABORATIVE FILTERING COURSES DEBUG - User: {user_id}")
             print("=" * 60)
             
-            interactions_df = self.get_user_interactions()
+            interactions_df = self.get_collaborative_interactions()
             
             if interactions_df.empty:
                 print("❌ No interactions data found")
@@ -564,208 +701,133 @@ class CRAFFTASSISTRecommendationSystem:
                 print("❌ No course interactions found")
                 return []
             
-            # Pivot table: user_id x course_id
-            user_item_matrix = course_interactions.pivot_table(
-                index='user_id', 
-                columns='item_id', 
-                values='rating', 
-                fill_value=0
-            )
+            # Sparse user x course matrix (CSR) thay cho pivot_table dense
+            with stage_timer("user_item_matrix"):
+                user_item_matrix = UserItemMatrix(course_interactions)
 
             print(f"📊 USER-ITEM MATRIX STRUCTURE:")
-            print(f"   Matrix shape: {user_item_matrix}")
             print(f"   Matrix shape: {user_item_matrix.shape} (users x courses)")
-            print(f"   Total elements: {user_item_matrix.size}")
-            print(f"   Non-zero elements: {(user_item_matrix != 0).sum().sum()}")
-            print(f"   Sparsity: {(1 - (user_item_matrix != 0).sum().sum() / user_item_matrix.size) * 100:.2f}%")
-            print(f"   Users in matrix: {list(user_item_matrix.index)}")
-            print(f"   Courses in matrix: {list(user_item_matrix.columns)}")
+            print(f"   Non-zero elements: {user_item_matrix.nnz}")
+            print(f"   Sparsity: {user_item_matrix.sparsity:.2f}%")
             
             # Check if user exists in matrix
-            if user_id not in user_item_matrix.index:
+            if user_id not in user_item_matrix:
                 print(f"❌ User {user_id} not found in interaction matrix")
-                print(f"   Available users: {list(user_item_matrix.index)}")
                 return []
             
             # Show user's interaction profile
-            user_row = user_item_matrix.loc[user_id]
-            user_interactions_count = (user_row != 0).sum()
-            user_avg_rating = user_row[user_row != 0].mean() if user_interactions_count > 0 else 0
-            
+            user_rated_items = user_item_matrix.seen_items(user_id)
             print(f"👤 USER INTERACTION PROFILE:")
-            print(f"   User interactions count: {user_interactions_count}")
-            print(f"   User avg rating: {user_avg_rating:.3f}")
-            print(f"   User rated courses: {list(user_row[user_row != 0].index)}")
+            print(f"   User interactions count: {len(user_rated_items)}")
+            print(f"   User rated courses: {list(user_item_matrix.item_ids[user_rated_items])}")
             
             # 🆕 STRICT SURVEY CATEGORY FILTERING FOR SIMILARITY
             # Get user's survey category for strict similarity matching (same as consultant logic)
-            user_surveys = self.get_user_survey_data()
-            current_user_survey = user_surveys[user_surveys['user_id'] == user_id]
+            current_user_survey = self.get_latest_user_survey(user_id)
             
-            if not current_user_survey.empty:
-                current_user_risk = current_user_survey.iloc[0]['risk_level']
-                current_user_category = current_user_survey.iloc[0]['category_id']
+            if current_user_survey is not None:
+                current_user_risk = current_user_survey['risk_level']
+                current_user_category = current_user_survey['category_id']
                 print(f"👤 USER SURVEY PROFILE:")
                 print(f"   Risk level: {current_user_risk}")
                 print(f"   Survey category: {current_user_category}")
                 
-                # Find users with same risk level and category (STRICT FILTERING)
-                strict_similar_users = user_surveys[
-                    (user_surveys['risk_level'] == current_user_risk) &
-                    (user_surveys['category_id'] == current_user_category) &
-                    (user_surveys['user_id'] != user_id)
-                ]['user_id'].unique().tolist()
+                # Find users with same risk level and category (STRICT FILTERING) - segment index lookup
+                segment_index = self.get_segment_index()
+                strict_similar_users = segment_index.users_in_segment(current_user_risk, current_user_category, exclude_user=user_id)
                 
                 print(f"   Users with same risk+category (STRICT): {len(strict_similar_users)}")
-                print(f"   Strict similar users: {strict_similar_users}")
                 
                 # Get intersection of users in both interaction matrix and survey similarity
-                if strict_similar_users:
-                    available_similar_users = [u for u in strict_similar_users if u in user_item_matrix.index]
-                    print(f"   Available similar users in interaction matrix: {len(available_similar_users)}")
-                    print(f"   Available users: {available_similar_users}")
+                if len(strict_similar_users):
+                    available_similar_rows = user_item_matrix.user_rows(strict_similar_users)
+                    print(f"   Available similar users in interaction matrix: {len(available_similar_rows)}")
                     
-                    if not available_similar_users:
+                    if len(available_similar_rows) == 0:
                         print(f"❌ No users with same risk+category found in interaction matrix")
                         print(f"   Falling back to risk level only...")
                         
                         # Fallback to risk level only if no same category users have interactions
-                        risk_only_users = user_surveys[
-                            (user_surveys['risk_level'] == current_user_risk) &
-                            (user_surveys['user_id'] != user_id)
-                        ]['user_id'].unique().tolist()
+                        risk_only_users = segment_index.users_with_risk(current_user_risk, exclude_user=user_id)
                         
-                        available_similar_users = [u for u in risk_only_users if u in user_item_matrix.index]
-                        print(f"   Fallback users (risk level only): {len(available_similar_users)}")
-                        print(f"   Fallback available users: {available_similar_users}")
+                        available_similar_rows = user_item_matrix.user_rows(risk_only_users)
+                        print(f"   Fallback users (risk level only): {len(available_similar_rows)}")
                 else:
                     print(f"❌ No users with same risk+category found")
-                    available_similar_users = []
+                    available_similar_rows = np.zeros(0, dtype=np.int64)
             else:
                 print(f"❌ No survey data found for user")
-                available_similar_users = []
+                available_similar_rows = np.zeros(0, dtype=np.int64)
             
             # Tính cosine similarity chỉ với filtered users (strict filtering)
-            if not available_similar_users:
+            if len(available_similar_rows) == 0:
                 print(f"❌ No similar users available for recommendations")
                 return []
-                
-            # Filter user_item_matrix to only include target user and similar users
-            filtered_users = [user_id] + available_similar_users
-            filtered_matrix = user_item_matrix.loc[filtered_users]
-            
-            print(f"📊 FILTERED USER SIMILARITY MATRIX:")
-            print(f"   Original matrix users: {len(user_item_matrix)}")
-            print(f"   Filtered matrix users: {len(filtered_matrix)} (target + {len(available_similar_users)} similar)")
-            print(f"   Filtered users: {filtered_users}")
-            
-            user_similarity = cosine_similarity(filtered_matrix.values)
-            user_similarity_df = pd.DataFrame(
-                user_similarity, 
-                index=filtered_matrix.index, 
-                columns=filtered_matrix.index
-            )
-           
+            
+            # Chỉ tính similarity giữa target user và similar users (1 x n)
+            with stage_timer("cosine_similarity"):
+                similarities = user_item_matrix.user_similarities(user_id, available_similar_rows)
+            
             print(f"📊 SIMILARITY CALCULATION RESULTS:")
-            print(f"   Similarity matrix shape: {user_similarity_df.shape}")
+            print(f"   Candidate users: {len(similarities)} (of {user_item_matrix.shape[0]} in matrix)")
+            print(f"   Similarity scores - min: {similarities.min():.3f}, max: {similarities.max():.3f}, mean: {similarities.mean():.3f}")
+            print(f"   Non-zero similarities: {(similarities > 0).sum()}/{len(similarities)}")
             
-            user_sim_stats = user_similarity_df[user_id].drop(user_id)
-            print(f"   Similarity scores - min: {user_sim_stats.min():.3f}, max: {user_sim_stats.max():.3f}, mean: {user_sim_stats.mean():.3f}")
-            print(f"   Non-zero similarities: {(user_sim_stats > 0).sum()}/{len(user_sim_stats)}")
+            similarity_threshold = 0.1
+            rating_threshold = 0.4
             
-            # Tìm users tương tự (đã được filtered by survey profile)
-            similar_users = user_similarity_df[user_id].drop(user_id)
-            similar_users = similar_users.sort_values(ascending=False)
-            top_similar_users = similar_users.head(7)  # Top 7 similar users from filtered list
+            # Top 7 similar users from filtered list, bỏ các users dưới similarity threshold
+            top_positions = top_k_indices(similarities, 7)
+            top_positions = top_positions[similarities[top_positions] >= similarity_threshold]
+            neighbor_rows = available_similar_rows[top_positions]
+            neighbor_similarities = similarities[top_positions]
             
             print(f"👥 TOP SIMILAR USERS (STRICT RISK+CATEGORY FILTERING):")
-            for i, (sim_user, sim_score) in enumerate(top_similar_users.items(), 1):
-                sim_user_interactions = (filtered_matrix.loc[sim_user] != 0).sum()
-                print(f"   {i}. 📋 User {sim_user}: similarity={sim_score:.3f}, interactions={sim_user_interactions} (same risk+category)")
+            for i, (row, sim_score) in enumerate(zip(neighbor_rows, neighbor_similarities), 1):
+                print(f"   {i}. 📋 User {user_item_matrix.user_ids[row]}: similarity={sim_score:.3f} (same risk+category)")
             
-            if len(top_similar_users) == 0:
+            if len(neighbor_rows) == 0:
                 print(f"❌ No similar users found with sufficient similarity")
                 return []
             
-            # Lấy courses mà similar users đã rated cao nhưng current user chưa thử
-            user_rated_courses = set(course_interactions[course_interactions['user_id'] == user_id]['item_id'])
+            # Loại courses user đã thử và courses không còn trong catalog
+            catalog = self.get_catalog()
+            missing_items = np.flatnonzero(~user_item_matrix.item_ids.isin(list(catalog.course_index)))
+            exclude_items = np.union1d(user_rated_items, missing_items)
             
             print(f"📚 COURSE RECOMMENDATION GENERATION:")
-            print(f"   User already rated courses: {len(user_rated_courses)}")
-            print(f"   Courses to exclude: {list(user_rated_courses)}")
-            
-            course_recommendations = []
-            courses_df = self.get_courses_data()
-            
-            similarity_threshold = 0.1
-            rating_threshold = 0.4
-            
+            print(f"   User already rated courses: {len(user_rated_items)}")
+            print(f"   Courses not in catalog: {len(missing_items)}")
             print(f"🔍 FILTERING CRITERIA:")
             print(f"   Similarity threshold: {similarity_threshold}")
             print(f"   Rating threshold: {rating_threshold}")
             
-            for similar_user, similarity_score in top_similar_users.items():
-                if similarity_score < similarity_threshold:
-                    print(f"   ⏭️  Skipping user {similar_user} (similarity {similarity_score:.3f} < {similarity_threshold})")
-                    continue
-                    
-                similar_user_courses = course_interactions[
-                    (course_interactions['user_id'] == similar_user) & 
-                    (course_interactions['rating'] >= rating_threshold)  
-                ]['item_id'].tolist()
-                
-                print(f"   👤 User {similar_user} (sim: {similarity_score:.3f}):")
-                print(f"      High-rated courses: {len(similar_user_courses)} courses")
-                print(f"      Course IDs: {similar_user_courses}")
-                
-                for course_id in similar_user_courses:
-                    if course_id not in user_rated_courses:
-                        print(f"type (course_id): {type(course_id)}")
-                        # Ensure type consistency for comparison
-                        course_info = courses_df[courses_df['id'].astype(str) == str(course_id)]
-                        if not course_info.empty:
-                            course_info = course_info.iloc[0]
-                            
-                            print(f"✅ Recommending course {course_id}: '{course_info['title'][:30]}...' (similarity_score: {similarity_score:.3f})")
-                            
-                            course_recommendations.append({
-                                'course_id': str(course_id),
-                                'title': str(course_info['title']),
-                                'description': str(course_info['description']) if pd.notna(course_info['description']) else '',
-                                'similarity_score': float(similarity_score),
-                                'enrollment_count': int(course_info['enrollment_count']) if pd.notna(course_info['enrollment_count']) else 0,
-                                'recommendation_type': 'collaborative',
-                                'source_user': str(similar_user)
-                            })
-                        else:
-                            print(f"         ❌ Course {course_id} not found in courses database")
-                    else:
-                        print(f"         ⏭️  Course {course_id} already rated by user")
-            
-            print(f"📊 DEDUPLICATION AND RANKING:")
-            print(f"   Raw recommendations: {len(course_recommendations)}")
-            print(f"   Raw recommendations 1: {(course_recommendations)}")
-            
-            # Remove duplicates và sort by predicted rating
-            seen_courses = set()
-            unique_recommendations = []
-            for rec in course_recommendations:
-                if rec['course_id'] not in seen_courses:
-                    seen_courses.add(rec['course_id'])
-                    unique_recommendations.append(rec)
-                else:
-                    print(f"   🔄 Removing duplicate course: {rec['course_id']}")
-            
-            print(f"   Unique recommendations: {len(unique_recommendations)}")
-            
-            unique_recommendations.sort(key=lambda x: x['similarity_score'], reverse=True)
+            # Predicted score = similarities @ neighbor-course matrix / sum(similarities)
+            with stage_timer("neighbor_aggregation"):
+                item_indices, predicted_scores, source_positions = aggregate_neighbor_scores(
+                    user_item_matrix.liked_matrix(neighbor_rows, rating_threshold),
+                    neighbor_similarities,
+                    exclude_items,
+                    top_k
+                )
+            
+            recommendations = []
+            with stage_timer("candidate_resolution"):
+                for item_idx, predicted_score, source_position in zip(item_indices, predicted_scores, source_positions):
+                    course_info = catalog.get_course(user_item_matrix.item_ids[item_idx])
+                    recommendations.append({
+                        **course_info,
+                        'similarity_score': float(predicted_score),
+                        'recommendation_type': 'collaborative',
+                        'source_user': str(user_item_matrix.user_ids[neighbor_rows[source_position]])
+                    })
             
             print(f"🏆 FINAL COLLABORATIVE COURSE RECOMMENDATIONS:")
-            for i, rec in enumerate(unique_recommendations[:top_k], 1):
+            for i, rec in enumerate(recommendations, 1):
                 print(f"   {i}. {rec['title'][:40]}... (Score: {rec['similarity_score']:.4f}, Source: User {rec['source_user']})")
             
             print("=" * 60)
-            return unique_recommendations[:top_k]
+            return recommendations
             
         except Exception as e:
             print(f"❌ Error in collaborative course filtering: {str(e)}")
@@ -773,87 +835,59 @@ class CRAFFTASSISTRecommendationSystem:
             traceback.print_exc()
             return []
 
+    @timed("consultant_total", engine="collaborative")
     def collaborative_filtering_consultant_recommendations(self, user_id: str, top_k: int = 3) -> List[Dict]:
         """
         Collaborative filtering cho consultants dựa trên appointment history với comprehensive debugging
         Logic: Users có cùng risk level book cùng consultant → recommend consultant đó
         """
         try:
+            if not self.has_interactions(user_id, 'consultant'):
+                print(f"ℹ️ User {user_id} has no consultant interactions (cold start)")
+                return []
+
             print(f"🤝 COLLABORATIVE FILTERING CONSULTANTS DEBUG - User: {user_id}")
             print("=" * 60)
             
             # Bước 1: Lấy risk level của current user
-            user_surveys = self.get_user_survey_data()
             print(f"📊 RISK LEVEL ANALYSIS:")
-            print(f"   Total user surveys: {len(user_surveys)}")
-            print(f"   Unique users in surveys: {user_surveys['user_id'].nunique()}")
-            
-            # 🔍 DEBUG: Kiểm tra user_id có trong DataFrame không
-            print(f"🔍 USER LOOKUP DEBUG:")
-            print(f"   All unique user_ids: {list(user_surveys['user_id'].unique())}")
-            print(f"   Looking for user_id: '{user_id}' (type: {type(user_id)})")
-            print(f"   DataFrame user_id dtype: {user_surveys['user_id'].dtype}")
+            current_user_data = self.get_latest_user_survey(user_id)
             
-            # 🔍 Check exact match
-            exact_matches = user_surveys[user_surveys['user_id'] == user_id]
-            print(f"   Exact matches found: {len(exact_matches)}")
-            
-            # 🔍 Check với .str.strip() để loại bỏ whitespace
-            if user_surveys['user_id'].dtype == 'object':
-                stripped_matches = user_surveys[user_surveys['user_id'].str.strip() == str(user_id).strip()]
-                print(f"   Stripped matches found: {len(stripped_matches)}")
-            
-            current_user_data = user_surveys[user_surveys['user_id'] == user_id]
-            
-            if current_user_data.empty:
+            if current_user_data is None:
                 print(f"❌ No survey data found for user {user_id}")
-                print(f"   Available users: {list(user_surveys['user_id'].unique())}")
                 return []
             
-            current_user_risk = current_user_data.iloc[0]['risk_level']
-            current_user_category = current_user_data.iloc[0]['category_id']
+            current_user_risk = current_user_data['risk_level']
+            current_user_category = current_user_data['category_id']
             print(f"✅ Current user risk level: {current_user_risk}")
             print(f"✅ Current user survey category: {current_user_category}")
             
-            # Bước 2: Tìm users có cùng risk level AND same survey category
-            users_same_risk_and_category = user_surveys[
-                (user_surveys['risk_level'] == current_user_risk) &
-                (user_surveys['category_id'] == current_user_category) &
-                (user_surveys['user_id'] != user_id)
-            ]['user_id'].unique().tolist()
+            # Bước 2: Tìm users có cùng risk level AND same survey category (segment index lookup)
+            segment_index = self.get_segment_index()
+            users_same_risk_and_category = segment_index.users_in_segment(current_user_risk, current_user_category, exclude_user=user_id)
             
             print(f"👥 SIMILAR USERS ANALYSIS:")
             print(f"   Users with same risk level ({current_user_risk}) AND category ({current_user_category}): {len(users_same_risk_and_category)}")
-            print(f"   Similar user IDs: {users_same_risk_and_category}")
             
             # If no users with exact match, fallback to same risk level only
             if len(users_same_risk_and_category) < 1:
                 print(f"⚠️  No users found with same risk level AND category, falling back to risk level only...")
-                users_same_risk_and_category = user_surveys[
-                    (user_surveys['risk_level'] == current_user_risk) &
-                    (user_surveys['user_id'] != user_id)
-                ]['user_id'].unique().tolist()
+                users_same_risk_and_category = segment_index.users_with_risk(current_user_risk, exclude_user=user_id)
                 print(f"   Fallback users with same risk level only: {len(users_same_risk_and_category)}")
             
-            # Risk level and category distribution
-            risk_distribution = user_surveys['risk_level'].value_counts()
-            category_distribution = user_surveys['category_id'].value_counts()
-            print(f"   Risk level distribution: {dict(risk_distribution)}")
-            print(f"   Category distribution: {dict(category_distribution)}")
-            
             if len(users_same_risk_and_category) < 1:  
                 print("⚠️  Not enough users with same risk level for collaborative filtering")
                 return []
             
             # Bước 3: Lấy appointment interactions cho users cùng risk level
-            interactions_df = self.get_user_interactions()
+            interactions_df = self.get_collaborative_interactions()
             print(f"📊 INTERACTION DATA ANALYSIS:")
             print(f"   Total interactions: {len(interactions_df)}")
             print(f"   Interaction types: {interactions_df['item_type'].value_counts().to_dict()}")
             
             consultant_interactions = interactions_df[
                 (interactions_df['item_type'] == 'consultant') &
-                (interactions_df['user_id'].isin(users_same_risk_and_category + [user_id]))
+                (interactions_df['user_id'].isin(np.append(users_same_risk_and_category, user_id)))
             ]
             
             print(f"   Consultant interactions for risk group: {len(consultant_interactions)}")
@@ -868,25 +902,17 @@ class CRAFFTASSISTRecommendationSystem:
             rating_distribution = consultant_interactions['rating'].value_counts().sort_index()
             print(f"   Rating distribution: {dict(rating_distribution)}")
             
-            # Bước 4: Tạo user-consultant matrix
-            user_consultant_matrix = consultant_interactions.pivot_table(
-                index='user_id',
-                columns='item_id', 
-                values='rating',
-                fill_value=0
-            )
+            # Bước 4: Tạo user-consultant matrix (sparse CSR)
+            with stage_timer("user_item_matrix"):
+                user_consultant_matrix = UserItemMatrix(consultant_interactions)
             
             print(f"📊 USER-CONSULTANT MATRIX:")
-            print(f"   Matrix shape: {user_consultant_matrix} ")
             print(f"   Matrix shape: {user_consultant_matrix.shape} (users x consultants)")
-            print(f"   Total elements: {user_consultant_matrix.size}")
-            print(f"   Non-zero elements: {(user_consultant_matrix != 0).sum().sum()}")
-            print(f"   Sparsity: {(1 - (user_consultant_matrix != 0).sum().sum() / user_consultant_matrix.size) * 100:.2f}%")
-            print(f"   Users in matrix: {list(user_consultant_matrix.index)}")
-            print(f"   Consultants in matrix: {list(user_consultant_matrix.columns)}")
+            print(f"   Non-zero elements: {user_consultant_matrix.nnz}")
+            print(f"   Sparsity: {user_consultant_matrix.sparsity:.2f}%")
             
             # Check if current user has interactions
-            current_user_in_matrix = user_id in user_consultant_matrix.index
+            current_user_in_matrix = user_id in user_consultant_matrix
             print(f"   Current user in matrix: {current_user_in_matrix}")
             
             # it should be content base consultant
@@ -938,125 +964,81 @@ class CRAFFTASSISTRecommendationSystem:
                 # return popular_recommendations
             
             # Continue with existing collaborative logic for users with interactions
-            user_similarity = cosine_similarity(user_consultant_matrix.values)
-            user_similarity_df = pd.DataFrame(
-                user_similarity,
-                index=user_consultant_matrix.index,
-                columns=user_consultant_matrix.index
-            )
+            # Similarity giữa current user và các users còn lại trong risk group (1 x n)
+            other_rows = user_consultant_matrix.user_rows(u for u in user_consultant_matrix.user_ids if u != user_id)
+            with stage_timer("cosine_similarity"):
+                similarities = user_consultant_matrix.user_similarities(user_id, other_rows)
             
             print(f"📊 USER SIMILARITY ANALYSIS:")
-            print(f"   Similarity matrix shape: {user_similarity_df.shape}")
-            
-            # Check if user exists in similarity matrix (additional safety check)
-            if user_id not in user_similarity_df.columns:
-                print(f"⚠️ User {user_id} not in similarity matrix")
-                return []
+            print(f"   Candidate users: {len(similarities)}")
             
             # Show user's consultant interaction profile
-            user_row = user_consultant_matrix.loc[user_id]
-            user_consultant_count = (user_row != 0).sum()
-            user_avg_rating = user_row[user_row != 0].mean() if user_consultant_count > 0 else 0
-            
+            user_consulted = user_consultant_matrix.seen_items(user_id)
             print(f"👤 USER CONSULTANT PROFILE:")
-            print(f"   Consultant interactions: {user_consultant_count}")
-            print(f"   Average rating: {user_avg_rating:.3f}")
-            print(f"   Consulted with: {list(user_row[user_row != 0].index)}")
+            print(f"   Consultant interactions: {len(user_consulted)}")
+            print(f"   Consulted with: {list(user_consultant_matrix.item_ids[user_consulted])}")
             
-            # Find similar users
-            similar_users = user_similarity_df[user_id].drop(user_id).sort_values(ascending=False)
-            user_sim_stats = similar_users
-            print(f"   Similarity scores - min: {user_sim_stats.min():.3f}, max: {user_sim_stats.max():.3f}, mean: {user_sim_stats.mean():.3f}")
+            if len(similarities) == 0:
+                print(f"❌ No other users in consultant matrix")
+                return []
+            print(f"   Similarity scores - min: {similarities.min():.3f}, max: {similarities.max():.3f}, mean: {similarities.mean():.3f}")
+            
+            similarity_threshold = 0.1
+            rating_threshold = 0.5
             
-            top_similar_users = similar_users.head(5)  # Top 5 similar users
+            # Top 5 similar users, bỏ các users dưới similarity threshold
+            top_positions = top_k_indices(similarities, 5)
+            top_positions = top_positions[similarities[top_positions] >= similarity_threshold]
+            neighbor_rows = other_rows[top_positions]
+            neighbor_similarities = similarities[top_positions]
             
             print(f"👥 TOP SIMILAR USERS:")
-            for i, (sim_user, sim_score) in enumerate(top_similar_users.items(), 1):
-                sim_user_consultants = (user_consultant_matrix.loc[sim_user] != 0).sum()
-                sim_user_avg = user_consultant_matrix.loc[sim_user][user_consultant_matrix.loc[sim_user] != 0].mean()
-                print(f"   {i}. User {sim_user}: similarity={sim_score:.3f}, consultants={sim_user_consultants}, avg_rating={sim_user_avg:.3f}")
-            
-            user_booked_consultants = set(
-                consultant_interactions[
-                    (consultant_interactions['user_id'] == user_id) &
-                    (consultant_interactions['rating'] >= 0.5)  
-                ]['item_id']
-            )
-            print(f"📅 USER HISTORY:")
-            print(f"   Already completely booked consultants: {(user_booked_consultants)}")
+            for i, (row, sim_score) in enumerate(zip(neighbor_rows, neighbor_similarities), 1):
+                print(f"   {i}. User {user_consultant_matrix.user_ids[row]}: similarity={sim_score:.3f}")
             
-            consultant_recommendations = []
-            consultants_df = self.get_consultants_data()
+            if len(neighbor_rows) == 0:
+                print(f"❌ No similar users found with sufficient similarity")
+                return []
             
+            # Chỉ recommend consultants mà current user chưa book hoàn tất (rating >= 0.5) và còn trong catalog
+            user_booked_consultants = user_consultant_matrix.seen_items(user_id, min_rating=0.5)
+            catalog = self.get_catalog()
+            missing_items = np.flatnonzero(~user_consultant_matrix.item_ids.isin(list(catalog.consultant_index)))
+            exclude_items = np.union1d(user_booked_consultants, missing_items)
             
-            similarity_threshold = 0.1
-            rating_threshold = 0.5
-            
+            print(f"📅 USER HISTORY:")
+            print(f"   Already completely booked consultants: {list(user_consultant_matrix.item_ids[user_booked_consultants])}")
             print(f"🔍 FILTERING CRITERIA:")
             print(f"   Similarity threshold: {similarity_threshold}")
             print(f"   Rating threshold: {rating_threshold}")
             
-            for similar_user, similarity_score in top_similar_users.items():
-                if similarity_score < similarity_threshold:
-                    print(f"   ⏭️  Skipping user {similar_user} (similarity {similarity_score:.3f} < {similarity_threshold})")
-                    continue   
-                
-                # Lấy consultants mà similar user đã book với rating cao
-                similar_user_consultants = consultant_interactions[
-                    (consultant_interactions['user_id'] == similar_user) &
-                    (consultant_interactions['rating'] >= rating_threshold)
-                ]['item_id'].tolist()
-                print(f"   👤 User {similar_user} (sim: {similarity_score:.3f}):")
-                print(f"      High-rated consultants: {len(similar_user_consultants)}")
-                print(f"      Consultant IDs: {similar_user_consultants}")
-                for consultant_id in similar_user_consultants:
-                    # Chỉ recommend consultants mà current user chưa book
-                    if consultant_id not in user_booked_consultants:
-                        consultant_info = consultants_df[(consultants_df['consult_id']) == (consultant_id)]
-                        
-                        if not consultant_info.empty:
-                            consultant_info = consultant_info.iloc[0]
-                            print(f"         ✅ Recommending consultant {consultant_id}: '{consultant_info['full_name']}' (similarity_score: {similarity_score:.3f})")
-                            
-                            consultant_recommendations.append({
-                                'consultant_id': str(consultant_id),
-                                'name': str(consultant_info['full_name']),
-                                'specialization': str(consultant_info['specialization']) if consultant_info['specialization'] else 'General',
-                                'experience_years': int(consultant_info['experience_years']) if pd.notna(consultant_info['experience_years']) else 0,
-                                'similarity_score': float(similarity_score),
-                                'total_appointments': int(consultant_info['total_appointments']) if pd.notna(consultant_info['total_appointments']) else 0,
-                                'recommendation_type': 'collaborative',
-                                'reason': f"Users with {current_user_risk} risk level and {current_user_category} survey category also booked this consultant",
-                                'source_user': str(similar_user)
-                            })
-                        else:
-                            print(f"         ❌ Consultant {consultant_id} not found in consultants database")
-                    else:
-                        print(f"         ⏭️  Consultant {consultant_id} already booked by user")
-            
-            print(f"📊 DEDUPLICATION AND RANKING:")
-            print(f"   Raw recommendations: {(consultant_recommendations)}")
-            
-            # Bước 9: Remove duplicates và sort by predicted rating
-            seen_consultants = set()
-            unique_recommendations = []
-            for rec in consultant_recommendations:
-                if rec['consultant_id'] not in seen_consultants:
-                    seen_consultants.add((rec['consultant_id']))
-                    unique_recommendations.append(rec)
-                else:
-                    print(f"   🔄 Removing duplicate consultant: {rec['consultant_id']}")
-            
-            print(f"   Unique recommendations: {len(unique_recommendations)}")
-            
-            unique_recommendations.sort(key=lambda x: x['similarity_score'], reverse=True)
+            # Predicted score = similarities @ neighbor-consultant matrix / sum(similarities)
+            with stage_timer("neighbor_aggregation"):
+                item_indices, predicted_scores, source_positions = aggregate_neighbor_scores(
+                    user_consultant_matrix.liked_matrix(neighbor_rows, rating_threshold),
+                    neighbor_similarities,
+                    exclude_items,
+                    top_k
+                )
+            
+            recommendations = []
+            with stage_timer("candidate_resolution"):
+                for item_idx, predicted_score, source_position in zip(item_indices, predicted_scores, source_positions):
+                    consultant_info = catalog.get_consultant(user_consultant_matrix.item_ids[item_idx])
+                    recommendations.append({
+                        **consultant_info,
+                        'similarity_score': float(predicted_score),
+                        'recommendation_type': 'collaborative',
+                        'reason': f"Users with {current_user_risk} risk level and {current_user_category} survey category also booked this consultant",
+                        'source_user': str(user_consultant_matrix.user_ids[neighbor_rows[source_position]])
+                    })
             
             print(f"🏆 FINAL COLLABORATIVE CONSULTANT RECOMMENDATIONS:")
-            for i, rec in enumerate(unique_recommendations[:top_k], 1):
+            for i, rec in enumerate(recommendations, 1):
                 print(f"   {i}. {rec['name']} (Score: {rec['similarity_score']:.4f}, Source: User {rec['source_user']})")
             
             print("=" * 60)
-            return unique_recommendations[:top_k]
+            return recommendations
             
         except Exception as e:
             print(f"❌ Error in collaborative consultant filtering: {str(e)}")
@@ -1064,13 +1046,112 @@ class CRAFFTASSISTRecommendationSystem:
             traceback.print_exc()
             return []
 
+    def _als_recommendations(self, model: ImplicitALSModel, user_id: str, item_type: str, top_k: int) -> List[Dict]:
+        """Top_k items của item_type theo implicit ALS (trained factors hoặc fold-in cho user mới)"""
+        user_interactions = self.get_user_interactions_by_user(user_id)
+        with stage_timer("als_user_vector"):
+            user_vector = model.user_vector(user_id, user_interactions)
+        if user_vector is None:
+            print(f"❌ User {user_id} has no interactions with items known to ALS model {model.version}")
+            return []
+
+        catalog = self.get_catalog()
+        if user_interactions.empty:
+            seen = user_interactions
+        elif item_type == 'course':
+            seen = user_interactions[user_interactions['item_type'] == 'course']
+        else:
+            # Giống neighborhood CF: chỉ loại consultants đã book hoàn tất
+            seen = user_interactions[(user_interactions['item_type'] == 'consultant') & (user_interactions['rating'] >= 0.5)]
+        allowed = catalog.course_index if item_type == 'course' else catalog.consultant_index
+        with stage_timer("als_scoring"):
+            item_ids, scores = model.recommend(
+                user_vector, item_type, top_k,
+                exclude_item_ids=seen['item_id'] if not seen.empty else (),
+                allowed_item_ids=allowed
+            )
+
+        recommendations = []
+        for item_id, score in zip(item_ids, scores):
+            info = catalog.get_course(item_id) if item_type == 'course' else catalog.get_consultant(item_id)
+            recommendations.append({
+                **info,
+                'similarity_score': float(min(score, 1.0)),
+                'als_score': float(score),
+                'recommendation_type': 'collaborative',
+                'source_model': f"implicit_als:{model.version}"
+            })
+        return recommendations
+
+    @timed("course_total", engine="implicit_als")
+    def als_course_recommendations(self, model: ImplicitALSModel, user_id: str, top_k: int = 5) -> List[Dict]:
+        try:
+            return self._als_recommendations(model, user_id, 'course', top_k)
+        except Exception as e:
+            print(f"❌ Error in ALS course recommendations: {str(e)}")
+            return []
+
+    @timed("consultant_total", engine="implicit_als")
+    def als_consultant_recommendations(self, model: ImplicitALSModel, user_id: str, top_k: int = 3) -> List[Dict]:
+        try:
+            return self._als_recommendations(model, user_id, 'consultant', top_k)
+        except Exception as e:
+            print(f"❌ Error in ALS consultant recommendations: {str(e)}")
+            return []
+
+    def collaborative_consultant_recommendations(self, user_id: str, top_k: int = 3, engine: Optional[str] = None) -> List[Dict]:
+        """Consultants của collaborative engine (implicit ALS nếu có model, ngược lại neighborhood)"""
+        if not self.has_interactions(user_id, 'consultant'):
+            return []
+        engine = engine or COLLABORATIVE_ENGINE
+        als_model = get_implicit_als_model() if engine == 'als' else None
+        if als_model is not None:
+            return self.als_consultant_recommendations(als_model, user_id, top_k)
+        return self.collaborative_filtering_consultant_recommendations(user_id, top_k)
+
+    @timed("course_total", engine="two_stage")
+    def two_stage_course_recommendations(self, user_id: str, top_k: int = 5) -> List[Dict]:
+        """
+        Courses theo hai stage (app.service.candidates): generators rẻ trả về candidates,
+        ranker score hợp các candidates bằng content + collaborative signals + business rules
+        """
+        user_data = self.get_latest_user_survey(user_id)
+        if user_data is None:
+            return []
+        
+        catalog = self.get_catalog()
+        if catalog.courses_df.empty:
+            return []
+        
+        with stage_timer("tfidf_fit"):
+            content_model = get_course_content_model(catalog, self.create_risk_level_mapping())
+        if content_model is None:
+            return []
+        
+        with stage_timer("candidate_index"):
+            # Chỉ dựng DataFrame interactions (merge O(N)) khi index thật sự build lại
+            state = self.get_collaborative_state()
+            index = get_candidate_index(catalog, content_model, state.to_dataframe, state.data_version)
+        context = index.context(
+            user_id, user_data, self.get_user_interactions_by_user(user_id),
+            lambda: self.get_segment_index().users_in_segment(user_data['risk_level'], user_data['category_id'])
+        )
+        
+        with stage_timer("candidate_generation"):
+            candidates = generate_candidates(index, context)
+        candidate_count = len(np.unique(np.concatenate(list(candidates.values())))) if candidates else 0
+        print(f"🎯 Two-stage candidates: {candidate_count} unique of {index.num_courses} courses "
+              f"({', '.join(f'{name}={len(positions)}' for name, positions in candidates.items())})")
+        
+        with stage_timer("ranking"):
+            return rank_candidates(index, context, candidates, HYBRID_ENGINE_WEIGHTS, top_k)
+
     def get_user_risk_summary(self, user_id: str) -> Dict:
         """Lấy tóm tắt risk assessment của user"""
         try:
-            user_surveys = self.get_user_survey_data()
-            user_data = user_surveys[user_surveys['user_id'] == user_id]
+            latest_survey = self.get_latest_user_survey(user_id)
             
-            if user_data.empty:
+            if latest_survey is None:
                 return {
                     'latest_risk_level': None,
                     'latest_score': 0,
@@ -1079,9 +1160,6 @@ class CRAFFTASSISTRecommendationSystem:
                     'latest_category_id': None
                 }
             
-            # Get the latest survey (first row since data is ordered by completed_at DESC)
-            latest_survey = user_data.iloc[0]
-            
             # Log the category of the latest survey
             category_id = latest_survey['category_id']
             print(f"🏷️  User {user_id} latest survey category: {category_id}")
@@ -1090,7 +1168,7 @@ class CRAFFTASSISTRecommendationSystem:
                 'latest_risk_level': latest_survey['risk_level'],
                 'latest_score': int(latest_survey['total_score']) if latest_survey['total_score'] else 0,
                 'completed_at': latest_survey['completed_at'].isoformat() if pd.notna(latest_survey['completed_at']) else None,
-                'total_surveys_taken': len(user_data),
+                'total_surveys_taken': latest_survey['total_surveys_taken'],
                 'latest_category_id': str(category_id) if category_id else None
             }
             
@@ -1103,265 +1181,71 @@ class CRAFFTASSISTRecommendationSystem:
                 'total_surveys_taken': 0
             }
 
-    def hybrid_recommendations(self, user_id: str, top_k: int = 10) -> Dict:
+    @staticmethod
+    def _fuse_recommendations(id_key: str, engine_results: Dict[str, List[Dict]], top_k: int) -> Tuple[List[Dict], int]:
+        """
+        Gộp recommendations của các engines (theo id_key) bằng score_fusion.fuse_scores.
+        Record gốc là lần xuất hiện đầu tiên của item; mỗi engine ghi lại score của nó
+        (HYBRID_SCORE_KEYS), kèm hybrid_score, recommendation_source và score_provenance.
+        Trả về (top_k records, số items khác nhau).
+        """
+        inputs = [
+            EngineScores(
+                engine,
+                np.array([record.get(id_key) for record in records], dtype=object),
+                np.array([record.get(HYBRID_SCORE_KEYS[engine], 0) for record in records], dtype=np.float64)
+            )
+            for engine, records in engine_results.items()
+        ]
+        fused = fuse_scores(inputs, HYBRID_ENGINE_WEIGHTS, top_k)
+        records_by_engine = list(engine_results.values())
+
+        merged = []
+        for column, (engine_idx, position) in enumerate(zip(fused.first_engine, fused.first_position)):
+            record = dict(records_by_engine[engine_idx][position])
+            sources = fused.sources(column)
+            for row, engine in enumerate(fused.engines):
+                if fused.raw_scores[row, column] > 0:
+                    record[HYBRID_SCORE_KEYS[engine]] = float(fused.raw_scores[row, column])
+            record['hybrid_score'] = float(fused.scores[column])
+            if len(sources) > 1:
+                record['recommendation_source'] = 'both' if len(sources) == 2 else 'multiple'
+            else:
+                record['recommendation_source'] = sources[0] if sources else 'collaborative'
+            record['score_provenance'] = fused.provenance(column)
+            merged.append(record)
+        return merged, fused.unique_items
+
+    def stage_executor(self, user_id: str, deadline_ms: Optional[int] = None) -> StageExecutor:
+        """Executor (memo theo request) của RECOMMENDATION_STAGES cho user, deadline tính từ bây giờ"""
+        deadline = time.perf_counter() + deadline_ms / 1000.0 if deadline_ms else None
+        return RECOMMENDATION_STAGES.executor(self, user_id, deadline)
+
+    @timed("total", engine="hybrid")
+    def hybrid_recommendations(self, user_id: str, top_k: int = 10, executor: Optional[StageExecutor] = None,
+                               deadline_ms: Optional[int] = None, pipeline: Optional[str] = None) -> Dict:
         """
         Enhanced hybrid recommendation system combining content-based and collaborative filtering
         with proper score normalization and weighting
+        executor: dùng chung stage outputs với các phần khác của request (demo, explanation)
+        deadline_ms: stages rẻ (risk, content-based) chạy trước; collaborative chỉ chạy nếu còn đủ thời gian,
+        nếu bị bỏ qua thì kết quả là fusion của các stages còn lại và 'skipped_stages' liệt kê stages bị bỏ
+        pipeline: cách chọn courses, 'merge' hoặc 'two_stage' (mặc định HYBRID_COURSE_PIPELINE)
         """
         try:
             print(f"🚀 Starting hybrid recommendations for user: {user_id}")
             print("=" * 60)
-            
-            # Get user risk summary
-            user_risk_info = self.get_user_risk_summary(user_id)
-            print(f"📊 User risk info: {user_risk_info}")
-            
-            # GET CONTENT-BASED AND COLLABORATIVE RECOMMENDATIONS FROM
-            # Get content-based recommendations
-            content_courses = self.content_based_course_recommendations(user_id, top_k * 2)  # Get more to increase diversity
-            print(f"📚 Content-based course recommendations: {len(content_courses)} found")
-            content_consultants = self.content_based_consultant_recommendations(user_id, min(6, top_k * 2))
-            print(f"👩‍⚕️ Content-based consultant recommendations: {len(content_consultants)} found")
-            
-            # Get collaborative filtering recommendations
-            collab_result = self.collaborative_filtering_recommendations(user_id, top_k * 2)
-            collab_courses = collab_result.get('courses', [])
-            collab_consultants = collab_result.get('consultants', [])
-            print(f"🤝 Collaborative course recommendations: {len(collab_courses)}")
-            print(f"🤝 Collaborative consultant recommendations: {len(collab_consultants)} found")
-            # GET CONTENT-BASED AND COLLABORATIVE RECOMMENDATIONS TO
-
-            
-            # Combine and deduplicate courses with enhanced hybrid scoring
-            print(f"🔄 COMBINING COURSE RECOMMENDATIONS:")
-            all_courses = content_courses + collab_courses
-            course_ids_seen = {}
-            for i, course in enumerate(all_courses):
-                course_id = course.get('course_id')
-                if course_id in course_ids_seen:
-                    print(f"   🔄 DUPLICATE FOUND:")
-                    print(f"      Course {course_id} appeared before at index {course_ids_seen[course_id]}")
-                    print(f"      Previous: {all_courses[course_ids_seen[course_id]]}")
-                    print(f"      Current: {course}")
-                    print(f"      → Current will be SKIPPED due to deduplication logic")
-                else:
-                    course_ids_seen[course_id] = i
-                    print(f"   ✅ Course {course_id}: {course.get('recommendation_type', 'unknown')} - score: {course.get('score', 0):.3f}, similarity: {course.get('similarity_score', 0):.3f}")
-                
-            print(f"   Total courses from both methods: {(all_courses)}")
-            unique_courses = []
-            seen_course_ids = set()
-            
-            # Weights for hybrid scoring (can be tuned)
-            content_weight = 0.5
-            collaborative_weight = 0.5
-            print(f"📊 COURSE APPEARANCE ORDER:")
-            for i, course in enumerate(all_courses):
-                course_id = course.get('course_id')
-                course_type = course.get('recommendation_type', 'unknown')
-                content_score = course.get('score', 0)
-                collab_score = course.get('similarity_score', 0)
-                print(f"   {i:2d}. {course_id} ({course_type}): content={content_score:.3f}, collab={collab_score:.3f}")
-            
-            # SMART DEDUPLICATION WITH MERGING - Group all course versions by course_id
-            course_groups = {}
-            for course in all_courses:
-                course_id = course.get('course_id')
-                if course_id not in course_groups:
-                    course_groups[course_id] = []
-                course_groups[course_id].append(course)
-            
-            print(f"📊 SMART MERGING ANALYSIS:")
-            for course_id, course_versions in course_groups.items():
-                print(f"   Course {course_id}: {len(course_versions)} versions found")
-                for i, version in enumerate(course_versions):
-                    content_score = version.get('score', 0)
-                    collab_score = version.get('similarity_score', 0)
-                    rec_type = version.get('recommendation_type', 'unknown')
-                    print(f"      Version {i+1}: {rec_type} - content={content_score:.3f}, collab={collab_score:.3f}")
-            
-            # Merge all versions of each course
-            for course_id, course_versions in course_groups.items():
-                # Start with the first version as base
-                merged_course = course_versions[0].copy()
-                
-                # Collect all available scores from all versions
-                content_score = 0
-                collab_score = 0
-                has_content = False
-                has_collab = False
-                
-                for version in course_versions:
-                    if 'score' in version and version['score'] > 0:
-                        content_score = max(content_score, version['score'])  # Take the highest content score
-                        has_content = True
-                    if 'similarity_score' in version and version['similarity_score'] > 0:
-                        collab_score = max(collab_score, version['similarity_score'])  # Take the highest collab score
-                        has_collab = True
-                
-                # Calculate hybrid score from merged scores
-                hybrid_score = (content_score * content_weight) + (collab_score * collaborative_weight)
-                
-                # Determine source and apply boost
-                if has_content and has_collab:
-                    # hybrid_score *= 1.1  # 10% boost for items recommended by both methods
-                    source = 'both'
-                    print(f"   ✅ Course {course_id} MERGED: content={content_score:.3f}, collab={collab_score:.3f}, hybrid={hybrid_score:.3f} (BOOSTED - {source})")
-                elif has_content:
-                    source = 'content_based'
-                    print(f"   📚 Course {course_id}: content={content_score:.3f}, hybrid={hybrid_score:.3f} ({source})")
-                else:
-                    source = 'collaborative'
-                    print(f"   🤝 Course {course_id}: collab={collab_score:.3f}, hybrid={hybrid_score:.3f} ({source})")
-                
-                # Update merged course with final scores
-                if has_content:
-                    merged_course['score'] = content_score
-                if has_collab:
-                    merged_course['similarity_score'] = collab_score
-                merged_course['hybrid_score'] = float(hybrid_score)
-                merged_course['recommendation_source'] = str(source)
-                
-                unique_courses.append(merged_course)
-            
-            # Sort by hybrid score and take top K
-            unique_courses.sort(key=lambda x: x.get('hybrid_score', 0), reverse=True)
-            final_courses = unique_courses[:top_k]
-            
-            # Combine and deduplicate consultants with enhanced hybrid scoring
-            print(f"🔄 COMBINING CONSULTANT RECOMMENDATIONS:")
-            all_consultants = content_consultants + collab_consultants
-            consultant_ids_seen = {}
-            for i, consultant in enumerate(all_consultants):
-                consultant_id = consultant.get('consultant_id')
-                if consultant_id in consultant_ids_seen:
-                    print(f"   🔄 DUPLICATE FOUND:")
-                    print(f"      Consultant {consultant_id} appeared before at index {consultant_ids_seen[consultant_id]}")
-                    print(f"      Previous: {all_consultants[consultant_ids_seen[consultant_id]]}")
-                    print(f"      Current: {consultant}")
-                    print(f"      → Current will be SKIPPED due to deduplication logic")
-                else:
-                    consultant_ids_seen[consultant_id] = i
-                    print(f"   ✅ Consultant {consultant_id}: {consultant.get('recommendation_type', 'unknown')} - score: {consultant.get('score', 0):.3f}, similarity: {consultant.get('similarity_score', 0):.3f}")
-                
-            print(f"   Total consultants from both methods: {len(all_consultants)}")
-            
-            print(f"📊 CONSULTANT APPEARANCE ORDER:")
-            for i, consultant in enumerate(all_consultants):
-                consultant_id = consultant.get('consultant_id')
-                consultant_type = consultant.get('recommendation_type', 'unknown')
-                content_score = consultant.get('score', 0)
-                collab_score = consultant.get('similarity_score', 0)
-                print(f"   {i:2d}. {consultant_id} ({consultant_type}): content={content_score:.3f}, collab={collab_score:.3f}")
-            
-            # SMART DEDUPLICATION WITH MERGING - Group all consultant versions by consultant_id
-            consultant_groups = {}
-            for consultant in all_consultants:
-                consultant_id = consultant.get('consultant_id')
-                if consultant_id not in consultant_groups:
-                    consultant_groups[consultant_id] = []
-                consultant_groups[consultant_id].append(consultant)
-            
-            print(f"📊 SMART MERGING ANALYSIS:")
-            for consultant_id, consultant_versions in consultant_groups.items():
-                print(f"   Consultant {consultant_id}: {len(consultant_versions)} versions found")
-                for i, version in enumerate(consultant_versions):
-                    content_score = version.get('score', 0)
-                    collab_score = version.get('similarity_score', 0)
-                    rec_type = version.get('recommendation_type', 'unknown')
-                    print(f"      Version {i+1}: {rec_type} - content={content_score:.3f}, collab={collab_score:.3f}")
-            
-            # Merge all versions of each consultant
-            unique_consultants = []
-            for consultant_id, consultant_versions in consultant_groups.items():
-                # Start with the first version as base
-                merged_consultant = consultant_versions[0].copy()
-                
-                # Collect all available scores from all versions
-                content_score = 0
-                collab_score = 0
-                has_content = False
-                has_collab = False
-                
-                for version in consultant_versions:
-                    if 'score' in version and version['score'] > 0:
-                        content_score = max(content_score, version['score'])  # Take the highest content score
-                        has_content = True
-                    if 'similarity_score' in version and version['similarity_score'] > 0:
-                        collab_score = max(collab_score, version['similarity_score'])  # Take the highest collab score
-                        has_collab = True
-                
-                # Calculate hybrid score from merged scores
-                hybrid_score = (content_score * content_weight) + (collab_score * collaborative_weight)
-                
-                # Determine source and apply boost
-                if has_content and has_collab:
-                    # hybrid_score *= 1.1  # 10% boost for items recommended by both methods
-                    source = 'both'
-                    print(f"   ✅ Consultant {consultant_id} MERGED: content={content_score:.3f}, collab={collab_score:.3f}, hybrid={hybrid_score:.3f} (BOOSTED - {source})")
-                elif has_content:
-                    source = 'content_based'
-                    print(f"   👩‍⚕️ Consultant {consultant_id}: content={content_score:.3f}, hybrid={hybrid_score:.3f} ({source})")
-                else:
-                    source = 'collaborative'
-                    print(f"   🤝 Consultant {consultant_id}: collab={collab_score:.3f}, hybrid={hybrid_score:.3f} ({source})")
-                
-                # Update merged consultant with final scores
-                if has_content:
-                    merged_consultant['score'] = content_score
-                if has_collab:
-                    merged_consultant['similarity_score'] = collab_score
-                merged_consultant['hybrid_score'] = float(hybrid_score)
-                merged_consultant['recommendation_source'] = str(source)
-                
-                unique_consultants.append(merged_consultant)
-            
-            # Sort by hybrid score and take top K
-            unique_consultants.sort(key=lambda x: x.get('hybrid_score', 0), reverse=True)
-            final_consultants = unique_consultants[:min(5, top_k)]
-            
-            # Final results summary
-            print(f"🎯 HYBRID RECOMMENDATION RESULTS:")
-            print(f"   Final courses: {len(final_courses)} (from {len(unique_courses)} unique)")
-            print(f"   Final consultants: {len(final_consultants)} (from {len(unique_consultants)} unique)")
-            print(f"   Content weight: {content_weight}, Collaborative weight: {collaborative_weight}")
-            
-            # Show top recommendations
-            if final_courses:
-                print(f"🏆 Top 3 Course Recommendations:")
-                for i, course in enumerate(final_courses[:3], 1):
-                    source = course.get('recommendation_source', 'unknown')
-                    score = course.get('hybrid_score', 0)
-                    print(f"   {i}. {course.get('title', 'Unknown')[:40]}... (Score: {score:.4f}, Source: {source})")
-            
-            if final_consultants:
-                print(f"🏆 Top Consultant Recommendations:")
-                for i, consultant in enumerate(final_consultants, 1):
-                    source = consultant.get('recommendation_source', 'unknown')
-                    score = consultant.get('hybrid_score', 0)
-                    print(f"   {i}. {consultant.get('name', 'Unknown')} (Score: {score:.4f}, Source: {source})")
-            
+            executor = executor or self.stage_executor(user_id, deadline_ms)
+            pipeline = pipeline or HYBRID_COURSE_PIPELINE
+            result = executor.run('hybrid_two_stage' if pipeline == 'two_stage' else 'hybrid', top_k)
+            if executor.deadline is None:
+                return result
+            if executor.skipped:
+                print(f"⏱️  Deadline: skipped stages {executor.skipped}")
             return {
-                'courses': final_courses,
-                'consultants': final_consultants,
-                'user_risk_info': user_risk_info,
-                'recommendation_type': 'hybrid',
-                'hybrid_config': {
-                    'content_weight': content_weight,
-                    'collaborative_weight': collaborative_weight,
-                    'diversity_boost': 1.1
-                },
-                'recommendation_summary': {
-                    'total_courses': len(final_courses),
-                    'total_consultants': len(final_consultants),
-                    'content_based_courses': len(content_courses),
-                    'collaborative_courses': len(collab_courses),
-                    'content_based_consultants': len(content_consultants),
-                    'collaborative_consultants': len(collab_consultants),
-                    'unique_courses_found': len(unique_courses),
-                    'unique_consultants_found': len(unique_consultants)
-                },
-                'status': 'success'
+                **result,
+                'skipped_stages': list(executor.skipped),
+                'deadline_exceeded': executor.deadline_exceeded
             }
             
         except Exception as e:
@@ -1376,17 +1260,222 @@ class CRAFFTASSISTRecommendationSystem:
                 'message': str(e)
             }
 
-def get_user_recommendations(user_id: str, test_survey_id: str, total_score: int, risk_level: str, db: Session) -> dict:
+    def _hybrid_stage(self, user_id: str, top_k: int, risk_summary: Dict, content_consultants: List[Dict],
+                      content_courses: Optional[List[Dict]] = None, collaborative: Optional[Dict] = None,
+                      ranked_courses: Optional[List[Dict]] = None,
+                      collaborative_consultants: Optional[List[Dict]] = None) -> Dict:
+        """
+        Fusion của stage 'hybrid' / 'hybrid_two_stage': inputs (top_k * 2 mỗi engine) đã được executor tính sẵn.
+        Với two-stage, courses đã được ranker xếp hạng (ranked_courses), chỉ consultants cần fusion.
+        """
+        user_risk_info = risk_summary
+        content_courses = content_courses or []
+        collaborative = collaborative or {}
+        print(f"📊 User risk info: {user_risk_info}")
+        print(f"📚 Content-based course recommendations: {len(content_courses)} found")
+        print(f"👩‍⚕️ Content-based consultant recommendations: {len(content_consultants)} found")
+        collab_courses = collaborative.get('courses', [])
+        collab_consultants = collaborative.get('consultants', []) if collaborative_consultants is None else collaborative_consultants
+        print(f"🤝 Collaborative course recommendations: {len(collab_courses)}")
+        print(f"🤝 Collaborative consultant recommendations: {len(collab_consultants)} found")
+
+        # Fuse content-based + collaborative scores (một operator cho cả courses và consultants)
+        merge_started = time.perf_counter()
+        content_weight = HYBRID_ENGINE_WEIGHTS['content_based']
+        collaborative_weight = HYBRID_ENGINE_WEIGHTS['collaborative']
+        if ranked_courses is None:
+            final_courses, unique_course_count = self._fuse_recommendations(
+                'course_id', {'content_based': content_courses, 'collaborative': collab_courses}, top_k
+            )
+        else:
+            final_courses, unique_course_count = ranked_courses[:top_k], len(ranked_courses)
+        final_consultants, unique_consultant_count = self._fuse_recommendations(
+            'consultant_id', {'content_based': content_consultants, 'collaborative': collab_consultants}, min(5, top_k)
+        )
+        observe_stage("merge", time.perf_counter() - merge_started)
+        
+        # Final results summary
+        print(f"🎯 HYBRID RECOMMENDATION RESULTS:")
+        print(f"   Final courses: {len(final_courses)} (from {unique_course_count} unique)")
+        print(f"   Final consultants: {len(final_consultants)} (from {unique_consultant_count} unique)")
+        print(f"   Content weight: {content_weight}, Collaborative weight: {collaborative_weight}")
+        
+        # Show top recommendations
+        if final_courses:
+            print(f"🏆 Top 3 Course Recommendations:")
+            for i, course in enumerate(final_courses[:3], 1):
+                source = course.get('recommendation_source', 'unknown')
+                score = course.get('hybrid_score', 0)
+                print(f"   {i}. {course.get('title', 'Unknown')[:40]}... (Score: {score:.4f}, Source: {source})")
+        
+        if final_consultants:
+            print(f"🏆 Top Consultant Recommendations:")
+            for i, consultant in enumerate(final_consultants, 1):
+                source = consultant.get('recommendation_source', 'unknown')
+                score = consultant.get('hybrid_score', 0)
+                print(f"   {i}. {consultant.get('name', 'Unknown')} (Score: {score:.4f}, Source: {source})")
+        
+        result = {
+            'courses': final_courses,
+            'consultants': final_consultants,
+            'user_risk_info': user_risk_info,
+            'recommendation_type': 'hybrid',
+            'hybrid_config': {
+                'content_weight': content_weight,
+                'collaborative_weight': collaborative_weight,
+                'diversity_boost': 1.1,
+                'course_pipeline': 'merge' if ranked_courses is None else 'two_stage'
+            },
+            'recommendation_summary': {
+                'total_courses': len(final_courses),
+                'total_consultants': len(final_consultants),
+                'content_based_courses': len(content_courses),
+                'collaborative_courses': len(collab_courses),
+                'content_based_consultants': len(content_consultants),
+                'collaborative_consultants': len(collab_consultants),
+                'unique_courses_found': unique_course_count,
+                'unique_consultants_found': unique_consultant_count
+            },
+            'status': 'success'
+        }
+        # Explanation được ghi lại ngay lúc scoring: /recommendation-explanation chỉ cần lookup
+        result['recommendation_id'] = explanation_store.capture(user_id, result)
+        return result
+
+
+def _truncate_collaborative(result: Dict, top_k: int) -> Dict:
+    """Prefix top_k của kết quả collaborative đã tính với top_k lớn hơn (consultants: min(3, top_k))"""
+    courses = result.get('courses', [])[:top_k]
+    consultants = result.get('consultants', [])[:min(3, top_k)]
+    truncated = {**result, 'courses': courses, 'consultants': consultants}
+    if 'recommendation_summary' in result:
+        truncated['recommendation_summary'] = {
+            **result['recommendation_summary'],
+            'total_courses': len(courses),
+            'total_consultants': len(consultants)
+        }
+    return truncated
+
+
+def _truncate_ranked(records: List[Dict], top_k: int) -> List[Dict]:
+    return records[:top_k]
+
+
+def _skipped_collaborative(top_k: Optional[int]) -> Dict:
+    """Output của stage collaborative khi bị bỏ qua vì deadline"""
+    return {
+        'courses': [],
+        'consultants': [],
+        'recommendation_type': 'collaborative_filtering',
+        'recommendation_summary': {'total_courses': 0, 'total_consultants': 0, 'method': 'skipped'},
+        'status': 'skipped'
+    }
+
+
+def _no_interactions_collaborative(top_k: Optional[int]) -> Dict:
+    """Output của collaborative cho user chưa có interaction nào (không có user-item row để so sánh)"""
+    return {
+        'courses': [],
+        'consultants': [],
+        'recommendation_type': 'collaborative_filtering',
+        'recommendation_summary': {'total_courses': 0, 'total_consultants': 0, 'method': 'no_interactions'},
+        'status': 'success'
+    }
+
+
+# Pipeline của một recommendation request. Ranked stages (content-based, collaborative) sort theo score
+# nên top_k nhỏ là prefix của top_k lớn: /demo lấy top 5 từ lần tính top 20 của hybrid.
+# Inputs của hybrid theo thứ tự rẻ -> đắt; collaborative stages (neighborhood trên segment lớn) là các stages
+# đắt và bị bỏ qua khi không kịp deadline.
+RECOMMENDATION_STAGES = StageGraph([
+    Stage('risk_summary', lambda recommender, user_id, top_k: recommender.get_user_risk_summary(user_id)),
+    Stage('content_courses',
+          lambda recommender, user_id, top_k: recommender.content_based_course_recommendations(user_id, top_k),
+          truncate=_truncate_ranked),
+    Stage('content_consultants',
+          lambda recommender, user_id, top_k: recommender.content_based_consultant_recommendations(user_id, top_k),
+          truncate=_truncate_ranked),
+    Stage('collaborative',
+          lambda recommender, user_id, top_k, risk_summary: recommender.collaborative_filtering_recommendations(
+              user_id, top_k, user_risk_info=risk_summary
+          ),
+          inputs={'risk_summary': unranked},
+          truncate=_truncate_collaborative,
+          expensive=True,
+          fallback=_skipped_collaborative,
+          shortcut=lambda recommender, user_id, top_k: (
+              None if recommender.has_interactions(user_id) else _no_interactions_collaborative(top_k)
+          )),
+    Stage('hybrid',
+          lambda recommender, user_id, top_k, **inputs: recommender._hybrid_stage(user_id, top_k, **inputs),
+          inputs={
+              'risk_summary': unranked,
+              'content_courses': lambda top_k: top_k * 2,  # lấy nhiều hơn để tăng diversity
+              'content_consultants': lambda top_k: min(6, top_k * 2),
+              'collaborative': lambda top_k: top_k * 2,
+          }),
+    # Two-stage: courses từ candidate generators + ranker, consultants vẫn fusion content + collaborative
+    Stage('ranked_courses',
+          lambda recommender, user_id, top_k: recommender.two_stage_course_recommendations(user_id, top_k),
+          truncate=_truncate_ranked),
+    Stage('collaborative_consultants',
+          lambda recommender, user_id, top_k: recommender.collaborative_consultant_recommendations(user_id, top_k),
+          truncate=_truncate_ranked,
+          expensive=True,
+          fallback=lambda top_k: [],
+          shortcut=lambda recommender, user_id, top_k: (
+              None if recommender.has_interactions(user_id, 'consultant') else []
+          )),
+    Stage('hybrid_two_stage',
+          lambda recommender, user_id, top_k, **inputs: recommender._hybrid_stage(user_id, top_k, **inputs),
+          inputs={
+              'risk_summary': unranked,
+              'ranked_courses': lambda top_k: top_k,
+              'content_consultants': lambda top_k: min(6, top_k * 2),
+              'collaborative_consultants': lambda top_k: min(3, top_k * 2),
+          }),
+])
+
+
+def compute_user_recommendations(user_id: str, db: Session, deadline_ms: int) -> dict:
+    """Hybrid recommendations đầy đủ (không qua result cache), cùng top_k với GET /{user_id}"""
+    recommender = CRAFFTASSISTRecommendationSystem(db)
+    return recommender.hybrid_recommendations(user_id, top_k=10, deadline_ms=deadline_ms)
+
+
+def get_user_recommendations(user_id: str, test_survey_id: str, total_score: int, risk_level: str, db: Session,
+                             deadline_ms: Optional[int] = None,
+                             versions: Optional[Tuple[Optional[str], Optional[str]]] = None) -> dict:
     """
     Hàm chính để lấy recommendations cho user
+    deadline_ms: None = RECOMMENDATION_DEADLINE_MS, 0 = không giới hạn
+    versions: (user data version, catalog version) route đã đọc cho ETag (None = đọc ở đây)
+    Kết quả đầy đủ được cache theo (user_id, params) đến khi data của user hoặc catalog đổi; entry quá TTL
+    được trả ngay (trong max staleness) và tính lại ở background (result_refresher, không deadline)
     """
     try:
-        # Khởi tạo recommendation system
-        recommender = CRAFFTASSISTRecommendationSystem(db)
-        
-        # Lấy recommendations
-        recommendations = recommender.hybrid_recommendations(user_id, top_k=10)
+        # Cache hit không build catalog -> so version tokens (cùng tokens với ETag) để phát hiện catalog /
+        # data của user đổi (kể cả ở worker khác)
+        user_version, catalog_version = versions if versions is not None else get_recommendation_versions(db, user_id)
+        if catalog_version is not None:
+            recommendation_result_cache.on_catalog_change(catalog_version)
+        cache_key = recommendation_result_cache.key(user_id, test_survey_id, total_score, risk_level,
+                                                    HYBRID_COURSE_PIPELINE)
+        cached, stale = recommendation_result_cache.lookup(cache_key, allow_stale=result_refresher.enabled,
+                                                           data_version=user_version)
+        if cached is not None:
+            if stale:
+                result_refresher.submit(cache_key, lambda session: compute_user_recommendations(user_id, session, 0),
+                                        user_version)
+            return cached
+
+        token = recommendation_result_cache.token(cache_key)
+        recommendations = compute_user_recommendations(
+            user_id, db, RECOMMENDATION_DEADLINE_MS if deadline_ms is None else deadline_ms
+        )
         
+        # Kết quả thiếu stage (deadline) không được cache
+        recommendation_result_cache.put(cache_key, recommendations, token, user_version)
         return recommendations
     except Exception as e:
         return {
@@ -0,0 +1,304 @@
+"""
+Per-user cache của kết quả hybrid cuối cùng (get_user_recommendations)
+
+Phần lớn requests trả về đúng kết quả user đã nhận một phút trước. Cache LRU trong process, key là
+(user_id, params), giới hạn cả số entries lẫn bytes ước lượng (JSON size của kết quả):
+- invalidate_user(user_id) (survey / interactions của user đổi) -> xoá mọi entries của user đó
+  (listener của app.service.data_version)
+- catalog version đổi hoặc catalog bị invalidate -> xoá toàn bộ (listener của app.service.catalog)
+- entry lưu kèm user data version (data_version.get_user_data_version, cùng token với ETag): lookup với version
+  hiện tại khác -> miss, kể cả khi invalidate_user không chạy trong process này (worker khác nhận event)
+- RESULT_CACHE_TTL_SECONDS giới hạn độ cũ của tín hiệu collaborative (hành vi của users khác)
+Kết quả lỗi hoặc thiếu stage (deadline) không được cache.
+
+Stale-while-revalidate: entry quá TTL nhưng chưa quá RESULT_CACHE_MAX_STALE_SECONDS vẫn được trả ngay, ResultRefresher
+(thread pool nhỏ, mỗi key tối đa một refresh đang chờ) tính lại ở background với session riêng. Entry bị invalidate thì
+bị xoá hẳn, không bao giờ trả stale. Kết quả tính xong sau khi user / catalog bị invalidate bị bỏ (token generation).
+Trong bypass_result_cache() (profiling) mọi lookup là miss để request thật sự tính lại.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.service.catalog import add_catalog_listener
+from app.service.data_version import add_invalidation_listener, get_user_generation
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "5000"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+# Độ cũ tối đa (sau TTL) còn được trả trong lúc refresh ở background, 0 = tắt stale-while-revalidate
+RESULT_CACHE_MAX_STALE_SECONDS = float(os.getenv("RESULT_CACHE_MAX_STALE_SECONDS", "300"))
+RESULT_REFRESH_WORKERS = int(os.getenv("RESULT_REFRESH_WORKERS", "2"))
+RESULT_REFRESH_MAX_PENDING = int(os.getenv("RESULT_REFRESH_MAX_PENDING", "64"))
+
+ResultKey = Tuple[str, Tuple[Hashable, ...]]
+
+_bypass: ContextVar[bool] = ContextVar("result_cache_bypass", default=False)
+
+
+@contextmanager
+def bypass_result_cache():
+    """Trong block này lookup luôn miss (vd. profiling cần đo chính lần tính của request này)"""
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def is_result_cache_bypassed() -> bool:
+    return _bypass.get()
+
+
+def estimate_size(result: Dict) -> int:
+    """Bytes ước lượng của một kết quả (độ dài JSON, cùng bậc với bộ nhớ các dicts/strings)"""
+    return len(json.dumps(result, default=str))
+
+
+def is_cacheable(result: Dict) -> bool:
+    return result.get('status') == 'success' and not result.get('skipped_stages')
+
+
+class RecommendationResultCache:
+    """LRU (user_id, params) -> (result, bytes, thời điểm lưu, user data version), index theo user để invalidate có mục tiêu"""
+
+    def __init__(self, max_size: int = RESULT_CACHE_SIZE, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+                 max_stale_seconds: float = RESULT_CACHE_MAX_STALE_SECONDS):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self._entries: "OrderedDict[ResultKey, tuple]" = OrderedDict()
+        self._keys_by_user: Dict[str, Set[ResultKey]] = {}
+        self._lock = threading.Lock()
+        self.catalog_version: Optional[str] = None
+        self._catalog_epoch = 0
+        self.bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.evictions = 0
+        self.user_invalidations = 0
+        self.catalog_invalidations = 0
+
+    @staticmethod
+    def key(user_id: str, *params: Hashable) -> ResultKey:
+        return (str(user_id), tuple(params))
+
+    def _remove(self, key: ResultKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry[1]
+        user_keys = self._keys_by_user.get(key[0])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._keys_by_user[key[0]]
+
+    def lookup(self, key: ResultKey, allow_stale: bool = False,
+               data_version: Optional[str] = None) -> Tuple[Optional[Dict], bool]:
+        """
+        (kết quả, stale): stale = quá TTL nhưng trong max_stale_seconds (chỉ khi allow_stale), (None, False) nếu miss.
+        data_version: user data version hiện tại, entry lưu với version khác là miss (None = không kiểm tra)
+        """
+        if _bypass.get():
+            return None, False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and data_version is not None and entry[3] != data_version:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                age = time.time() - entry[2]
+                stale = age > self.ttl_seconds
+                if not stale or (allow_stale and age <= self.ttl_seconds + self.max_stale_seconds):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    if stale:
+                        self.stale_hits += 1
+                    return entry[0], stale
+                self._remove(key)
+            self.misses += 1
+            return None, False
+
+    def get(self, key: ResultKey) -> Optional[Dict]:
+        """Kết quả còn hạn, None nếu miss"""
+        return self.lookup(key)[0]
+
+    def token(self, key: ResultKey) -> Tuple[int, int]:
+        """Lấy trước khi tính; put với token cũ (user / catalog đã bị invalidate trong lúc tính) bị bỏ"""
+        with self._lock:
+            return self._catalog_epoch, get_user_generation(key[0])
+
+    def put(self, key: ResultKey, result: Dict, token: Optional[Tuple[int, int]] = None,
+            data_version: Optional[str] = None) -> bool:
+        """Lưu kết quả (nếu cacheable và vừa giới hạn bytes) với user data version đọc trước khi tính, True nếu đã lưu"""
+        if not is_cacheable(result):
+            return False
+        size = estimate_size(result)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if token is not None and token != (self._catalog_epoch, get_user_generation(key[0])):
+                self.discarded += 1
+                return False
+            self._remove(key)
+            self._entries[key] = (result, size, time.time(), data_version)
+            self._keys_by_user.setdefault(key[0], set()).add(key)
+            self.bytes += size
+            while len(self._entries) > self.max_size or self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return True
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            keys = self._keys_by_user.get(str(user_id))
+            if keys:
+                for key in list(keys):
+                    self._remove(key)
+                self.user_invalidations += 1
+
+    def on_catalog_change(self, version: Optional[str]) -> None:
+        """Catalog version mới (hoặc None: catalog bị invalidate) -> xoá toàn bộ"""
+        with self._lock:
+            if version is not None and version == self.catalog_version:
+                return
+            self.catalog_version = version
+            self._catalog_epoch += 1
+            if self._entries:
+                self._entries.clear()
+                self._keys_by_user.clear()
+                self.bytes = 0
+                self.catalog_invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'users': len(self._keys_by_user),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'discarded': self.discarded,
+                'user_invalidations': self.user_invalidations,
+                'catalog_invalidations': self.catalog_invalidations
+            }
+
+
+class ResultRefresher:
+    """Bounded thread pool tính lại entries stale; mỗi key tối đa một refresh đang chờ / chạy"""
+
+    def __init__(self, cache: RecommendationResultCache, workers: int = RESULT_REFRESH_WORKERS,
+                 max_pending: int = RESULT_REFRESH_MAX_PENDING):
+        self.cache = cache
+        self.workers = workers
+        self.max_pending = max_pending
+        self.session_factory: Optional[Callable[[], Session]] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Set[ResultKey] = set()
+        self._lock = threading.Lock()
+        self.scheduled = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.completed = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.session_factory is not None and self.cache.max_stale_seconds > 0
+
+    def start(self, session_factory: Callable[[], Session]) -> None:
+        """Bật refresh ở background; mỗi job mở session riêng từ session_factory"""
+        with self._lock:
+            self.session_factory = session_factory
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="result-refresh")
+
+    def stop(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self.session_factory = None
+            self._pending.clear()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, key: ResultKey, compute: Callable[[Session], Dict], data_version: Optional[str] = None) -> bool:
+        """
+        Lên lịch compute(session) cho key, False nếu refresher tắt hoặc hàng đợi đầy.
+        data_version: user data version lúc submit (kết quả mới được lưu với version này)
+        """
+        with self._lock:
+            if self._executor is None or self.session_factory is None:
+                return False
+            if key in self._pending:
+                self.deduplicated += 1
+                return True
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.add(key)
+            self.scheduled += 1
+            token = self.cache.token(key)
+            self._executor.submit(self._refresh, key, compute, token, data_version, self.session_factory)
+        return True
+
+    def _refresh(self, key: ResultKey, compute: Callable[[Session], Dict], token: Tuple[int, int],
+                 data_version: Optional[str], session_factory: Callable[[], Session]) -> None:
+        db = session_factory()
+        try:
+            self.cache.put(key, compute(db), token, data_version)
+            with self._lock:
+                self.completed += 1
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"Error refreshing cached recommendations for {key}: {str(e)}")
+            db.rollback()
+        finally:
+            db.close()
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': int(self.enabled),
+                'pending': len(self._pending),
+                'scheduled': self.scheduled,
+                'deduplicated': self.deduplicated,
+                'dropped': self.dropped,
+                'completed': self.completed,
+                'errors': self.errors
+            }
+
+
+recommendation_result_cache = RecommendationResultCache()
+result_refresher = ResultRefresher(recommendation_result_cache)
+
+add_invalidation_listener(recommendation_result_cache.invalidate_user)
+add_catalog_listener(recommendation_result_cache.on_catalog_change)
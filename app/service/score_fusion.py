@@ -0,0 +1,128 @@
+"""
+Score fusion cho hybrid recommendations: một operator chung cho mọi item type và mọi số engine
+
+Input của mỗi engine là (item_ids, scores) dạng arrays. Fuser:
+1. intern ids của mọi engine một lần (pd.factorize, giữ thứ tự xuất hiện đầu tiên)
+2. dựng matrix engines x items, lấy max score mỗi (engine, item) bằng np.maximum.at
+3. normalize từng engine ('none' | 'max' | 'minmax') và nhân weights trong numpy
+4. chọn top_k ổn định (argpartition + tie-break theo thứ tự xuất hiện, giống list.sort stable)
+5. trả về provenance: score thô, score sau normalize và phần đóng góp của từng engine cho mỗi item
+
+Thêm engine chỉ là thêm một input; không có vòng lặp Python theo engine x item.
+"""
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+NORMALIZATIONS = ('none', 'max', 'minmax')
+
+
+class EngineScores(NamedTuple):
+    """Output của một engine: item_ids[i] có scores[i]; score <= 0 coi như engine không recommend item"""
+    engine: str
+    item_ids: np.ndarray
+    scores: np.ndarray
+
+
+class FusedScores(NamedTuple):
+    engines: List[str]
+    item_ids: np.ndarray           # items được chọn, theo thứ tự fused score giảm dần
+    scores: np.ndarray             # fused score
+    raw_scores: np.ndarray         # engines x selected: max score thô (0 nếu engine không có item)
+    normalized_scores: np.ndarray  # engines x selected: sau normalize
+    contributions: np.ndarray      # engines x selected: weight * normalized
+    first_engine: np.ndarray       # engine index nơi item xuất hiện đầu tiên
+    first_position: np.ndarray     # vị trí của item trong input của engine đó
+    unique_items: int              # tổng số items khác nhau trước khi chọn top_k
+
+    def sources(self, column: int) -> List[str]:
+        """Các engines đã recommend item ở cột column (score > 0)"""
+        return [engine for engine, raw in zip(self.engines, self.raw_scores[:, column]) if raw > 0]
+
+    def provenance(self, column: int) -> Dict[str, Dict[str, float]]:
+        return {
+            engine: {
+                'score': float(self.raw_scores[row, column]),
+                'normalized': float(self.normalized_scores[row, column]),
+                'contribution': float(self.contributions[row, column]),
+            }
+            for row, engine in enumerate(self.engines)
+            if self.raw_scores[row, column] > 0
+        }
+
+
+def stable_top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Index của top_k scores giảm dần; bằng nhau thì index nhỏ trước (như sort stable)"""
+    n = len(scores)
+    if top_k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if top_k < n:
+        kth = np.partition(scores, n - top_k)[n - top_k]
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(n)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:top_k]
+
+
+def _normalize(matrix: np.ndarray, present: np.ndarray, method: str) -> np.ndarray:
+    if method == 'none':
+        return matrix
+    masked = np.where(present, matrix, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        high = np.nanmax(masked, axis=1, keepdims=True)
+        if method == 'max':
+            normalized = matrix / high
+        else:
+            low = np.nanmin(masked, axis=1, keepdims=True)
+            span = high - low
+            normalized = np.where(span > 0, (matrix - low) / span, 1.0)
+    return np.where(present, np.nan_to_num(normalized), 0.0)
+
+
+def fuse_scores(inputs: Sequence[EngineScores], weights: Dict[str, float], top_k: int,
+                normalization: Optional[Dict[str, str]] = None) -> FusedScores:
+    """Gộp scores của các engines thành một ranking, normalization mặc định 'none' cho mọi engine"""
+    engines = [item.engine for item in inputs]
+    lengths = np.array([len(item.item_ids) for item in inputs], dtype=np.int64)
+    all_ids = np.concatenate([np.asarray(item.item_ids, dtype=object) for item in inputs]) if inputs else np.zeros(0, dtype=object)
+    all_scores = np.concatenate([np.asarray(item.scores, dtype=np.float64) for item in inputs]) if inputs else np.zeros(0)
+    engine_of = np.repeat(np.arange(len(inputs)), lengths)
+
+    codes, unique_ids = pd.factorize(all_ids, sort=False)
+    num_items = len(unique_ids)
+
+    # Max score mỗi (engine, item); chỉ score > 0 được tính là engine có recommend item
+    raw = np.zeros((len(inputs), num_items), dtype=np.float64)
+    positive = all_scores > 0
+    np.maximum.at(raw, (engine_of[positive], codes[positive]), all_scores[positive])
+    present = raw > 0
+
+    methods = normalization or {}
+    normalized = np.vstack([
+        _normalize(raw[row:row + 1], present[row:row + 1], methods.get(engine, 'none'))
+        for row, engine in enumerate(engines)
+    ]) if inputs else raw
+    weight_vector = np.array([weights.get(engine, 0.0) for engine in engines], dtype=np.float64)
+    contributions = normalized * weight_vector[:, None]
+    fused = contributions.sum(axis=0)
+
+    # Lần xuất hiện đầu tiên của mỗi item (để lấy record gốc)
+    first_index = np.full(num_items, len(all_ids), dtype=np.int64)
+    np.minimum.at(first_index, codes, np.arange(len(all_ids)))
+    offsets = np.concatenate([[0], np.cumsum(lengths)])[:-1] if len(inputs) else np.zeros(0, dtype=np.int64)
+
+    chosen = stable_top_k(fused, top_k)
+    first_engine = engine_of[first_index[chosen]] if len(chosen) else np.zeros(0, dtype=np.int64)
+    return FusedScores(
+        engines=engines,
+        item_ids=np.asarray(unique_ids, dtype=object)[chosen],
+        scores=fused[chosen],
+        raw_scores=raw[:, chosen],
+        normalized_scores=normalized[:, chosen],
+        contributions=contributions[:, chosen],
+        first_engine=first_engine,
+        first_position=first_index[chosen] - offsets[first_engine] if len(chosen) else np.zeros(0, dtype=np.int64),
+        unique_items=num_items,
+    )
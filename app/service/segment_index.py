@@ -0,0 +1,180 @@
+"""
+Segment index cho survey attempts: (risk_level, category_id) -> users và risk_level -> users
+
+Mỗi segment là một sorted int32 array các interned user codes. Chọn candidate users cho
+collaborative filtering chỉ còn là một dict lookup (+ intersection với users có interactions),
+thay vì scan toàn bộ user_surveys DataFrame mỗi request.
+
+Index được build một lần trong process rồi cập nhật dần khi có survey attempts mới
+(record_attempt, hoặc poll các rows có created_at sau watermark).
+"""
+import os
+import threading
+import time
+from typing import Dict, Hashable, Iterable, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.database.routing import BULK, POINT, routed
+from app.service.data_version import invalidate_user
+
+SEGMENT_INDEX_POLL_SECONDS = float(os.getenv("SEGMENT_INDEX_POLL_SECONDS", "30"))
+SEGMENT_INDEX_REBUILD_SECONDS = float(os.getenv("SEGMENT_INDEX_REBUILD_SECONDS", "3600"))
+
+_EMPTY_CODES = np.zeros(0, dtype=np.int32)
+
+
+class SurveySegmentIndex:
+    """(risk_level, category_id) / risk_level -> sorted int32 array của user codes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._user_codes: Dict[str, int] = {}
+        self._user_ids = np.empty(0, dtype=object)
+        self._num_users = 0
+        self._by_segment: Dict[Hashable, np.ndarray] = {}
+        self._by_risk: Dict[Hashable, np.ndarray] = {}
+        self.watermark = None
+        self.built_at = time.time()
+        self.polled_at = self.built_at
+
+    def __len__(self) -> int:
+        return self._num_users
+
+    def _intern(self, user_id: str) -> int:
+        code = self._user_codes.get(user_id)
+        if code is None:
+            code = self._num_users
+            if code >= len(self._user_ids):
+                grown = np.empty(max(16, 2 * len(self._user_ids)), dtype=object)
+                grown[:code] = self._user_ids[:code]
+                self._user_ids = grown
+            self._user_ids[code] = user_id
+            self._user_codes[user_id] = code
+            self._num_users += 1
+        return code
+
+    @staticmethod
+    def _add_code(segments: Dict[Hashable, np.ndarray], key: Hashable, code: int) -> bool:
+        codes = segments.get(key, _EMPTY_CODES)
+        pos = int(np.searchsorted(codes, code))
+        if pos < len(codes) and codes[pos] == code:
+            return False
+        # Copy-on-write: readers đang giữ array cũ không bị ảnh hưởng
+        segments[key] = np.insert(codes, pos, code).astype(np.int32)
+        return True
+
+    def record_attempt(self, user_id: str, risk_level: str, category_id: Optional[str], created_at=None) -> bool:
+        """Thêm một survey attempt vào index, trả về True nếu segment membership thay đổi"""
+        with self._lock:
+            code = self._intern(str(user_id))
+            changed = self._add_code(self._by_segment, (risk_level, str(category_id)), code)
+            changed = self._add_code(self._by_risk, risk_level, code) or changed
+            if created_at is not None and (self.watermark is None or created_at > self.watermark):
+                self.watermark = created_at
+            return changed
+
+    def record_attempts(self, rows: Iterable) -> int:
+        """Thêm nhiều attempts (rows có user_id, risk_level, category_id, created_at)"""
+        changed = 0
+        for row in rows:
+            if self.record_attempt(row.user_id, row.risk_level, row.category_id, row.created_at):
+                changed += 1
+        return changed
+
+    def _decode(self, codes: np.ndarray, exclude_user: Optional[str]) -> np.ndarray:
+        user_ids = self._user_ids[codes]
+        if exclude_user is not None:
+            user_ids = user_ids[user_ids != exclude_user]
+        return user_ids
+
+    def users_in_segment(self, risk_level: str, category_id: Optional[str], exclude_user: Optional[str] = None) -> np.ndarray:
+        """User ids có attempt với cùng risk_level AND category_id"""
+        return self._decode(self._by_segment.get((risk_level, str(category_id)), _EMPTY_CODES), exclude_user)
+
+    def users_with_risk(self, risk_level: str, exclude_user: Optional[str] = None) -> np.ndarray:
+        """User ids có attempt với cùng risk_level (fallback khi segment rỗng)"""
+        return self._decode(self._by_risk.get(risk_level, _EMPTY_CODES), exclude_user)
+
+    def segment_sizes(self) -> Dict[str, int]:
+        return {f"{risk}:{category}": len(codes) for (risk, category), codes in self._by_segment.items()}
+
+
+_ATTEMPTS_SQL = """
+    SELECT
+        sa.user_id,
+        sa.risk_level,
+        ts.category_id,
+        sa.created_at
+    FROM "Survey_Attempts" sa
+    JOIN "Users" u ON sa.user_id = u.id
+    JOIN "Test_Survey" ts ON sa.test_survey_id = ts.id
+    WHERE u.is_deleted = false
+"""
+
+
+def build_segment_index(db: Session) -> SurveySegmentIndex:
+    """Build index từ toàn bộ Survey_Attempts (chỉ các cột cần cho segment)"""
+    rows = db.execute(routed(_ATTEMPTS_SQL, BULK)).fetchall()
+    index = SurveySegmentIndex()
+    index.record_attempts(rows)
+    print(f"🗂️  Built survey segment index: {len(index)} users, {len(index.segment_sizes())} segments")
+    return index
+
+
+def poll_segment_index(db: Session, index: SurveySegmentIndex) -> int:
+    """Thêm các attempts có created_at từ watermark trở đi (record_attempt idempotent nên >= là an toàn)"""
+    if index.watermark is None:
+        rows = db.execute(routed(_ATTEMPTS_SQL, BULK)).fetchall()
+    else:
+        rows = db.execute(routed(_ATTEMPTS_SQL + " AND sa.created_at >= :watermark", POINT),
+                          {'watermark': index.watermark}).fetchall()
+    index.polled_at = time.time()
+    watermark = index.watermark
+    for row in rows:
+        # Attempt mới -> các cache per-user (latest survey, result cache) không còn đúng.
+        # Rows đúng bằng watermark đã thấy ở lần poll trước: không invalidate lại mỗi lần poll
+        if watermark is None or (row.created_at is not None and row.created_at > watermark):
+            invalidate_user(row.user_id)
+    return index.record_attempts(rows)
+
+
+_segment_index_lock = threading.Lock()
+_segment_index: Optional[SurveySegmentIndex] = None
+
+
+def get_segment_index(db: Session) -> SurveySegmentIndex:
+    """Segment index dùng chung trong process: poll attempts mới định kỳ, rebuild toàn bộ khi quá hạn"""
+    global _segment_index
+    with _segment_index_lock:
+        now = time.time()
+        index = _segment_index
+        if index is None or now - index.built_at > SEGMENT_INDEX_REBUILD_SECONDS:
+            _segment_index = index = build_segment_index(db)
+        elif now - index.polled_at > SEGMENT_INDEX_POLL_SECONDS:
+            changed = poll_segment_index(db, index)
+            if changed:
+                print(f"🗂️  Segment index: {changed} new segment memberships")
+        return index
+
+
+def record_survey_attempt(user_id: str, risk_level: str, category_id: Optional[str]) -> bool:
+    """
+    Áp dụng survey completion event vào segment index đang dùng (nếu đã build).
+    Không đẩy watermark: poll kế tiếp vẫn đọc các rows chưa thấy (record_attempt idempotent).
+    """
+    index = _segment_index
+    if index is None:
+        return False
+    return index.record_attempt(user_id, risk_level, category_id)
+
+
+def apply_survey_attempts(rows: Iterable) -> int:
+    """Merge attempts từ change feed vào segment index đang dùng; request path không cần tự poll nữa"""
+    index = _segment_index
+    if index is None:
+        return 0
+    changed = index.record_attempts(rows)
+    index.polled_at = time.time()
+    return changed
@@ -0,0 +1,105 @@
+"""
+Single-flight coalescing cho các recommendation requests giống hệt nhau đang chạy đồng thời
+
+Khi app mở, nhiều màn hình gọi /recommendations/{user_id}, /courses, /consultants, /risk-summary cùng
+lúc. Với cùng key (endpoint kind, user_id, params): caller đầu tiên (leader) tính, các caller trùng
+(followers) chờ kết quả đó. Follower chờ quá SINGLE_FLIGHT_TIMEOUT_SECONDS thì tự tính (không bao giờ
+kẹt vì một leader chậm).
+"""
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable
+
+SINGLE_FLIGHT_TIMEOUT_SECONDS = float(os.getenv("SINGLE_FLIGHT_TIMEOUT_SECONDS", "30"))
+
+_bypass: ContextVar[bool] = ContextVar("single_flight_bypass", default=False)
+
+
+@contextmanager
+def bypass_single_flight():
+    """Trong block này do() luôn tự tính (vd. profiling cần đo chính request này)"""
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Mỗi key chỉ có tối đa một lần tính đang chạy; các caller trùng dùng chung kết quả"""
+
+    def __init__(self, timeout_seconds: float = SINGLE_FLIGHT_TIMEOUT_SECONDS):
+        self.timeout_seconds = timeout_seconds
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout_seconds: float = None) -> Any:
+        """Chạy fn() cho key, hoặc chờ kết quả của lần chạy đang diễn ra với cùng key"""
+        if _bypass.get():
+            return fn()
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                leader = False
+
+        if not leader:
+            timeout = self.timeout_seconds if timeout_seconds is None else timeout_seconds
+            if not call.done.wait(timeout):
+                with self._lock:
+                    self.timeouts += 1
+                print(f"⏱️  Single-flight timeout after {timeout}s for {key}, computing locally")
+                return fn()
+            with self._lock:
+                self.coalesced += 1
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.leaders + self.coalesced
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+                'coalesced_ratio': self.coalesced / total if total else 0.0
+            }
+
+
+recommendation_flight = SingleFlight()
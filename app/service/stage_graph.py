@@ -0,0 +1,185 @@
+"""
+Recommendation pipeline dạng DAG các stage có tên, mỗi stage khai báo inputs của nó
+
+Một StageExecutor sống trong một request (một user) và tính mỗi stage nhiều nhất một lần:
+- inputs được resolve trước (đệ quy), rồi truyền vào compute dưới dạng keyword arguments
+- output được memoize theo tên stage. Với stage trả về ranked list (có `truncate`), output đã tính
+  với top_k lớn hơn phục vụ luôn top_k nhỏ hơn bằng cách cắt prefix; top_k lớn hơn thì tính lại
+- stage không có `truncate` (vd. hybrid: fusion phụ thuộc top_k) được memoize theo (tên, top_k)
+
+Endpoints ghép nhiều stage (demo, recommendation-explanation) dùng chung một executor, nên
+content-based / collaborative / risk summary chỉ được tính một lần dù nhiều kết quả cần đến chúng.
+
+Deadline ("anytime"): executor có thể nhận deadline. Inputs chạy theo thứ tự khai báo (stage rẻ trước);
+stage `expensive` chỉ được bắt đầu khi thời gian còn lại >= chi phí ước lượng của nó (EWMA thời gian
+chạy các lần trước trong process), nếu không nó bị bỏ qua và input nhận `fallback` (kết quả rỗng).
+Stage đang chạy không bị ngắt giữa chừng (nó dùng chung DB session của request).
+
+Shortcut: stage có thể khai báo `shortcut(recommender, user_id, top_k)` trả về output rẻ khi stage không cần
+chạy cho user này (vd. collaborative cho user chưa có interaction nào). Khi đó inputs không được tính, chi phí
+không được ghi vào EWMA (không làm lệch ước lượng cho deadline) và stage không bị tính là skipped.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app.service.metrics import registry
+
+STAGE_RUNS = registry.counter("stage_graph_runs_total", "Stage graph lookups per stage", ("stage", "outcome"))
+
+STAGE_COST_EWMA_ALPHA = 0.2
+
+_cost_lock = threading.Lock()
+_stage_costs: Dict[str, float] = {}
+
+
+def observe_stage_cost(name: str, seconds: float) -> None:
+    with _cost_lock:
+        previous = _stage_costs.get(name)
+        _stage_costs[name] = seconds if previous is None else previous + STAGE_COST_EWMA_ALPHA * (seconds - previous)
+
+
+def expected_stage_cost(name: str) -> float:
+    """Thời gian chạy ước lượng (giây) của stage, 0 nếu chưa chạy lần nào"""
+    return _stage_costs.get(name, 0.0)
+
+
+def stage_costs() -> Dict[str, float]:
+    with _cost_lock:
+        return dict(_stage_costs)
+
+
+def unranked(top_k: Optional[int]) -> Optional[int]:
+    """Input không phụ thuộc top_k (vd. risk summary)"""
+    return None
+
+
+class Stage(NamedTuple):
+    """
+    compute(recommender, user_id, top_k, **inputs) -> output
+    inputs: tên stage input -> hàm đổi top_k của stage này thành top_k cần cho input đó
+    truncate(output, top_k): cắt output đã tính với top_k lớn hơn (None = không cắt được)
+    expensive: có thể bị bỏ qua khi không đủ thời gian trước deadline, khi đó output là fallback(top_k)
+    shortcut(recommender, user_id, top_k): output thay cho compute nếu khác None (không tính inputs)
+    """
+    name: str
+    compute: Callable[..., Any]
+    inputs: Dict[str, Callable[[Optional[int]], Optional[int]]] = {}
+    truncate: Optional[Callable[[Any, int], Any]] = None
+    expensive: bool = False
+    fallback: Optional[Callable[[Optional[int]], Any]] = None
+    shortcut: Optional[Callable[[Any, str, Optional[int]], Any]] = None
+
+
+class StageGraph:
+    """Tập stages đã kiểm tra: inputs phải được khai báo trước (nên đồ thị luôn là DAG)"""
+
+    def __init__(self, stages: Iterable[Stage]):
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage: {stage.name}")
+            missing = [name for name in stage.inputs if name not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on undeclared stages: {missing}")
+            if stage.expensive and stage.fallback is None:
+                raise ValueError(f"Expensive stage {stage.name} needs a fallback")
+            self.stages[stage.name] = stage
+
+    def __getitem__(self, name: str) -> Stage:
+        return self.stages[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.stages
+
+    def executor(self, recommender, user_id: str, deadline: Optional[float] = None) -> "StageExecutor":
+        return StageExecutor(self, recommender, user_id, deadline)
+
+
+class StageExecutor:
+    """Memo các stage outputs cho một request; không thread-safe (một request = một thread)"""
+
+    def __init__(self, graph: StageGraph, recommender, user_id: str, deadline: Optional[float] = None):
+        self.graph = graph
+        self.recommender = recommender
+        self.user_id = user_id
+        self.deadline = deadline  # time.perf_counter() tuyệt đối, None = không giới hạn
+        # tên stage (ranked, cắt được) hoặc (tên, top_k) -> (top_k đã tính, output)
+        self._memo: Dict[Any, Tuple[Optional[int], Any]] = {}
+        self.computed: List[Tuple[str, Optional[int]]] = []
+        self.reused: List[Tuple[str, Optional[int]]] = []
+        self.skipped: List[str] = []
+        self.shortcut: List[Tuple[str, Optional[int]]] = []
+
+    def _memo_key(self, stage: Stage, top_k: Optional[int]):
+        return stage.name if stage.truncate is not None else (stage.name, top_k)
+
+    def _lookup(self, stage: Stage, top_k: Optional[int]) -> Tuple[bool, Any]:
+        entry = self._memo.get(self._memo_key(stage, top_k))
+        if entry is None:
+            return False, None
+        computed_top_k, output = entry
+        if stage.truncate is None or top_k is None:
+            return True, output
+        if computed_top_k is not None and top_k > computed_top_k:
+            return False, None
+        return True, output if top_k == computed_top_k else stage.truncate(output, top_k)
+
+    def remaining(self) -> Optional[float]:
+        """Số giây còn lại trước deadline (None nếu không có deadline)"""
+        return None if self.deadline is None else self.deadline - time.perf_counter()
+
+    @property
+    def deadline_exceeded(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining < 0
+
+    def _has_time_for(self, stage: Stage) -> bool:
+        remaining = self.remaining()
+        return remaining is None or remaining > expected_stage_cost(stage.name)
+
+    def run(self, name: str, top_k: Optional[int] = None) -> Any:
+        """Output của stage name (với top_k), tính inputs trước nếu cần"""
+        stage = self.graph[name]
+        found, output = self._lookup(stage, top_k)
+        if found:
+            self.reused.append((name, top_k))
+            STAGE_RUNS.inc(name, "reused")
+            return output
+
+        if stage.shortcut is not None:
+            output = stage.shortcut(self.recommender, self.user_id, top_k)
+            if output is not None:
+                self._memo[self._memo_key(stage, top_k)] = (top_k, output)
+                self.shortcut.append((name, top_k))
+                STAGE_RUNS.inc(name, "shortcut")
+                return output
+
+        if stage.expensive and not self._has_time_for(stage):
+            # Fallback không được memoize. Ước lượng chi phí giảm dần sau mỗi lần bỏ qua để stage
+            # được thử lại (không bị bỏ qua mãi vì một lần chạy chậm, vd. cache còn lạnh)
+            observe_stage_cost(name, 0.0)
+            if name not in self.skipped:
+                self.skipped.append(name)
+            STAGE_RUNS.inc(name, "skipped")
+            return stage.fallback(top_k)
+
+        inputs = {
+            input_name: self.run(input_name, input_top_k(top_k))
+            for input_name, input_top_k in stage.inputs.items()
+        }
+        started = time.perf_counter()
+        output = stage.compute(self.recommender, self.user_id, top_k, **inputs)
+        observe_stage_cost(name, time.perf_counter() - started)
+        self._memo[self._memo_key(stage, top_k)] = (top_k, output)
+        self.computed.append((name, top_k))
+        STAGE_RUNS.inc(name, "computed")
+        return output
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'computed': [f"{name}@{top_k}" if top_k is not None else name for name, top_k in self.computed],
+            'reused': len(self.reused),
+            'skipped': list(self.skipped),
+            'shortcut': [name for name, _ in self.shortcut],
+        }
@@ -0,0 +1,68 @@
+-- Indexes cho các loader / point queries của recommendation service
+-- (app/service/recommendation_action.py, latest_survey.py, data_version.py, segment_index.py, catalog.py)
+--
+-- CREATE INDEX CONCURRENTLY không chạy được trong transaction: apply bằng
+--   psql "$DATABASE_URL" -f migrations/001_recommendation_loader_indexes.sql
+-- (không dùng --single-transaction). IF NOT EXISTS -> chạy lại an toàn.
+-- Kiểm tra plans sau khi apply: python -m app.database.plan_checker
+
+-- Survey_Attempts ---------------------------------------------------------------
+-- Latest survey (DISTINCT ON user_id ... ORDER BY completed_at DESC) + per-user version token
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_survey_attempts_user_completed
+    ON "Survey_Attempts" (user_id, completed_at DESC);
+-- Full survey load ORDER BY completed_at DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_survey_attempts_completed_at
+    ON "Survey_Attempts" (completed_at DESC);
+-- Segment index poll: created_at >= watermark
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_survey_attempts_created_at
+    ON "Survey_Attempts" (created_at);
+-- JOIN "Test_Survey" ts ON sa.test_survey_id = ts.id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_survey_attempts_test_survey
+    ON "Survey_Attempts" (test_survey_id);
+
+-- Test_Survey / Users -------------------------------------------------------------
+-- Không thêm index: các joins ts.id / u.id dùng primary key, và is_deleted = false giữ gần như mọi Users nên
+-- index riêng cho filter đó không đổi plan. Các index trước đây (bản sao của primary key) chỉ tốn chi phí ghi:
+DROP INDEX CONCURRENTLY IF EXISTS idx_test_survey_id_category;
+DROP INDEX CONCURRENTLY IF EXISTS idx_users_active_id;
+
+-- Course_Enrollment ---------------------------------------------------------------
+-- enrollment_count: GROUP BY course_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_course_enrollment_course_id
+    ON "Course_Enrollment" (course_id);
+-- Per-user interactions + version token (index-only)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_course_enrollment_user_course
+    ON "Course_Enrollment" (user_id, course_id) INCLUDE (progress_percentage, enrollment_date);
+
+-- Appointments --------------------------------------------------------------------
+-- total_appointments: WHERE is_deleted = false GROUP BY "consultantId"
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_consultant_active
+    ON "Appointments" ("consultantId") WHERE is_deleted = false;
+-- Per-user interactions: WHERE "userId" = :user_id AND is_deleted = false
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_user_active
+    ON "Appointments" ("userId", booking_time) WHERE is_deleted = false;
+-- Version token: MAX(updated_at) WHERE "userId" = :user_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_user_updated
+    ON "Appointments" ("userId", updated_at);
+
+-- Catalog -------------------------------------------------------------------------
+-- Course list ORDER BY created_at DESC, catalog version MAX(updated_at)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_course_created_at
+    ON "Course" (created_at DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_course_updated_at
+    ON "Course" (updated_at);
+-- Consultant list: WHERE is_available = true ORDER BY created_at DESC, JOIN Users
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_consultants_available_created
+    ON "Consultants" (created_at DESC) WHERE is_available = true;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_consultants_user_id
+    ON "Consultants" (user_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_consultants_updated_at
+    ON "Consultants" (updated_at);
+
+ANALYZE "Survey_Attempts";
+ANALYZE "Test_Survey";
+ANALYZE "Users";
+ANALYZE "Course_Enrollment";
+ANALYZE "Appointments";
+ANALYZE "Course";
+ANALYZE "Consultants";
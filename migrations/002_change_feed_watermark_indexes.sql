@@ -0,0 +1,21 @@
+-- Indexes cho change feed (app/service/change_feed.py): mỗi bảng nguồn được poll bằng
+--   WHERE updated_at >= :watermark OR created_at >= :watermark
+-- Postgres kết hợp hai index bằng BitmapOr, nên mỗi vòng poll chỉ đọc các rows đã đổi.
+-- Chạy ngoài transaction (CREATE INDEX CONCURRENTLY):
+--   psql "$DATABASE_URL" -f migrations/002_change_feed_watermark_indexes.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_survey_attempts_updated_at
+    ON "Survey_Attempts" (updated_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_course_enrollment_enrollment_date
+    ON "Course_Enrollment" (enrollment_date);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_course_enrollment_completion_date
+    ON "Course_Enrollment" (completion_date);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_created_at
+    ON "Appointments" (created_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_updated_at
+    ON "Appointments" (updated_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_consultants_created_at
+    ON "Consultants" (created_at);
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Test script for two-stage candidate generation + ranking
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import cosine_similarity
+
+from app.service import candidates as candidates_module
+from app.service.candidates import (CourseCandidateIndex, generate_candidates, get_candidate_index,
+                                    invalidate_candidate_index, rank_candidates, register_candidate_generator)
+from app.service.catalog import RecommendationCatalog
+from app.service.content_model import get_course_content_model
+from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem, HYBRID_ENGINE_WEIGHTS
+
+TOPICS = ['drug prevention awareness', 'stress management coping skills', 'relapse prevention addiction treatment',
+          'family support intervention', 'mindfulness recovery therapy']
+
+
+def make_catalog(num_courses=40):
+    courses = pd.DataFrame([
+        {'id': f'c{i}', 'title': f'Course {i}', 'description': TOPICS[i % len(TOPICS)],
+         'target_audience': ['all', 'youth', 'adult'][i % 3], 'category_name': 'prevention', 'enrollment_count': 0}
+        for i in range(num_courses)
+    ])
+    return RecommendationCatalog(courses, pd.DataFrame())
+
+
+def make_interactions():
+    rng = np.random.default_rng(3)
+    rows = []
+    for user in range(30):
+        for course in rng.choice(40, size=4, replace=False):
+            rows.append({'user_id': f'u{user}', 'item_id': f'c{course}', 'item_type': 'course',
+                         'rating': float(rng.choice([0.2, 0.6, 1.0])), 'interaction_date': None})
+    return pd.DataFrame(rows)
+
+
+def make_index():
+    catalog = make_catalog()
+    risk_mapping = CRAFFTASSISTRecommendationSystem.create_risk_level_mapping(None)
+    model = get_course_content_model(catalog, risk_mapping)
+    return CourseCandidateIndex(catalog, model, make_interactions(), neighbors=10), model
+
+
+def user_context(index, user_id, interactions):
+    user_data = {'risk_level': 'high', 'category_id': 'cat0', 'user_type': ['youth', 'students']}
+    segment = np.array([f'u{i}' for i in range(10)], dtype=object)
+    return index.context(user_id, user_data, interactions[interactions['user_id'] == user_id], lambda: segment)
+
+
+def test_content_signal_matches_content_engine():
+    index, model = make_index()
+    expected = cosine_similarity(model.profile_vector('high'), model.tfidf_matrix).ravel()
+    assert np.allclose(index.content_scores[index.risk_row('high')], expected)
+    positions, scores = index.content_top('high', ('youth', 'students'), 5)
+    boosted = expected * index.audience_boost(np.arange(40), ('youth', 'students'))
+    assert np.allclose(scores, np.sort(boosted)[::-1][:5])
+    print("✅ Precomputed content scores match the content-based engine")
+
+
+def test_rank_only_candidates():
+    index, _ = make_index()
+    interactions = make_interactions()
+    context = user_context(index, 'u1', interactions)
+    generated = generate_candidates(index, context, per_generator=8)
+    assert set(generated) >= {'content_top_n', 'segment_popularity', 'item_neighbors'}
+    union = set(np.concatenate(list(generated.values())).tolist())
+    assert len(union) < 40
+
+    ranked = rank_candidates(index, context, generated, HYBRID_ENGINE_WEIGHTS, 5)
+    assert len(ranked) == 5 and all(index.catalog.course_index[r['course_id']] in union for r in ranked)
+    assert [r['hybrid_score'] for r in ranked] == sorted((r['hybrid_score'] for r in ranked), reverse=True)
+    seen = set(context.seen.tolist())
+    assert all(r['similarity_score'] == 0 for r in ranked if index.catalog.course_index[r['course_id']] in seen)
+    assert all(r['candidate_sources'] for r in ranked)
+    print(f"✅ Ranked {len(union)} candidates of 40 courses: {[(r['course_id'], round(r['hybrid_score'], 3)) for r in ranked]}")
+
+
+def test_cold_user_uses_segment_popularity_and_plugged_generator():
+    index, _ = make_index()
+    context = user_context(index, 'new-user', make_interactions())
+    assert len(context.seen) == 0
+
+    @register_candidate_generator("pinned")
+    def pinned(index, context, n):
+        return np.array([39])
+
+    try:
+        generated = generate_candidates(index, context, per_generator=5)
+        assert list(generated['pinned']) == [39] and len(generated['item_neighbors']) == 0
+        ranked = rank_candidates(index, context, generated, HYBRID_ENGINE_WEIGHTS, 40)
+        assert any(r['similarity_score'] > 0 for r in ranked)  # segment popularity
+        assert 'pinned' in next(r for r in ranked if r['course_id'] == 'c39')['candidate_sources']
+    finally:
+        del candidates_module.CANDIDATE_GENERATORS['pinned']
+
+
+def test_shared_index_loads_interactions_only_on_rebuild():
+    invalidate_candidate_index()
+    catalog = make_catalog()
+    model = get_course_content_model(catalog, CRAFFTASSISTRecommendationSystem.create_risk_level_mapping(None))
+    loads = []
+
+    def load():
+        loads.append(1)
+        return make_interactions()
+
+    original_refresh = candidates_module.CANDIDATE_INDEX_REFRESH_SECONDS
+    try:
+        first = get_candidate_index(catalog, model, load, ('snap', 1.0, 0))
+        assert get_candidate_index(catalog, model, load, ('snap', 1.0, 0)) is first
+        assert get_candidate_index(catalog, model, load, ('snap', 1.0, 5)) is first  # trong refresh window
+        assert len(loads) == 1
+
+        candidates_module.CANDIDATE_INDEX_REFRESH_SECONDS = 0
+        assert get_candidate_index(catalog, model, load, ('snap', 1.0, 0)) is first  # cùng version -> không build
+        second = get_candidate_index(catalog, model, load, ('snap', 1.0, 5))
+        assert second is not first and len(loads) == 2 and second.interactions_version == ('snap', 1.0, 5)
+    finally:
+        candidates_module.CANDIDATE_INDEX_REFRESH_SECONDS = original_refresh
+        invalidate_candidate_index()
+    print("✅ Candidate index built interactions DataFrame only on rebuild")
+
+
+def main():
+    test_content_signal_matches_content_engine()
+    test_rank_only_candidates()
+    test_cold_user_uses_segment_popularity_and_plugged_generator()
+    test_shared_index_loads_interactions_only_on_rebuild()
+    print("🎯 Candidate pipeline tests completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared recommendation catalog (id indexes, version / age based rebuilds)
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from app.service import catalog as catalog_module
+from app.service.catalog import RecommendationCatalog, add_catalog_listener, get_catalog, invalidate_catalog
+
+
+def make_courses(num_courses=3):
+    return pd.DataFrame([
+        {'id': i, 'title': f'Course {i}', 'description': None if i == 0 else f'desc {i}',
+         'target_audience': 'all', 'category_name': 'prevention', 'enrollment_count': None if i == 0 else i * 10}
+        for i in range(num_courses)
+    ])
+
+
+def make_consultants():
+    return pd.DataFrame([
+        {'consult_id': 'k1', 'full_name': 'Dr. A', 'specialization': '', 'experience_years': 5, 'total_appointments': None},
+        {'consult_id': 'k2', 'full_name': 'Dr. B', 'specialization': 'Addiction', 'experience_years': None, 'total_appointments': 7},
+    ])
+
+
+class VersionSession:
+    """Session giả: chỉ trả lời query catalog version"""
+
+    def __init__(self, version=(3, 'v1', 1, 'v1', 2, 'v1')):
+        self.version = version
+
+    def execute(self, statement, params=None):
+        version = self.version
+        return type('Result', (), {'fetchone': staticmethod(lambda: version)})()
+
+    def rollback(self):
+        pass
+
+
+class Loader:
+    def __init__(self, frame_factory):
+        self.frame_factory = frame_factory
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.frame_factory()
+
+
+def test_index_lookups():
+    catalog = RecommendationCatalog(make_courses(), make_consultants(), 'v1')
+    course = catalog.get_course(1)
+    assert course == {'course_id': '1', 'title': 'Course 1', 'description': 'desc 1', 'enrollment_count': 10}
+    assert catalog.get_course('0')['description'] == '' and catalog.get_course('0')['enrollment_count'] == 0
+    course['title'] = 'changed'  # bản copy, record dựng sẵn không đổi
+    assert catalog.get_course('1')['title'] == 'Course 1'
+    assert catalog.get_course('missing') is None
+
+    assert catalog.get_consultant('k1')['specialization'] == 'General'
+    assert catalog.get_consultant('k2')['experience_years'] == 0 and catalog.get_consultant('k2')['total_appointments'] == 7
+    assert catalog.course_index == {'0': 0, '1': 1, '2': 2}
+    assert not catalog.is_empty and RecommendationCatalog(pd.DataFrame(), pd.DataFrame()).is_empty
+    print("✅ Catalog id indexes resolve prebuilt records")
+
+
+def test_version_and_age_rebuilds():
+    invalidate_catalog()
+    versions = []
+    add_catalog_listener(versions.append)
+    db = VersionSession()
+    courses, consultants = Loader(make_courses), Loader(make_consultants)
+    original_max_age = catalog_module.CATALOG_MAX_AGE_SECONDS
+    try:
+        first = get_catalog(db, courses, consultants)
+        assert get_catalog(db, courses, consultants) is first and courses.calls == 1
+
+        # Quá hạn, cùng version: build lại (counts mới) nhưng giữ content model, không báo listeners
+        first.course_content_model = sentinel = object()
+        catalog_module.CATALOG_MAX_AGE_SECONDS = 0
+        second = get_catalog(db, courses, consultants)
+        assert second is not first and courses.calls == 2
+        assert second.course_content_model is sentinel
+
+        # Version đổi: build lại, model được fit lại, listeners nhận version mới
+        catalog_module.CATALOG_MAX_AGE_SECONDS = original_max_age
+        db.version = (4, 'v2', 1, 'v1', 2, 'v1')
+        courses.frame_factory = lambda: make_courses(4)
+        third = get_catalog(db, courses, consultants)
+        assert third.version != second.version and third.course_content_model is None
+        assert len(third.course_records) == 4
+        assert versions[-1] == third.version and versions.count(second.version) == 1
+
+        invalidate_catalog()
+        assert versions[-1] is None
+        assert get_catalog(db, courses, consultants) is not third
+    finally:
+        catalog_module.CATALOG_MAX_AGE_SECONDS = original_max_age
+        catalog_module._catalog_listeners.remove(versions.append)
+        invalidate_catalog()
+    print(f"✅ Catalog rebuilt on version change / max age ({courses.calls} loads), listeners saw {versions}")
+
+
+def main():
+    test_index_lookups()
+    test_version_and_age_rebuilds()
+    print("🎯 Catalog tests completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Test script for the watermark change feed (sqlite stand-in)
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.service import interaction_state, segment_index
+from app.service.change_feed import ChangeFeed
+from app.service.data_version import get_user_generation
+from app.service.interaction_state import InteractionState
+from app.service.segment_index import SurveySegmentIndex
+
+
+def make_db():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE "Users" (id TEXT, is_deleted BOOLEAN)'))
+        conn.execute(text('CREATE TABLE "Test_Survey" (id TEXT, category_id TEXT)'))
+        conn.execute(text('CREATE TABLE "Survey_Attempts" (user_id TEXT, test_survey_id TEXT, risk_level TEXT, created_at TEXT, updated_at TEXT)'))
+        conn.execute(text('CREATE TABLE "Course_Enrollment" (user_id TEXT, course_id TEXT, progress_percentage REAL, enrollment_date TEXT, completion_date TEXT)'))
+        conn.execute(text('CREATE TABLE "Appointments" ("userId" TEXT, "consultantId" TEXT, status TEXT, booking_time TEXT, is_deleted BOOLEAN, created_at TEXT, updated_at TEXT)'))
+        conn.execute(text('CREATE TABLE "Course" (id TEXT, created_at TEXT, updated_at TEXT)'))
+        conn.execute(text('CREATE TABLE "Consultants" (id TEXT, created_at TEXT, updated_at TEXT)'))
+        conn.execute(text("INSERT INTO \"Users\" VALUES ('u1', 0), ('u2', 0)"))
+        conn.execute(text("INSERT INTO \"Test_Survey\" VALUES ('s1', 'cat1')"))
+        conn.execute(text("INSERT INTO \"Survey_Attempts\" VALUES ('u1', 's1', 'low', '2024-01-01', '2024-01-01')"))
+        conn.execute(text("INSERT INTO \"Course_Enrollment\" VALUES ('u1', 'c1', 20, '2024-01-01', NULL)"))
+        conn.execute(text("INSERT INTO \"Appointments\" VALUES ('u2', 'k1', 'pending', '2024-01-02', 0, '2024-01-01', '2024-01-01')"))
+        conn.execute(text("INSERT INTO \"Course\" VALUES ('c1', '2024-01-01', '2024-01-01')"))
+    return sessionmaker(bind=engine)()
+
+
+def test_change_feed_merges_only_deltas():
+    db = make_db()
+    rebuilds = []
+    feed = ChangeFeed(rebuild_catalog=lambda session: rebuilds.append(1))
+    state = InteractionState(CRAFFT_base())
+    index = SurveySegmentIndex()
+    interaction_state._state, segment_index._segment_index = state, index
+    try:
+        # Lần đầu: chỉ lấy watermarks, datasets đã build từ trạng thái hiện tại
+        assert not any(feed.poll(db).values())
+        assert feed.watermarks['Survey_Attempts'] == '2024-01-01'
+
+        db.execute(text("INSERT INTO \"Survey_Attempts\" VALUES ('u2', 's1', 'high', '2024-02-01', '2024-02-01')"))
+        db.execute(text("INSERT INTO \"Course_Enrollment\" VALUES ('u1', 'c2', 50, '2024-02-01', NULL)"))
+        db.execute(text("UPDATE \"Appointments\" SET status = 'completed', updated_at = '2024-02-01'"))
+        generation = get_user_generation('u2')
+
+        counts = feed.poll(db)
+        print(f"📊 Changes: {counts}")
+        assert counts['Survey_Attempts'] == 1 and counts['Course_Enrollment'] == 1 and counts['Appointments'] == 1
+        assert list(index.users_in_segment('high', 'cat1')) == ['u2']
+        assert get_user_generation('u2') > generation
+        assert rebuilds == []
+
+        df = state.to_dataframe()
+        ratings = {(r.user_id, r.item_id): r.rating for r in df.itertuples()}
+        assert ratings == {('u1', 'c1'): 0.2, ('u1', 'c2'): 0.5, ('u2', 'k1'): 0.8}
+
+        # Appointment bị xoá -> rows của user được thay bằng tập rỗng
+        db.execute(text("UPDATE \"Appointments\" SET is_deleted = 1, updated_at = '2024-03-01'"))
+        db.execute(text("UPDATE \"Course\" SET updated_at = '2024-03-01'"))
+        feed.poll(db)
+        assert set(state.to_dataframe()['item_id']) == {'c1', 'c2'}
+        assert rebuilds == [1]
+        print("✅ Change feed merged inserts, updates and deletes")
+    finally:
+        interaction_state._state, segment_index._segment_index = None, None
+
+
+def CRAFFT_base():
+    import pandas as pd
+    return pd.DataFrame([
+        {'user_id': 'u1', 'item_id': 'c1', 'item_type': 'course', 'rating': 0.2, 'interaction_date': '2024-01-01'},
+        {'user_id': 'u2', 'item_id': 'k1', 'item_type': 'consultant', 'rating': 0.1, 'interaction_date': '2024-01-02'},
+    ])
+
+
+def main():
+    test_change_feed_merges_only_deltas()
+    print("🎯 Change feed tests completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Test script for sparse neighbor aggregation used by collaborative filtering
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+from app.service.collaborative_scoring import UserItemMatrix, aggregate_neighbor_scores, top_k_indices
+
+
+def build_interactions() -> pd.DataFrame:
+    rows = [
+        ('target', 'c1', 1.0), ('target', 'c2', 0.5),
+        ('n1', 'c1', 1.0), ('n1', 'c3', 0.9), ('n1', 'c4', 0.2),
+        ('n2', 'c2', 0.6), ('n2', 'c3', 0.5), ('n2', 'c5', 0.8),
+        ('n3', 'c5', 1.0), ('n3', 'c5', 0.0),  # duplicate (user, item) -> mean like pivot_table
+    ]
+    return pd.DataFrame([{'user_id': u, 'item_id': i, 'item_type': 'course', 'rating': r} for u, i, r in rows])
+
+
+def test_user_item_matrix_matches_pivot_table():
+    """Sparse matrix phải giống pivot_table(fill_value=0)"""
+    interactions = build_interactions()
+    matrix = UserItemMatrix(interactions)
+    pivot = interactions.pivot_table(index='user_id', columns='item_id', values='rating', fill_value=0)
+
+    dense = pd.DataFrame(matrix.ratings.toarray(), index=matrix.user_ids, columns=matrix.item_ids)
+    dense = dense.loc[pivot.index, pivot.columns]
+    assert np.allclose(dense.values, pivot.values)
+
+    assert 'target' in matrix
+    assert 'nobody' not in matrix
+    assert sorted(matrix.item_ids[matrix.seen_items('target')]) == ['c1', 'c2']
+    assert list(matrix.item_ids[matrix.seen_items('n3', min_rating=0.9)]) == ['c5']
+    print("✅ UserItemMatrix matches pivot_table")
+
+
+def test_aggregate_neighbor_scores():
+    """Predicted score = weighted average rating của neighbors, mask items đã có"""
+    matrix = UserItemMatrix(build_interactions())
+    neighbor_rows = matrix.user_rows(['n1', 'n2'])
+    weights = np.array([0.75, 0.25])
+    exclude = matrix.seen_items('target')
+
+    items, scores, sources = aggregate_neighbor_scores(
+        matrix.liked_matrix(neighbor_rows, rating_threshold=0.4), weights, exclude, top_k=10
+    )
+    result = {matrix.item_ids[i]: (score, matrix.user_ids[neighbor_rows[s]]) for i, score, s in zip(items, scores, sources)}
+    print(f"📊 Aggregated scores: {result}")
+
+    assert 'c1' not in result and 'c2' not in result  # đã có
+    assert 'c4' not in result  # dưới rating threshold
+    assert np.isclose(result['c3'][0], 0.75 * 0.9 + 0.25 * 0.5)
+    assert result['c3'][1] == 'n1'
+    assert np.isclose(result['c5'][0], 0.25 * 0.8)
+    assert result['c5'][1] == 'n2'
+    assert list(scores) == sorted(scores, reverse=True)
+    print("✅ Neighbor aggregation OK")
+
+
+def test_top_k_indices():
+    scores = np.array([0.1, 0.9, 0.3, 0.9, 0.5])
+    assert list(top_k_indices(scores, 3)) == [1, 3, 4]
+    assert list(top_k_indices(scores, 10)) == [1, 3, 4, 2, 0]
+    assert len(top_k_indices(scores, 0)) == 0
+
+
+def main():
+    test_user_item_matrix_matches_pivot_table()
+    test_aggregate_neighbor_scores()
+    test_top_k_indices()
+    print("🎯 Collaborative scoring tests completed!")
+
+
+if __name__ == "__main__":
+    main()
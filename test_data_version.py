@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Test script for ETag helpers and per-user invalidation
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.service.data_version import (
+    add_invalidation_listener, cache_headers, etag_matches, get_user_generation, invalidate_user
+)
+
+
+def test_etag_matches():
+    etag = '"abc123"'
+    assert etag_matches('"abc123"', etag)
+    assert etag_matches('W/"abc123"', etag)
+    assert etag_matches('"zzz", "abc123"', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches('"zzz"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"abc123"', None)
+    assert cache_headers(etag)['ETag'] == etag
+    print("✅ If-None-Match matching OK")
+
+
+def test_invalidate_user_bumps_generation_and_notifies():
+    seen = []
+    add_invalidation_listener(seen.append)
+    before = get_user_generation('user-etag')
+    assert invalidate_user('user-etag') == before + 1
+    assert get_user_generation('user-etag') == before + 1
+    assert seen == ['user-etag']
+    print("✅ invalidate_user OK")
+
+
+def main():
+    test_etag_matches()
+    test_invalidate_user_bumps_generation_and_notifies()
+    print("🎯 Data version tests completed!")
+
+
+if __name__ == "__main__":
+    main()
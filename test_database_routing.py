@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Test script for bulk/point read routing against local stand-in (sqlite) databases
+"""
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from app.database.routing import BULK, POINT, RoutingSession, routed
+
+
+def make_stand_in(path: str, name: str):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE source (name TEXT)"))
+        conn.execute(text("INSERT INTO source VALUES (:name)"), {'name': name})
+    return engine
+
+
+def test_routing_session_sends_annotated_queries_to_route_engines():
+    with tempfile.TemporaryDirectory() as tmp:
+        primary = make_stand_in(os.path.join(tmp, "primary.db"), "primary")
+        bulk = make_stand_in(os.path.join(tmp, "bulk.db"), "bulk")
+        point = make_stand_in(os.path.join(tmp, "point.db"), "point")
+
+        Session = sessionmaker(class_=RoutingSession, bind=primary, route_binds={BULK: bulk, POINT: point})
+        db = Session()
+        try:
+            assert db.execute(text("SELECT name FROM source")).scalar() == "primary"
+            assert db.execute(routed("SELECT name FROM source", BULK)).scalar() == "bulk"
+            assert db.execute(routed("SELECT name FROM source WHERE name = :name", POINT), {'name': 'point'}).scalar() == "point"
+            assert db.execute(routed("SELECT name FROM source", "unknown")).scalar() == "primary"
+        finally:
+            db.close()
+        for engine in (primary, bulk, point):
+            engine.dispose()
+    print("✅ Routing annotations OK")
+
+
+def test_database_module_with_stand_in_url():
+    """DATABASE_URL=sqlite -> mọi route dùng chung một engine (một database)"""
+    os.environ["DATABASE_URL"] = "sqlite://"
+    from app.database import database
+    assert database.point_engine is database.engine and database.bulk_engine is database.engine
+    db = database.SessionLocal()
+    try:
+        assert db.execute(routed("SELECT 1", BULK)).scalar() == 1
+    finally:
+        db.close()
+    print(f"📊 Pool status: {database.pool_status()}")
+    print("✅ Stand-in database config OK")
+
+
+def main():
+    test_routing_session_sends_annotated_queries_to_route_engines()
+    test_database_module_with_stand_in_url()
+    print("🎯 Database routing tests completed!")
+
+
+if __name__ == "__main__":
+    main()
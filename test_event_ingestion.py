@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Test script for incremental event ingestion (interaction state deltas + latest survey updates)
+"""
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from app.service import interaction_state
+from app.service.event_ingestion import ingest_appointment_status, ingest_enrollment_progress
+from app.service.interaction_state import (InteractionState, appointment_rating, course_rating,
+                                           current_interaction_state, get_interaction_state)
+from app.service.latest_survey import latest_survey_cache, peek_latest_survey, record_survey_completion
+
+
+def base_interactions():
+    return pd.DataFrame([
+        {'user_id': 'u1', 'item_id': 'c1', 'item_type': 'course', 'rating': 0.2, 'interaction_date': None},
+        {'user_id': 'u1', 'item_id': 'k1', 'item_type': 'consultant', 'rating': 0.1, 'interaction_date': None},
+        {'user_id': 'u2', 'item_id': 'c1', 'item_type': 'course', 'rating': 1.0, 'interaction_date': None},
+    ])
+
+
+def test_ratings_match_loader():
+    assert course_rating(50) == 0.5
+    assert course_rating(None) == 0.0
+    assert appointment_rating('completed') == 0.8
+    assert appointment_rating('pending') == 0.1
+
+
+def test_apply_upserts_user_item_pair():
+    state = InteractionState(base_interactions())
+    state.apply('u1', 'course', 'c1', course_rating(90))
+    state.apply('u1', 'course', 'c2', course_rating(10))
+    df = state.to_dataframe()
+
+    assert len(df) == 4
+    u1_c1 = df[(df['user_id'] == 'u1') & (df['item_id'] == 'c1')]
+    assert len(u1_c1) == 1 and u1_c1.iloc[0]['rating'] == 0.9
+    # Cặp khác không bị ảnh hưởng
+    assert df[(df['user_id'] == 'u2') & (df['item_id'] == 'c1')].iloc[0]['rating'] == 1.0
+    print("✅ Enrollment delta replaced only the (u1, c1) row")
+
+
+def test_materializes_once_per_version():
+    state = InteractionState(base_interactions())
+    state.apply('u1', 'consultant', 'k1', appointment_rating('completed'))
+    first = state.to_dataframe()
+    assert state.to_dataframe() is first
+    state.apply('u3', 'consultant', 'k1', appointment_rating('pending'))
+    assert state.to_dataframe() is not first
+
+
+def test_events_update_shared_state():
+    interaction_state._state = InteractionState(base_interactions())
+    try:
+        result = ingest_appointment_status('u1', 'k1', 'completed')
+        assert result['interaction_state_updated']
+        ingest_enrollment_progress('u2', 'c3', 40)
+        df = interaction_state._state.to_dataframe()
+        assert df[(df['user_id'] == 'u1') & (df['item_id'] == 'k1')].iloc[0]['rating'] == 0.8
+        assert df[(df['user_id'] == 'u2') & (df['item_id'] == 'c3')].iloc[0]['rating'] == 0.4
+    finally:
+        interaction_state.invalidate_interaction_state()
+    assert ingest_enrollment_progress('u2', 'c3', 40)['interaction_state_updated'] is False
+
+
+def test_survey_completion_updates_cached_latest():
+    latest_survey_cache.put('u1', {'user_id': 'u1', 'risk_level': 'low', 'total_surveys_taken': 2})
+    previous = peek_latest_survey('u1')
+    assert record_survey_completion(previous, 'u1', 's9', 'cat1', 12, 'high')
+    latest = peek_latest_survey('u1')
+    assert latest['risk_level'] == 'high' and latest['total_surveys_taken'] == 3
+    # Không có entry cũ -> không đoán total_surveys_taken, lần đọc sau sẽ query lại
+    assert not record_survey_completion(None, 'u4', 's9', 'cat1', 12, 'high')
+    assert peek_latest_survey('u4') is None
+    print("✅ Survey completion updated latest risk in place")
+
+
+def test_same_snapshot_rebuild_keeps_deltas():
+    interaction_state.invalidate_interaction_state()
+    loads = []
+    original_rebuild = interaction_state.INTERACTION_STATE_REBUILD_SECONDS
+    try:
+        first = get_interaction_state(lambda: loads.append(1) or base_interactions(), 'snap-1')
+        ingest_enrollment_progress('u2', 'c3', 40)
+        interaction_state.INTERACTION_STATE_REBUILD_SECONDS = 0  # state quá hạn -> rebuild
+        second = get_interaction_state(lambda: loads.append(1) or base_interactions(), 'snap-1')
+        assert second is not first and len(loads) == 1  # cùng snapshot: không đọc lại
+        df = second.to_dataframe()
+        assert df[(df['user_id'] == 'u2') & (df['item_id'] == 'c3')].iloc[0]['rating'] == 0.4
+
+        # Event tới state cũ trong lúc build vẫn được giữ
+        since = second.version
+        second.apply('u1', 'course', 'c9', 0.5)
+        second.apply('u4', 'course', 'c2', 0.2)
+        interaction_state.INTERACTION_STATE_REBUILD_SECONDS = original_rebuild
+        third = InteractionState(base_interactions(), 'snap-1')
+        third.apply('u1', 'course', 'c9', 0.7)  # delta mới hơn của state mới thắng
+        third.apply('u3', 'course', 'c1', 0.3)
+        third.adopt_deltas(second, since)
+        adopted = third.to_dataframe()
+        assert adopted.query("user_id == 'u1' and item_id == 'c9'").iloc[0]['rating'] == 0.7
+        assert adopted.query("user_id == 'u4'").iloc[0]['rating'] == 0.2 and third.might_have_interactions('u4')
+
+        # Snapshot version mới -> load lại
+        get_interaction_state(lambda: loads.append(1) or base_interactions(), 'snap-2')
+        assert len(loads) == 2
+    finally:
+        interaction_state.INTERACTION_STATE_REBUILD_SECONDS = original_rebuild
+        interaction_state.invalidate_interaction_state()
+    print("✅ Rebuild of an unchanged snapshot kept applied deltas")
+
+
+def test_empty_state_installed_and_cold_load_serialized():
+    interaction_state.invalidate_interaction_state()
+    loads = []
+
+    def slow_empty_load():
+        loads.append(1)
+        time.sleep(0.05)
+        return pd.DataFrame()
+
+    try:
+        threads = [threading.Thread(target=get_interaction_state, args=(slow_empty_load,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(loads) == 1
+        assert current_interaction_state() is not None and current_interaction_state().empty_base
+        assert ingest_enrollment_progress('u5', 'c1', 80)['interaction_state_updated']
+
+        original_retry = interaction_state.INTERACTION_STATE_EMPTY_RETRY_SECONDS
+        interaction_state.INTERACTION_STATE_EMPTY_RETRY_SECONDS = 0  # base rỗng chỉ giữ ngắn hạn
+        try:
+            get_interaction_state(base_interactions)
+        finally:
+            interaction_state.INTERACTION_STATE_EMPTY_RETRY_SECONDS = original_retry
+        assert not current_interaction_state().empty_base
+    finally:
+        interaction_state.invalidate_interaction_state()
+    print("✅ Empty state installed for events, concurrent cold requests loaded once")
+
+
+def main():
+    print("🧪 Testing event ingestion")
+    test_ratings_match_loader()
+    test_apply_upserts_user_item_pair()
+    test_materializes_once_per_version()
+    test_events_update_shared_state()
+    test_same_snapshot_rebuild_keeps_deltas()
+    test_empty_state_installed_and_cold_load_serialized()
+    test_survey_completion_updates_cached_latest()
+    print("🎉 All event ingestion tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test script for explanation capture during hybrid scoring
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.service.data_version import invalidate_user
+from app.service.explanation_store import ExplanationStore, explanation_store
+from test_stage_graph import FakeRecommender
+
+
+def _result():
+    return {
+        'courses': [{
+            'course_id': 'c1', 'title': 'Coping skills', 'recommendation_type': 'content_based', 'hybrid_score': 0.6,
+            'recommendation_source': 'both', 'boosts': ['audience'], 'source_user': 'u9',
+            'score_provenance': {'content_based': {'score': 0.8}, 'collaborative': {'score': 0.4}}
+        }],
+        'consultants': [],
+        'user_risk_info': {'latest_risk_level': 'high'},
+        'recommendation_summary': {'total_courses': 1}
+    }
+
+
+def test_capture_and_lookup():
+    store = ExplanationStore(max_size=2, ttl_seconds=60)
+    recommendation_id = store.capture('u1', _result())
+    explanation = store.get('u1', recommendation_id)
+    course = explanation['course_explanations'][0]
+    assert course['factors']['content_based_score'] == 0.8 and course['factors']['collaborative_score'] == 0.4
+    assert course['factors']['boosts'] == ['audience'] and course['factors']['source_user'] == 'u9'
+    assert store.get('u1') is explanation          # kết quả mới nhất của user
+    assert store.get('u2', recommendation_id) is None  # id của user khác
+
+    store.invalidate('u1')
+    assert store.get('u1') is None and store.get('u1', recommendation_id) is explanation
+
+    store.capture('u2', _result())
+    store.capture('u3', _result())
+    assert store.get('u1', recommendation_id) is None  # bị đẩy khỏi LRU
+    print(f"✅ Explanations captured and looked up by id / latest: {store.stats()}")
+
+
+def test_ttl_expiry():
+    store = ExplanationStore(ttl_seconds=0.01)
+    recommendation_id = store.capture('u1', _result())
+    time.sleep(0.02)
+    assert store.get('u1', recommendation_id) is None
+
+
+def test_hybrid_captures_explanation():
+    explanation_store.clear()
+    recommender = FakeRecommender()
+    result = recommender.hybrid_recommendations('u7', 4)
+    explanation = explanation_store.get('u7', result['recommendation_id'])
+    assert [item['course_id'] for item in explanation['course_explanations']] == [c['course_id'] for c in result['courses']]
+    assert explanation['risk_info'] == {'latest_risk_level': 'high'}
+
+    invalidate_user('u7')
+    assert explanation_store.get('u7') is None
+    print("✅ Hybrid scoring captured its explanation; invalidate_user drops the latest pointer")
+
+
+def main():
+    test_capture_and_lookup()
+    test_ttl_expiry()
+    test_hybrid_captures_explanation()
+    print("🎯 Explanation store tests completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Test script for the Bloom-filter fast path that skips collaborative filtering for cold users
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from app.service import stage_graph
+from app.service.bloom_filter import BloomFilter
+from app.service.interaction_state import (get_interaction_state, invalidate_interaction_state,
+                                           might_have_interactions)
+from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
+from test_stage_graph import FakeRecommender
+
+
+def _interactions():
+    rows = [{'user_id': f'u{i}', 'item_id': f'c{i % 7}', 'item_type': 'course', 'rating': 0.6,
+             'interaction_date': None} for i in range(200)]
+    rows.append({'user_id': 'u0', 'item_id': 'k1', 'item_type': 'consultant', 'rating': 0.8, 'interaction_date': None})
+    return pd.DataFrame(rows)
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter.from_ids([f'u{i}' for i in range(3000)], fp_rate=0.01)
+    assert all(f'u{i}' in bloom for i in range(3000))
+    false_positives = sum(f'x{i}' in bloom for i in range(10000))
+    assert false_positives < 200
+    print(f"✅ Bloom filter: {bloom.nbytes} bytes for 3000 users, {false_positives}/10000 false positives")
+
+
+def test_state_filters_follow_events():
+    invalidate_interaction_state()
+    assert might_have_interactions('nobody')  # chưa có state -> không biết
+    state = get_interaction_state(_interactions)
+    try:
+        assert might_have_interactions('u5', 'course') and not might_have_interactions('u5', 'consultant')
+        assert not might_have_interactions('new-user')
+
+        state.apply('new-user', 'consultant', 'k2', 0.8)
+        assert might_have_interactions('new-user') and might_have_interactions('new-user', 'consultant')
+        state.replace_user('other-user', 'course', [{'user_id': 'other-user', 'item_id': 'c1', 'item_type': 'course',
+                                                     'rating': 1.0, 'interaction_date': None}])
+        assert might_have_interactions('other-user', 'course')
+        assert might_have_interactions('nobody', source_version='snapshot-v2')  # state của nguồn khác -> không biết
+        print(f"✅ Membership kept in sync with events: {state.stats()['user_filter_bytes']} filter bytes")
+    finally:
+        invalidate_interaction_state()
+
+
+class ColdRecommender(FakeRecommender):
+    def has_interactions(self, user_id, item_type=None):
+        return False
+
+
+def test_cold_user_shortcuts_collaborative_stage():
+    stage_graph._stage_costs.clear()
+    recommender = ColdRecommender()
+    executor = recommender.stage_executor('cold', deadline_ms=1000)
+    result = recommender.hybrid_recommendations('cold', 4, executor=executor)
+    assert result['status'] == 'success' and result['skipped_stages'] == []
+    assert all(c['recommendation_source'] == 'content_based' for c in result['courses'])
+    assert not any(call[0] == 'collaborative' for call in recommender.calls)
+    assert 'collaborative' not in stage_graph.stage_costs()  # không làm lệch ước lượng cho deadline
+    assert executor.stats()['shortcut'] == ['collaborative']
+    print(f"✅ Cold user skipped collaborative before touching data: {executor.stats()}")
+
+
+class NoDataRecommender(CRAFFTASSISTRecommendationSystem):
+    def __init__(self):
+        super().__init__(db_session=None, interaction_snapshot=None)
+        self.interaction_snapshot = None
+        self.loads = 0
+
+    def get_collaborative_interactions(self):
+        self.loads += 1
+        return _interactions()
+
+
+def test_collaborative_methods_return_early():
+    invalidate_interaction_state()
+    get_interaction_state(_interactions)
+    try:
+        recommender = NoDataRecommender()
+        assert recommender.collaborative_filtering_course_recommendations('new-user', 5) == []
+        assert recommender.collaborative_filtering_consultant_recommendations('u5', 3) == []
+        result = recommender.collaborative_filtering_recommendations('new-user', 5, user_risk_info={'latest_risk_level': 'low'})
+        assert result['status'] == 'success' and result['recommendation_summary']['method'] == 'no_interactions'
+        assert recommender.loads == 0  # không load interactions cho user lạnh
+    finally:
+        invalidate_interaction_state()
+
+
+def main():
+    test_bloom_filter_has_no_false_negatives()
+    test_state_filters_follow_events()
+    test_cold_user_shortcuts_collaborative_stage()
+    test_collaborative_methods_return_early()
+    print("🎯 Interaction membership tests completed!")
+
+
+if __name__ == "__main__":
+    main()
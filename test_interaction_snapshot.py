@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Test script for the memory-mapped interaction snapshot (write -> np.memmap -> DataFrame)
+"""
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+from types import SimpleNamespace
+from app.service.interaction_snapshot import InteractionSnapshot
+from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
+
+
+def build_sample_interactions() -> pd.DataFrame:
+    return pd.DataFrame([
+        {'user_id': 'user-b', 'item_id': 'course-1', 'item_type': 'course', 'rating': 0.75, 'interaction_date': pd.Timestamp('2024-03-01 10:30')},
+        {'user_id': 'user-a', 'item_id': 'course-2', 'item_type': 'course', 'rating': 0.4, 'interaction_date': pd.Timestamp('2024-02-11 08:00')},
+        {'user_id': 'user-a', 'item_id': 'consultant-9', 'item_type': 'consultant', 'rating': 0.8, 'interaction_date': None},
+        {'user_id': 'user-c', 'item_id': 'course-1', 'item_type': 'course', 'rating': 1.0, 'interaction_date': pd.Timestamp('2024-01-05 23:59')},
+    ])
+
+
+def test_snapshot_round_trip():
+    """Snapshot phải giữ nguyên dữ liệu (trừ giờ trong interaction_date)"""
+    print("🧪 Testing interaction snapshot round trip")
+    interactions_df = build_sample_interactions()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'interactions.snap')
+        version = InteractionSnapshot.write(interactions_df, path)
+        snapshot = InteractionSnapshot(path)
+
+        print(f"📦 Snapshot version: {version}, rows: {len(snapshot)}")
+        assert snapshot.version == version
+        assert len(snapshot) == 4
+        assert snapshot.num_users == 3
+        assert snapshot.num_items == 3
+        assert isinstance(snapshot.user_codes, np.memmap)
+        assert snapshot.user_codes.dtype == np.int32
+        assert snapshot.ratings.dtype == np.float32
+
+        assert snapshot.user_code('user-a') == 0
+        assert snapshot.user_code('user-unknown') == -1
+        assert snapshot.item_code('consultant-9') >= 0
+
+        restored = snapshot.to_dataframe()
+        merged = interactions_df.merge(restored, on=['user_id', 'item_id', 'item_type'], suffixes=('', '_snapshot'))
+        assert len(merged) == 4
+        assert np.allclose(merged['rating'], merged['rating_snapshot'])
+
+        course_df = snapshot.to_dataframe('course')
+        assert set(course_df['item_type']) == {'course'}
+        assert len(course_df) == 3
+
+        dated = restored[restored['item_id'] == 'course-2'].iloc[0]
+        assert dated['interaction_date'] == pd.Timestamp('2024-02-11')
+        undated = restored[restored['item_id'] == 'consultant-9'].iloc[0]
+        assert pd.isna(undated['interaction_date'])
+        print("✅ Round trip OK")
+
+
+def test_snapshot_user_slice():
+    """User offsets (CSR) phải trả đúng slice của từng user"""
+    print("🧪 Testing per-user snapshot slice")
+    interactions_df = build_sample_interactions()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'interactions.snap')
+        InteractionSnapshot.write(interactions_df, path)
+        snapshot = InteractionSnapshot(path)
+
+        assert snapshot.user_offsets[0] == 0
+        assert snapshot.user_offsets[-1] == len(snapshot)
+
+        for user_id in interactions_df['user_id'].unique():
+            user_slice = snapshot.user_slice(user_id)
+            expected = interactions_df[interactions_df['user_id'] == user_id]
+            print(f"   👤 {user_id}: {len(user_slice)} interactions")
+            assert set(user_slice['user_id']) == {user_id}
+            assert sorted(user_slice['item_id']) == sorted(expected['item_id'])
+
+        assert snapshot.user_slice('user-unknown').empty
+        print("✅ Per-user slice OK")
+
+
+class PointSession:
+    """Session giả: trả rows hiện tại của user (enrollment vừa cập nhật sau khi snapshot được ghi)"""
+
+    def __init__(self):
+        self.queries = 0
+
+    def execute(self, statement, params=None):
+        self.queries += 1
+        if 'Course_Enrollment' in str(statement):
+            rows = [SimpleNamespace(user_id='user-a', item_id='course-2', progress_percentage=90,
+                                    interaction_date=pd.Timestamp('2024-05-01 09:15'))]
+        else:
+            rows = []
+        return SimpleNamespace(fetchall=lambda: rows)
+
+
+def test_per_user_reads_skip_snapshot():
+    """Per-user reads phải thấy dữ liệu hiện tại, không phải snapshot (chỉ dùng cho bulk CF)"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'interactions.snap')
+        InteractionSnapshot.write(build_sample_interactions(), path)
+        db = PointSession()
+        recommender = CRAFFTASSISTRecommendationSystem(db, InteractionSnapshot(path))
+        user_df = recommender.get_user_interactions_by_user('user-a')
+        assert db.queries == 2
+        assert list(user_df['rating']) == [0.9]
+        assert user_df['interaction_date'].iloc[0] == pd.Timestamp('2024-05-01 09:15')
+        print("✅ Per-user interactions read from the database even with a snapshot")
+
+
+def test_snapshot_empty():
+    """Snapshot rỗng vẫn mở được"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'interactions.snap')
+        InteractionSnapshot.write(pd.DataFrame(), path)
+        snapshot = InteractionSnapshot(path)
+        assert len(snapshot) == 0
+        assert snapshot.to_dataframe().empty
+        assert snapshot.user_code('anyone') == -1
+        print("✅ Empty snapshot OK")
+
+
+def main():
+    test_snapshot_round_trip()
+    test_snapshot_user_slice()
+    test_per_user_reads_skip_snapshot()
+    test_snapshot_empty()
+    print("🎯 Snapshot tests completed!")
+
+
+if __name__ == "__main__":
+    main()
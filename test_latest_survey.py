@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Test script for the latest-survey LRU cache
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.service.latest_survey import LatestSurveyCache, user_type_for_age, _MISSING
+
+
+def test_lru_eviction_and_stats():
+    """Cache giữ tối đa max_size users, evict user ít dùng nhất"""
+    cache = LatestSurveyCache(max_size=2, ttl_seconds=60)
+    cache.put('u1', {'risk_level': 'low'})
+    cache.put('u2', {'risk_level': 'high'})
+    assert cache.get('u1') == {'risk_level': 'low'}  # u1 thành most recently used
+    cache.put('u3', None)  # user chưa có survey vẫn được cache
+
+    assert cache.get('u2') is _MISSING
+    assert cache.get('u3') is None
+    assert cache.stats()['size'] == 2
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 1
+    print("✅ LRU eviction OK")
+
+
+def test_ttl_and_invalidate():
+    cache = LatestSurveyCache(max_size=10, ttl_seconds=0.05)
+    cache.put('u1', {'risk_level': 'low'})
+    cache.put('u2', {'risk_level': 'medium'})
+    cache.invalidate('u2')
+    assert cache.get('u2') is _MISSING
+    assert cache.get('u1') == {'risk_level': 'low'}
+    time.sleep(0.1)
+    assert cache.get('u1') is _MISSING
+    print("✅ TTL + invalidate OK")
+
+
+def test_user_type_for_age():
+    assert user_type_for_age(30) == ['adult', 'parents', 'teacher']
+    assert user_type_for_age(16) == ['youth', 'students']
+    assert user_type_for_age(None) == ['youth', 'students']
+
+
+def main():
+    test_lru_eviction_and_stats()
+    test_ttl_and_invalidate()
+    test_user_type_for_age()
+    print("🎯 Latest survey cache tests completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Test script for per-stage latency metrics and Prometheus rendering
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.service.metrics import (
+    Histogram, STAGE_ERRORS, STAGE_SECONDS, render_metrics, set_endpoint, stage_timer, timed
+)
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "test", ("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "a")
+    histogram.observe(0.1, "a")  # le là inclusive
+    histogram.observe(5.0, "a")
+    lines = histogram.render()
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{stage="a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="a"} 3' in lines
+    print("✅ Histogram buckets OK")
+
+
+def test_nested_stages_inherit_engine_and_endpoint():
+    set_endpoint("/test/{user_id}")
+
+    @timed("outer_total", engine="test_engine")
+    def pipeline():
+        with stage_timer("inner"):
+            pass
+
+    pipeline()
+    assert STAGE_SECONDS.snapshot("/test/{user_id}", "test_engine", "outer_total")['count'] == 1
+    assert STAGE_SECONDS.snapshot("/test/{user_id}", "test_engine", "inner")['count'] == 1
+
+    try:
+        with stage_timer("failing", engine="test_engine"):
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    assert 'recommendation_stage_errors_total{endpoint="/test/{user_id}",engine="test_engine",stage="failing"} 1.0' in STAGE_ERRORS.render()
+    assert 'stage="inner"' in render_metrics()
+    print("✅ Stage timers OK")
+
+
+def main():
+    test_histogram_buckets_are_cumulative()
+    test_nested_stages_inherit_engine_and_endpoint()
+    print("🎯 Metrics tests completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Test script for the cross-worker model store and the shared course TF-IDF model
+"""
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from app.service import content_model as content_model_module
+from app.service.catalog import RecommendationCatalog
+from app.service.content_model import get_course_content_model
+from app.service.model_store import ModelHandle, ModelStore
+from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
+
+
+def make_catalog():
+    courses = pd.DataFrame([
+        {'id': 'c1', 'title': 'Prevention 101', 'description': 'drug prevention awareness for students', 'target_audience': 'student', 'category_name': 'prevention', 'enrollment_count': 3},
+        {'id': 'c2', 'title': 'Coping', 'description': 'stress management and coping skills', 'target_audience': 'all', 'category_name': 'intervention', 'enrollment_count': 1},
+        {'id': 'c3', 'title': 'Recovery', 'description': 'relapse prevention and addiction treatment', 'target_audience': 'parent', 'category_name': 'treatment', 'enrollment_count': 0},
+    ])
+    return RecommendationCatalog(courses, pd.DataFrame())
+
+
+def test_publish_attach_and_atomic_swap():
+    with tempfile.TemporaryDirectory() as root:
+        store = ModelStore(root, keep_versions=2)
+        handle = ModelHandle(store, 'demo')
+        assert handle.get() is None
+
+        store.publish('demo', 'v1', {'weights': np.arange(4, dtype=np.float32)}, {'rows': 4})
+        model = handle.get()
+        assert model.version == 'v1' and model.meta['rows'] == 4
+        assert isinstance(model['weights'], np.memmap) and not model['weights'].flags.writeable
+
+        # Worker khác publish version mới -> handle tự attach lại, version cũ vẫn đọc được
+        ModelStore(root, keep_versions=2).publish('demo', 'v2', {'weights': np.ones(4, dtype=np.float32)})
+        assert handle.get().version == 'v2'
+        assert model['weights'][3] == 3.0
+
+        store.publish('demo', 'v3', {'weights': np.zeros(4, dtype=np.float32)})
+        assert sorted(e for e in os.listdir(os.path.join(root, 'demo')) if not e.startswith('C')) == ['v2', 'v3']
+        print("✅ Model store publish / attach / swap OK")
+
+
+def test_shared_content_model_matches_per_request_fit():
+    recommender = CRAFFTASSISTRecommendationSystem.__new__(CRAFFTASSISTRecommendationSystem)
+    risk_mapping = recommender.create_risk_level_mapping()
+    catalog = make_catalog()
+    features = [f"{c['description']} {c['category_name']} {c['target_audience']}" for _, c in catalog.courses_df.iterrows()]
+
+    original_get_model_handle = content_model_module.get_model_handle
+    with tempfile.TemporaryDirectory() as root:
+        content_model_module.get_model_handle = lambda name: ModelHandle(ModelStore(root), name)
+        try:
+            model = get_course_content_model(catalog, risk_mapping)
+            assert model.shared  # worker đầu tiên fit + publish rồi đọc bản memmap
+            attached = get_course_content_model(make_catalog(), risk_mapping)
+            assert attached.version == model.version
+        finally:
+            content_model_module.get_model_handle = original_get_model_handle
+
+    for risk in ('low', 'medium', 'high', 'unknown'):
+        vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
+        tfidf = vectorizer.fit_transform(features)
+        profile = " ".join(risk_mapping.get(risk, risk_mapping['medium'])['course_topics'])
+        expected = cosine_similarity(vectorizer.transform([profile]), tfidf).ravel()
+        actual = cosine_similarity(attached.profile_vector(risk), attached.tfidf_matrix).ravel()
+        assert np.allclose(expected, actual), risk
+    print("✅ Shared TF-IDF model gives the same similarities as a per-request fit")
+
+
+def main():
+    test_publish_attach_and_atomic_swap()
+    test_shared_content_model_matches_per_request_fit()
+    print("🎯 Model store tests completed!")
+
+
+if __name__ == "__main__":
+    main()
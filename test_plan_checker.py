@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Test script for the loader query-plan checker (sqlite stand-in)
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from app.database.plan_checker import capture_routed_statements, check_query_plans
+from app.database.routing import BULK, POINT, routed
+
+
+def make_db():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE "Survey_Attempts" (id TEXT, user_id TEXT, completed_at TEXT)'))
+        conn.execute(text('CREATE TABLE "Course_Enrollment" (id TEXT, user_id TEXT, course_id TEXT)'))
+        conn.execute(text('CREATE INDEX idx_survey_attempts_user_completed ON "Survey_Attempts" (user_id, completed_at DESC)'))
+        for i in range(50):
+            conn.execute(text('INSERT INTO "Survey_Attempts" VALUES (:i, :u, :d)'), {'i': str(i), 'u': f'u{i % 5}', 'd': f'2024-01-{i % 28 + 1:02d}'})
+            conn.execute(text('INSERT INTO "Course_Enrollment" VALUES (:i, :u, :c)'), {'i': str(i), 'u': f'u{i % 5}', 'c': f'c{i % 7}'})
+    return sessionmaker(bind=engine)()
+
+
+def test_plan_checker_flags_unindexed_point_queries():
+    db = make_db()
+    with capture_routed_statements() as captured:
+        db.execute(routed('SELECT * FROM "Survey_Attempts" sa WHERE sa.user_id = :user_id ORDER BY sa.completed_at DESC', POINT), {'user_id': 'u1'}).fetchall()
+        db.execute(routed('SELECT * FROM "Course_Enrollment" WHERE user_id = :user_id', POINT), {'user_id': 'u1'}).fetchall()
+        db.execute(routed('SELECT course_id, COUNT(*) FROM "Course_Enrollment" GROUP BY course_id', BULK)).fetchall()
+        db.execute(text('SELECT * FROM "Course_Enrollment"')).fetchall()  # không annotate -> không check
+    assert len(captured) == 3
+
+    findings = check_query_plans(db, captured, min_rows=10)
+    print(f"📊 Findings: {findings}")
+    assert {(f['severity'], f['table']) for f in findings} == {('error', 'Course_Enrollment'), ('warning', 'Course_Enrollment')}
+    assert check_query_plans(db, captured, min_rows=1000) == []  # bảng nhỏ không bị flag
+    print("✅ Plan checker OK")
+
+
+def main():
+    test_plan_checker_flags_unindexed_point_queries()
+    print("🎯 Plan checker tests completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Test script for per-request profiling (stage timings, top functions, SQL capture)
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import Response
+from sqlalchemy import create_engine, text
+from app.service import profiling
+from app.service.metrics import stage_timer
+from app.service.profiling import profiled_endpoint, run_profiled
+from app.service.result_cache import RecommendationResultCache
+
+
+def slow_pipeline(engine):
+    with stage_timer("load", engine="test"):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1")).fetchall()
+    with stage_timer("score", engine="test"):
+        return sum(i * i for i in range(10000))
+
+
+def test_run_profiled_collects_stages_functions_and_sql():
+    engine = create_engine("sqlite://")
+    result, profile = run_profiled(slow_pipeline, engine)
+
+    assert result == sum(i * i for i in range(10000))
+    assert [stage['stage'] for stage in profile['stages']] == ['load', 'score']
+    assert profile['sql']['count'] == 1
+    assert profile['sql']['statements'][0]['statement'] == 'SELECT 1'
+    assert any('slow_pipeline' in fn['function'] for fn in profile['top_functions'])
+    print(f"📊 Profile total: {profile['total_ms']:.2f}ms, SQL: {profile['sql']['total_ms']:.3f}ms")
+
+    # Ngoài profiling mode không thu SQL
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 2")).fetchall()
+    assert profile['sql']['count'] == 1
+    print("✅ Profiling capture OK")
+
+
+def test_profiled_endpoint_keeps_headers_and_skips_result_cache():
+    cache = RecommendationResultCache()
+    key = cache.key('u1')
+    cache.put(key, {'status': 'success', 'courses': [{'course_id': 'cached'}]})
+
+    def endpoint(user_id, response: Response):
+        response.headers["ETag"] = '"abc"'
+        response.headers["Cache-Control"] = "private, max-age=60"
+        cached = cache.get(key)
+        return cached or {'status': 'success', 'courses': [{'course_id': 'fresh'}]}
+
+    assert profiled_endpoint(endpoint)('u1', response=Response())['courses'][0]['course_id'] == 'cached'
+    token = profiling._profile_mode.set("1")
+    try:
+        profiled = profiled_endpoint(endpoint)('u1', response=Response())
+    finally:
+        profiling._profile_mode.reset(token)
+    assert profiled.headers["ETag"] == '"abc"' and profiled.headers["Cache-Control"] == "private, max-age=60"
+    assert b'"fresh"' in profiled.body and profiled.headers["content-type"] == "application/json"
+    print("✅ Profiled response keeps endpoint headers and bypasses the result cache")
+
+
+def main():
+    test_run_profiled_collects_stages_functions_and_sql()
+    test_profiled_endpoint_keeps_headers_and_skips_result_cache()
+    print("🎯 Profiling tests completed!")
+
+
+if __name__ == "__main__":
+    main()
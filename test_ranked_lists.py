@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test script for cursor pagination backed by cached ranked lists
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.service.data_version import invalidate_user
+from app.service.ranked_lists import (InvalidCursorError, RANKED_LIST_SIZE, decode_cursor, encode_cursor,
+                                      paginate, ranked_lists)
+
+
+class CountingRanker:
+    """compute_top giả: ranking 'c0', 'c1', ... (prefix ổn định), ghi lại các top_k được tính"""
+
+    def __init__(self, total=300, prefix='c'):
+        self.total = total
+        self.prefix = prefix
+        self.calls = []
+
+    def __call__(self, top_k):
+        self.calls.append(top_k)
+        return [{'course_id': f'{self.prefix}{i}', 'score': 1.0 - i / 1000} for i in range(min(top_k, self.total))]
+
+
+def _ids(page):
+    return [item['course_id'] for item in page['items']]
+
+
+def test_pages_are_slices_of_one_ranked_list():
+    ranked_lists.clear()
+    ranker = CountingRanker()
+    first = paginate('u1', 'courses', ('content',), 5, None, ranker)
+    assert _ids(first) == [f'c{i}' for i in range(5)] and ranker.calls == [5]  # trang đầu không tính list sâu
+
+    seen = _ids(first)
+    cursor = first['next_cursor']
+    while cursor is not None:
+        page = paginate('u1', 'courses', ('content',), 5, cursor, ranker)
+        seen.extend(_ids(page))
+        cursor = page['next_cursor']
+    assert seen == [f'c{i}' for i in range(RANKED_LIST_SIZE)]
+    assert ranker.calls == [5, RANKED_LIST_SIZE]  # mọi trang sau cắt từ một lần tính
+    print(f"✅ {len(seen) // 5} pages served from {len(ranker.calls)} computations: {ranked_lists.stats()}")
+
+
+def test_cursor_pins_list_across_invalidation():
+    ranked_lists.clear()
+    old = CountingRanker(prefix='old')
+    page = paginate('u2', 'consultants', (), 3, encode_cursor(None, 3), old)
+    assert _ids(page) == ['old3', 'old4', 'old5']
+
+    invalidate_user('u2')  # dữ liệu của user đổi: trang mới tính lại, cursor đang lật vẫn cắt list cũ
+    new = CountingRanker(prefix='new')
+    assert _ids(paginate('u2', 'consultants', (), 3, page['next_cursor'], new)) == ['old6', 'old7', 'old8']
+    assert new.calls == []
+    assert _ids(paginate('u2', 'consultants', (), 3, encode_cursor(None, 3), new)) == ['new3', 'new4', 'new5']
+    assert _ids(paginate('u2', 'consultants', (), 3, None, new)) == ['new0', 'new1', 'new2']
+    assert new.calls == [RANKED_LIST_SIZE]
+
+
+def test_short_list_and_invalid_cursor():
+    ranked_lists.clear()
+    ranker = CountingRanker(total=4)
+    first = paginate('u3', 'courses', ('two_stage',), 5, None, ranker)
+    assert len(first['items']) == 4 and first['next_cursor'] is None
+    assert decode_cursor(encode_cursor('abc', 10)) == ('abc', 10)
+    for cursor in ('not-a-cursor', encode_cursor(None, -1)):
+        try:
+            paginate('u3', 'courses', ('two_stage',), 5, cursor, ranker)
+        except InvalidCursorError:
+            continue
+        raise AssertionError(f"expected InvalidCursorError for {cursor}")
+
+
+def main():
+    test_pages_are_slices_of_one_ranked_list()
+    test_cursor_pins_list_across_invalidation()
+    test_short_list_and_invalid_cursor()
+    print("🎯 Ranked list pagination tests completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Test script for the per-user recommendation result cache
+"""
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.service import recommendation_action
+from app.service.catalog import invalidate_catalog
+from app.service.data_version import get_recommendation_versions, invalidate_user
+from app.service.result_cache import (RecommendationResultCache, ResultRefresher, estimate_size,
+                                      recommendation_result_cache, result_refresher)
+from test_stage_graph import FakeRecommender
+
+
+def _result(n=3):
+    return {'status': 'success', 'courses': [{'course_id': f'c{i}'} for i in range(n)], 'consultants': []}
+
+
+def test_lru_bytes_and_user_invalidation():
+    size = estimate_size(_result())
+    cache = RecommendationResultCache(max_size=10, max_bytes=size * 3, ttl_seconds=60)
+    for user in ('u1', 'u2', 'u3'):
+        assert cache.put(cache.key(user, 'a'), _result())
+    assert cache.stats()['bytes'] == size * 3
+
+    cache.get(cache.key('u1', 'a'))                 # u1 mới dùng -> u2 là LRU
+    cache.put(cache.key('u4', 'a'), _result())
+    assert cache.get(cache.key('u2', 'a')) is None and cache.stats()['evictions'] == 1
+
+    cache.invalidate_user('u4')
+    cache.put(cache.key('u1', 'b'), _result())
+    cache.invalidate_user('u1')
+    assert cache.get(cache.key('u1', 'a')) is None and cache.get(cache.key('u1', 'b')) is None
+    assert cache.get(cache.key('u3', 'a')) is not None
+
+    # Lỗi / thiếu stage không được cache
+    assert not cache.put(cache.key('u5'), {'status': 'error', 'message': 'boom'})
+    assert not cache.put(cache.key('u5'), {**_result(), 'skipped_stages': ['collaborative']})
+    print(f"✅ Result cache bounded by bytes, invalidated per user: {cache.stats()}")
+
+
+def test_ttl_and_catalog_change():
+    cache = RecommendationResultCache(ttl_seconds=0.01)
+    cache.put(cache.key('u1'), _result())
+    time.sleep(0.02)
+    assert cache.get(cache.key('u1')) is None
+
+    cache = RecommendationResultCache()
+    cache.put(cache.key('u1'), _result(), data_version='d1')
+    assert cache.lookup(cache.key('u1'), data_version='d1')[0] is not None
+    assert cache.lookup(cache.key('u1'))[0] is not None                       # không kiểm tra version
+    assert cache.lookup(cache.key('u1'), data_version='d2') == (None, False)  # user data đổi -> miss
+    assert cache.get(cache.key('u1')) is None
+
+    cache = RecommendationResultCache()
+    cache.on_catalog_change('v1')
+    cache.put(cache.key('u1'), _result())
+    cache.on_catalog_change('v1')
+    assert cache.get(cache.key('u1')) is not None
+    cache.on_catalog_change('v2')
+    assert cache.get(cache.key('u1')) is None and cache.stats()['catalog_invalidations'] == 1
+
+
+class CountingRecommender(FakeRecommender):
+    instances = 0
+
+    def __init__(self, db_session=None, interaction_snapshot=None):
+        super().__init__()
+        CountingRecommender.instances += 1
+
+
+class VersionedSession:
+    """Session giả: chỉ trả lời query catalog version và user data version"""
+
+    def __init__(self):
+        self.version = (10, 'v1', 2, 'v1', 3, 'v1')
+        self.user_version = (1, 'd1', 0, None, None, 0, None)
+
+    def execute(self, statement, params=None):
+        self.queries = getattr(self, 'queries', 0) + 1
+        version = self.user_version if 'Survey_Attempts' in str(statement) else self.version
+        return type('Result', (), {'fetchone': staticmethod(lambda: version)})()
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_get_user_recommendations_uses_cache():
+    recommendation_result_cache.clear()
+    original = recommendation_action.CRAFFTASSISTRecommendationSystem
+    recommendation_action.CRAFFTASSISTRecommendationSystem = CountingRecommender
+    CountingRecommender.instances = 0
+    db = VersionedSession()
+    try:
+        first = recommendation_action.get_user_recommendations('u8', 's1', 7, 'high', db)
+        assert first['status'] == 'success'
+        assert recommendation_action.get_user_recommendations('u8', 's1', 7, 'high', db) is first
+        assert CountingRecommender.instances == 1
+
+        recommendation_action.get_user_recommendations('u8', 's2', 7, 'high', db)  # params khác
+        assert CountingRecommender.instances == 2
+
+        invalidate_user('u8')
+        recommendation_action.get_user_recommendations('u8', 's1', 7, 'high', db)
+        assert CountingRecommender.instances == 3
+
+        db.version = (11, 'v2', 2, 'v1', 3, 'v1')  # course mới -> catalog version đổi
+        recommendation_action.get_user_recommendations('u8', 's1', 7, 'high', db)
+        assert CountingRecommender.instances == 4
+
+        # Data của user đổi nhưng invalidate_user không chạy ở process này (worker khác nhận event)
+        db.user_version = (2, 'd2', 0, None, None, 0, None)
+        recommendation_action.get_user_recommendations('u8', 's1', 7, 'high', db)
+        assert CountingRecommender.instances == 5
+        recommendation_action.get_user_recommendations('u8', 's1', 7, 'high', db)
+        assert CountingRecommender.instances == 5
+
+        # Route đã đọc versions cho ETag -> cache hit không query lại
+        versions = get_recommendation_versions(db, 'u8')
+        db.queries = 0
+        recommendation_action.get_user_recommendations('u8', 's1', 7, 'high', db, versions=versions)
+        assert CountingRecommender.instances == 5 and db.queries == 0
+
+        invalidate_catalog()
+        assert recommendation_result_cache.stats()['size'] == 0
+    finally:
+        recommendation_action.CRAFFTASSISTRecommendationSystem = original
+    print(f"✅ get_user_recommendations served repeats from cache: {recommendation_result_cache.stats()}")
+
+
+def test_stale_while_revalidate_dedupes_refreshes():
+    cache = RecommendationResultCache(ttl_seconds=0.01, max_stale_seconds=60)
+    refresher = ResultRefresher(cache, workers=1)
+    sessions = []
+    refresher.start(lambda: sessions.append(VersionedSession()) or sessions[-1])
+    release = threading.Event()
+    calls = []
+
+    def compute(db):
+        calls.append(db)
+        release.wait(5)
+        return _result(5)
+
+    key = cache.key('u1')
+    try:
+        cache.put(key, _result())
+        time.sleep(0.02)
+        stale, is_stale = cache.lookup(key, allow_stale=True)
+        assert is_stale and len(stale['courses']) == 3
+
+        assert refresher.submit(key, compute) and refresher.submit(key, compute)
+        cache.ttl_seconds = 60
+        release.set()
+        for _ in range(100):
+            if refresher.stats()['pending'] == 0:
+                break
+            time.sleep(0.01)
+        assert len(calls) == 1 and refresher.stats()['deduplicated'] == 1
+        assert len(cache.lookup(key)[0]['courses']) == 5  # bản mới, còn hạn
+        assert calls[0] is sessions[0]                     # session riêng của background job
+
+        # Quá max staleness -> miss
+        cache.ttl_seconds = cache.max_stale_seconds = 0.01
+        time.sleep(0.03)
+        assert cache.lookup(key, allow_stale=True) == (None, False)
+    finally:
+        release.set()
+        refresher.stop()
+    print(f"✅ Stale entry served while one deduplicated refresh ran: {refresher.stats()}")
+
+
+def test_refresh_after_invalidation_is_discarded():
+    cache = RecommendationResultCache()
+    key = cache.key('u9')
+    token = cache.token(key)
+    invalidate_user('u9')                  # user đổi dữ liệu trong lúc đang tính
+    assert not cache.put(key, _result(), token)
+    assert cache.put(key, _result(), cache.token(key))
+    assert cache.stats()['discarded'] == 1
+
+
+def test_get_user_recommendations_serves_stale():
+    recommendation_result_cache.clear()
+    original = recommendation_action.CRAFFTASSISTRecommendationSystem
+    original_ttl = recommendation_result_cache.ttl_seconds
+    recommendation_action.CRAFFTASSISTRecommendationSystem = CountingRecommender
+    CountingRecommender.instances = 0
+    db = VersionedSession()
+    result_refresher.start(VersionedSession)
+    try:
+        first = recommendation_action.get_user_recommendations('u10', 's1', 7, 'high', db)
+        recommendation_result_cache.ttl_seconds = 0
+        time.sleep(0.01)
+        assert recommendation_action.get_user_recommendations('u10', 's1', 7, 'high', db) is first
+        for _ in range(100):
+            if result_refresher.stats()['pending'] == 0:
+                break
+            time.sleep(0.01)
+        assert CountingRecommender.instances == 2 and result_refresher.stats()['completed'] >= 1
+    finally:
+        result_refresher.stop()
+        recommendation_result_cache.ttl_seconds = original_ttl
+        recommendation_action.CRAFFTASSISTRecommendationSystem = original
+
+
+def main():
+    test_lru_bytes_and_user_invalidation()
+    test_ttl_and_catalog_change()
+    test_get_user_recommendations_uses_cache()
+    test_stale_while_revalidate_dedupes_refreshes()
+    test_refresh_after_invalidation_is_discarded()
+    test_get_user_recommendations_serves_stale()
+    print("🎯 Result cache tests completed!")
+
+
+if __name__ == "__main__":
+    main()
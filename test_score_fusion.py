@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Test script for the vectorized hybrid score fuser
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from app.service.score_fusion import EngineScores, fuse_scores, stable_top_k
+from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem
+
+
+def test_fuse_aligns_ids_and_records_provenance():
+    fused = fuse_scores([
+        EngineScores('content_based', np.array(['a', 'b', 'c'], dtype=object), np.array([0.9, 0.4, 0.2])),
+        EngineScores('collaborative', np.array(['c', 'd', 'c'], dtype=object), np.array([0.6, 0.8, 0.7])),
+    ], {'content_based': 0.5, 'collaborative': 0.5}, top_k=3)
+
+    assert list(fused.item_ids) == ['a', 'c', 'd']
+    assert np.allclose(fused.scores, [0.45, 0.45, 0.4])  # tie a/c -> thứ tự xuất hiện
+    assert fused.sources(1) == ['content_based', 'collaborative']
+    assert fused.provenance(1)['collaborative'] == {'score': 0.7, 'normalized': 0.7, 'contribution': 0.35}
+    assert fused.unique_items == 4
+    print("✅ Fusion aligned ids, took max per engine and kept provenance")
+
+
+def test_normalization_and_extra_engine():
+    fused = fuse_scores([
+        EngineScores('content_based', np.array(['a', 'b'], dtype=object), np.array([2.0, 1.0])),
+        EngineScores('collaborative', np.array(['b'], dtype=object), np.array([0.5])),
+        EngineScores('popularity', np.array(['c', 'a'], dtype=object), np.array([10.0, 5.0])),
+    ], {'content_based': 1.0, 'collaborative': 1.0, 'popularity': 1.0}, top_k=10,
+        normalization={'content_based': 'max', 'popularity': 'minmax'})
+    scores = dict(zip(fused.item_ids, fused.scores))
+    assert np.isclose(scores['a'], 1.0 + 0.0) and np.isclose(scores['b'], 0.5 + 0.5) and np.isclose(scores['c'], 1.0)
+
+
+def test_stable_top_k_matches_sorted():
+    rng = np.random.default_rng(0)
+    scores = rng.integers(0, 5, 200).astype(float)
+    expected = sorted(range(200), key=lambda i: -scores[i])[:17]
+    assert list(stable_top_k(scores, 17)) == expected
+
+
+def test_hybrid_merge_keeps_record_fields():
+    content = [{'course_id': 'c1', 'title': 'A', 'score': 0.8, 'recommendation_type': 'content_based'},
+               {'course_id': 'c2', 'title': 'B', 'score': 0.0, 'recommendation_type': 'content_based'}]
+    collab = [{'course_id': 'c1', 'title': 'A', 'similarity_score': 0.4, 'recommendation_type': 'collaborative', 'source_user': 'u9'}]
+    merged, unique = CRAFFTASSISTRecommendationSystem._fuse_recommendations(
+        'course_id', {'content_based': content, 'collaborative': collab}, 5)
+    assert unique == 2
+    assert merged[0]['recommendation_type'] == 'content_based' and merged[0]['similarity_score'] == 0.4
+    assert merged[0]['recommendation_source'] == 'both' and np.isclose(merged[0]['hybrid_score'], 0.6)
+    assert merged[1]['recommendation_source'] == 'collaborative' and merged[1]['hybrid_score'] == 0.0
+    assert content[0] == {'course_id': 'c1', 'title': 'A', 'score': 0.8, 'recommendation_type': 'content_based'}
+
+
+def main():
+    test_fuse_aligns_ids_and_records_provenance()
+    test_normalization_and_extra_engine()
+    test_stable_top_k_matches_sorted()
+    test_hybrid_merge_keeps_record_fields()
+    print("🎯 Score fusion tests completed!")
+
+
+if __name__ == "__main__":
+    main()
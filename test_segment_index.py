@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test script for the (risk_level, category_id) survey segment index
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from types import SimpleNamespace
+
+from app.service.data_version import get_user_generation
+from app.service.segment_index import SurveySegmentIndex, poll_segment_index
+
+
+def test_segment_lookup():
+    """Segment lookup phải trả đúng users giống filter trên user_surveys DataFrame"""
+    print("🧪 Testing survey segment index")
+    index = SurveySegmentIndex()
+    index.record_attempt('u1', 'high', 'cat-a')
+    index.record_attempt('u2', 'high', 'cat-a')
+    index.record_attempt('u3', 'high', 'cat-b')
+    index.record_attempt('u4', 'low', 'cat-a')
+    index.record_attempt('u1', 'low', 'cat-b')
+
+    assert sorted(index.users_in_segment('high', 'cat-a')) == ['u1', 'u2']
+    assert sorted(index.users_in_segment('high', 'cat-a', exclude_user='u1')) == ['u2']
+    assert sorted(index.users_with_risk('high')) == ['u1', 'u2', 'u3']
+    assert sorted(index.users_with_risk('low', exclude_user='u4')) == ['u1']
+    assert len(index.users_in_segment('medium', 'cat-a')) == 0
+    print(f"   Segments: {index.segment_sizes()}")
+    print("✅ Segment lookup OK")
+
+
+def test_record_attempt_is_idempotent():
+    """Attempt lặp lại không đổi membership"""
+    index = SurveySegmentIndex()
+    assert index.record_attempt('u1', 'medium', 'cat-a', created_at=1)
+    assert not index.record_attempt('u1', 'medium', 'cat-a', created_at=2)
+    assert list(index.users_in_segment('medium', 'cat-a')) == ['u1']
+    assert index.watermark == 2
+    assert len(index) == 1
+    print("✅ record_attempt idempotent")
+
+
+class AttemptSession:
+    """Session giả: trả về các attempts cố định cho mọi query"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, statement, params=None):
+        rows = self.rows
+        return SimpleNamespace(fetchall=lambda: rows)
+
+
+def test_poll_invalidates_only_new_attempts():
+    """Rows bằng watermark được đọc lại mỗi lần poll nhưng không invalidate user lại"""
+    index = SurveySegmentIndex()
+    index.record_attempt('p1', 'high', 'cat-a', created_at=5)
+    rows = [SimpleNamespace(user_id='p1', risk_level='high', category_id='cat-a', created_at=5),
+            SimpleNamespace(user_id='p2', risk_level='low', category_id='cat-a', created_at=6)]
+    before = get_user_generation('p1'), get_user_generation('p2')
+    poll_segment_index(AttemptSession(rows), index)
+    assert (get_user_generation('p1'), get_user_generation('p2')) == (before[0], before[1] + 1)
+
+    poll_segment_index(AttemptSession(rows[1:]), index)  # watermark = 6 -> không có gì mới
+    assert get_user_generation('p2') == before[1] + 1
+    assert sorted(index.users_with_risk('low')) == ['p2']
+    print("✅ Poll invalidates only attempts past the watermark")
+
+
+def main():
+    test_segment_lookup()
+    test_record_attempt_is_idempotent()
+    test_poll_invalidates_only_new_attempts()
+    print("🎯 Segment index tests completed!")
+
+
+if __name__ == "__main__":
+    main()
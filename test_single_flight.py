@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Test script for single-flight coalescing of concurrent identical requests
+"""
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.service.single_flight import SingleFlight
+
+
+def run_concurrently(flight, key, fn, n):
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def test_concurrent_duplicates_share_one_computation():
+    flight = SingleFlight(timeout_seconds=5)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'courses': ['c1']}
+
+    results, errors = run_concurrently(flight, ('courses', 'u1', 5), compute, 8)
+    stats = flight.stats()
+    print(f"📊 Single-flight stats: {stats}")
+    assert not errors
+    assert len(calls) == 1
+    assert results == [{'courses': ['c1']}] * 8
+    assert stats['leaders'] == 1 and stats['coalesced'] == 7 and stats['in_flight'] == 0
+    print("✅ Duplicates coalesced")
+
+
+def test_error_propagates_and_key_is_released():
+    flight = SingleFlight(timeout_seconds=5)
+
+    def fail():
+        time.sleep(0.1)
+        raise ValueError("db down")
+
+    results, errors = run_concurrently(flight, 'k', fail, 4)
+    assert not results and len(errors) == 4
+    assert flight.do('k', lambda: 42) == 42  # key không bị kẹt sau lỗi
+    print("✅ Errors propagate to followers")
+
+
+def test_follower_timeout_computes_locally():
+    flight = SingleFlight(timeout_seconds=0.05)
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: flight.do('slow', lambda: release.wait(2) and 'leader'))
+    leader.start()
+    time.sleep(0.05)
+    assert flight.do('slow', lambda: 'local') == 'local'
+    release.set()
+    leader.join()
+    assert flight.stats()['timeouts'] == 1
+    print("✅ Follower timeout falls back to local computation")
+
+
+def main():
+    test_concurrent_duplicates_share_one_computation()
+    test_error_propagates_and_key_is_released()
+    test_follower_timeout_computes_locally()
+    print("🎯 Single-flight tests completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Test script for the per-request recommendation stage graph
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.service import stage_graph
+from app.service.stage_graph import Stage, StageGraph, unranked
+from app.service.recommendation_action import CRAFFTASSISTRecommendationSystem, RECOMMENDATION_STAGES
+
+
+class FakeRecommender(CRAFFTASSISTRecommendationSystem):
+    """Engines giả: ghi lại mỗi lần gọi để kiểm tra số lần tính"""
+
+    def __init__(self):
+        self.calls = []
+
+    def has_interactions(self, user_id, item_type=None):
+        return True
+
+    def get_user_risk_summary(self, user_id):
+        self.calls.append(('risk', None))
+        return {'latest_risk_level': 'high'}
+
+    def content_based_course_recommendations(self, user_id, top_k=5):
+        self.calls.append(('content_courses', top_k))
+        return [{'course_id': f'c{i}', 'score': 1.0 - i * 0.01} for i in range(top_k)]
+
+    def content_based_consultant_recommendations(self, user_id, top_k=3):
+        self.calls.append(('content_consultants', top_k))
+        return [{'consultant_id': f'k{i}', 'score': 1.0 - i * 0.1} for i in range(top_k)]
+
+    def collaborative_filtering_recommendations(self, user_id, top_k=5, engine=None, user_risk_info=None):
+        self.calls.append(('collaborative', top_k))
+        assert user_risk_info == {'latest_risk_level': 'high'}
+        courses = [{'course_id': f'c{i}', 'similarity_score': 0.5} for i in range(0, top_k, 2)]
+        consultants = [{'consultant_id': 'k1', 'similarity_score': 0.9}]
+        return {'courses': courses, 'consultants': consultants, 'user_risk_info': user_risk_info,
+                'recommendation_summary': {'total_courses': len(courses), 'total_consultants': 1}}
+
+
+def test_graph_rejects_undeclared_inputs():
+    try:
+        StageGraph([Stage('b', lambda r, u, k, a: a, inputs={'a': unranked})])
+    except ValueError:
+        print("✅ Stage graph rejects inputs that are not declared first")
+        return
+    raise AssertionError("expected ValueError")
+
+
+def test_demo_computes_each_stage_once():
+    recommender = FakeRecommender()
+    executor = recommender.stage_executor('u1')
+
+    hybrid = recommender.hybrid_recommendations('u1', 10, executor=executor)
+    assert hybrid['status'] == 'success' and len(hybrid['courses']) == 10
+    assert hybrid['user_risk_info'] == {'latest_risk_level': 'high'}
+
+    # Các phần còn lại của /demo: lấy từ memo (prefix của top 20 / top 6)
+    assert executor.run('risk_summary') is hybrid['user_risk_info']
+    assert [c['course_id'] for c in executor.run('content_courses', 5)] == ['c0', 'c1', 'c2', 'c3', 'c4']
+    collaborative = executor.run('collaborative', 5)
+    assert len(collaborative['courses']) == 5 and collaborative['recommendation_summary']['total_courses'] == 5
+    assert len(executor.run('content_consultants', 3)) == 3
+    assert executor.run('hybrid', 10) is hybrid
+
+    assert sorted(recommender.calls) == sorted([
+        ('risk', None), ('content_courses', 20), ('content_consultants', 6), ('collaborative', 20)
+    ])
+    assert executor.stats()['reused'] >= 5
+    print(f"✅ Demo pipeline computed {len(recommender.calls)} engine stages once each: {executor.stats()}")
+
+
+def test_larger_top_k_recomputes():
+    recommender = FakeRecommender()
+    executor = RECOMMENDATION_STAGES.executor(recommender, 'u1')
+    executor.run('content_courses', 3)
+    assert len(executor.run('content_courses', 8)) == 8
+    assert len(executor.run('content_courses', 2)) == 2
+    assert recommender.calls == [('content_courses', 3), ('content_courses', 8)]
+
+
+class SlowCollaborativeRecommender(FakeRecommender):
+    def collaborative_filtering_recommendations(self, user_id, top_k=5, engine=None, user_risk_info=None):
+        time.sleep(0.05)
+        return super().collaborative_filtering_recommendations(user_id, top_k, engine, user_risk_info)
+
+
+def test_deadline_skips_expensive_stage():
+    stage_graph._stage_costs.clear()
+    recommender = SlowCollaborativeRecommender()
+
+    # Chưa có ước lượng -> collaborative vẫn chạy, kết quả đủ
+    full = recommender.hybrid_recommendations('u1', 4, deadline_ms=1000)
+    assert full['skipped_stages'] == [] and not full['deadline_exceeded']
+    assert stage_graph.expected_stage_cost('collaborative') >= 0.05
+
+    # Budget nhỏ hơn chi phí ước lượng -> bỏ qua collaborative, vẫn trả về content-based đã merge
+    recommender.calls.clear()
+    partial = recommender.hybrid_recommendations('u1', 4, deadline_ms=20)
+    assert partial['status'] == 'success' and partial['skipped_stages'] == ['collaborative']
+    assert [c['course_id'] for c in partial['courses']] == ['c0', 'c1', 'c2', 'c3']
+    assert all(c['recommendation_source'] == 'content_based' for c in partial['courses'])
+    assert ('collaborative', 8) not in recommender.calls
+    assert partial['recommendation_summary']['collaborative_courses'] == 0
+
+    # Không deadline -> không có field deadline
+    assert 'skipped_stages' not in recommender.hybrid_recommendations('u1', 4)
+    print(f"✅ Deadline dropped the collaborative stage and returned the content-based merge: {stage_graph.stage_costs()}")
+
+
+def test_skipped_stage_estimate_decays():
+    stage_graph._stage_costs.clear()
+    stage_graph.observe_stage_cost('collaborative', 1.0)
+    recommender = FakeRecommender()
+    skipped = 0
+    for _ in range(40):
+        result = recommender.hybrid_recommendations('u1', 4, deadline_ms=100)
+        if result['skipped_stages'] != ['collaborative']:
+            break
+        skipped += 1
+    assert 0 < skipped < 40, skipped
+
+
+def main():
+    test_graph_rejects_undeclared_inputs()
+    test_demo_computes_each_stage_once()
+    test_larger_top_k_recomputes()
+    test_deadline_skips_expensive_stage()
+    test_skipped_stage_estimate_decays()
+    print("🎯 Stage graph tests completed!")
+
+
+if __name__ == "__main__":
+    main()